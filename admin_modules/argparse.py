@@ -34,18 +34,79 @@ def run():
     parser.add_option("-n", "--modules", dest="nr_modules", default=1,
             help="set number of pipeline stages to run (1: edge detection; 2: ellipse fitting; 3: pose-1; 4: identify markers; 5: pose-2; 6: register data), default is all",
             type="int")
+    parser.add_option("-j", "--workers", dest="workers", default=0,
+            help="set number of worker processes that run the pipeline stages on successive frames in parallel (0: run in main process [default])",
+            type="int")
+    parser.add_option("-k", "--track", dest="track",
+            help="search for contours only around the ellipses found in the previous image, with a full image search every TRACK images and whenever no ellipses were found (0: off [default])",
+            type="int")
+    parser.add_option("--pyramid", dest="pyramid", default=1,
+            help="search for contours in an image decimated by the given factor first, then only around them at full resolution (1: off [default]; 2: half; 4: quarter resolution)",
+            type="int")
+    parser.add_option("--filter", dest="filter", default=0,
+            help="follow a single marker's pose over successive images with a constant velocity filter, which resolves the ambiguity of the estimates, records the filtered pose, seeds the -k search region, and skips the pose solve when its predicted ellipse matches the image (0: off [default]; 1: on; needs -n 3 or more)",
+            type="int")
+    parser.add_option("--prefilter", dest="prefilter", action="store_true",
+            default=False,
+            help="reject implausible contours before fitting ellipses to them, which saves most fits in cluttered images but also loses markers seen at a steep angle (default: off)")
     parser.add_option("-s", "--simulate", dest="simulate",
-            help="set simulation mode (-2: linear generated markers; -1: random generated markers; 0<:preset marker configurations by index nr)",
+            help="set simulation mode (-3: marker poses from the --poses file; -2: linear generated markers; -1: random generated markers; 0<:preset marker configurations by index nr)",
+            type="int")
+    parser.add_option("--headless", dest="headless", action="store_true",
+            default=False,
+            help="render simulated images offscreen, in software (OSMesa), without a window or display server")
+    parser.add_option("--poses", dest="poses",
+            help="set the pose table (.npy) that -s -3 streams marker poses from, e.g. a sweep's output/sweep/poses.npy",
+            type="string")
+    parser.add_option("--range", dest="range",
+            help="stream only the poses START:STOP of the pose table; with -d, print only the outputs START:STOP (default: all)",
+            type="string")
+    parser.add_option("--renderer", dest="renderer", type="choice",
+            choices=["gl", "numpy"], default="gl",
+            help="set the renderer of simulated images (gl: OpenGL [default]; numpy: analytic rendering without OpenGL, offscreen)")
+    parser.add_option("--sweep", dest="sweep",
+            help="run a batch accuracy study of SWEEP generated poses (with -s -1 or -2) in a pool of -j worker processes (default: one per cpu), resuming any interrupted sweep with the same parameters; results go to output/sweep/results.npy",
+            type="int")
+    parser.add_option("--seed", dest="seed",
+            help="set the seed of the random pose generator, for reproducible poses (default: unseeded; 0 for sweeps)",
+            type="int")
+    parser.add_option("--chunk", dest="chunk", default=100,
+            help="set the number of poses per sweep chunk, the unit of work and of resumption (default: 100)",
             type="int")
     parser.add_option("-w", "--windows", dest="windows",
             help="set image display (0: off; 1: on [default])",
             type="int")
+    parser.add_option("--refresh", dest="refresh", default=30,
+            help="set the maximum refresh rate (per second) of the image display, which runs alongside the pipeline and skips images it has no time for (default: 30)",
+            type="int")
     parser.add_option("-d", "--disk", dest="disk",
-            help="load marker poses from disk (0: off [default]; 1: on)",
+            help="print the outputs of a previous run from disk, read lazily, without running the pipeline (0: off [default]; 1: on); see --replay and --range",
             type="int")
+    parser.add_option("-z", "--zerocopy", dest="zerocopy",
+            help="process camera images in place in the camera's DMA buffers (0: off [default]; 1: on)",
+            type="int")
+    parser.add_option("--capture", dest="capture", type="choice",
+            choices=["sample", "newest", "drop-oldest", "lossless"], default="sample",
+            help="set the camera capture policy (sample: the current image when the pipeline is ready [default]; newest: the newest image not yet processed; drop-oldest: a queue of QUEUE images that drops the oldest when full; lossless: every image, in an unbounded queue)")
+    parser.add_option("--queue", dest="queue", default=4,
+            help="set the queue size of the drop-oldest capture policy (default: 4; at most 2 with -z)",
+            type="int")
+    parser.add_option("-r", "--record", dest="record",
+            help="stream outputs to output/outputs.rec, writing them to disk every RECORD outputs, instead of keeping all outputs in memory and recording them at exit (0: off [default]); use with -d to read recorded outputs",
+            type="int")
+    parser.add_option("--replay", dest="replay",
+            help="set the recording directory or sweep result table (e.g. output/sweep/results.npy) that -d reads outputs from (default: output/outputs.rec, or output/outputs.pickle from older runs)",
+            type="string")
     parser.add_option("-t", "--simtime", dest="simtime",
             help="number of seconds to run simulation (default: 60)",
             type="int")
+    parser.add_option("--report", dest="report",
+            help="write the printout to the given directory instead of showing it: the plots as png files, rendered in a pool of -j worker processes (default: one per cpu), and the stats as stats.json and stats.csv",
+            type="string")
+
+    parser.add_option("--trace", dest="trace",
+            help="write the per-frame latencies of the pipeline stages to the given csv file",
+            type="string")
 
     (options, args) = parser.parse_args()
 
@@ -55,4 +116,17 @@ def run():
     if not options.simulate:
         options.simulate = 0
 
+    if options.simulate == -3 and not options.poses:
+        parser.error('simulation mode -3 requires a pose table (--poses)')
+
+    if options.zerocopy and options.capture == 'lossless':
+        parser.error('the lossless capture policy cannot be used with -z: its unbounded queue would hold every DMA buffer')
+
+    if options.range:
+        try:
+            first, _, stop = options.range.partition(':')
+            options.range = (int(first or 0), int(stop) if stop else None)
+        except ValueError:
+            parser.error('invalid pose range: %s' % options.range)
+
     return options, args
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# bench_contour.py
+"""
+:synopsis:  Times ContourFinder and EllipseFitter on rendered simulator
+            images, at full resolution and in pyramid mode with decimation
+            factors 2 and 4, and measures the recall of the ellipses found at
+            full resolution. Run from the project root with:
+            python -m admin_modules.bench_contour
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import time
+import numpy as np
+
+from pipeline_modules import ContourFinder, EllipseFitter
+from simulator import Marker_Renderer
+from simulator.frame_ring import Marker_Packer
+from simulator.pose_generator import Random_Pose_Generator
+from output import Pipeline_Output
+from camera_values import GL_Camera_Vals
+
+
+class Bench_Options(object):
+    """ the options read by ContourFinder, for the given decimation factor """
+
+    def __init__(self, pyramid = 1):
+
+        self.pyramid = pyramid
+        self.track = 0
+        self.simulate = -1
+
+
+class Bench_Pipeline(object):
+    """ holds the attributes that ContourFinder and EllipseFitter expect """
+
+    def __init__(self, pyramid = 1):
+        """ sets the options and the modules """
+
+        self.options = Bench_Options(pyramid)
+        self.init_output = Pipeline_Output(sim = True)
+        self.init_output.cam = GL_Camera_Vals()
+        self.outputs = [self.init_output]
+        self.ellipses = None
+        self.orig = None
+        self.canv = None
+        self.modules = []
+        self.modules.append(ContourFinder(pipeline = self))
+        self.modules.append(EllipseFitter(pipeline = self))
+
+
+    def process(self, image, output):
+        """ runs the modules on the given image; returns the ellipses """
+
+        self.outputs = [output]
+        self.orig = image
+        self.canv = np.copy(image)
+        for module in self.modules:
+            module.run()
+        return self.ellipses
+
+
+def simulated_frames(n, seed = 0):
+    """ renders n images of random marker poses; returns images and outputs """
+
+    cam = GL_Camera_Vals()
+    output = Pipeline_Output(sim = True)
+    output.cam = cam
+    generator = Random_Pose_Generator(output, seed = seed)
+    Cs, Ns, vertices = generator.generate_poses(n)
+    poses = np.hstack((Cs, Ns, vertices.reshape((n, 12))))
+    config_ids = [generator.init_marker.config_id]
+    renderer = Marker_Renderer(cam)
+    packer = Marker_Packer()
+    images, outputs = [], []
+    for i in xrange(n):
+        output = Pipeline_Output(sim = True)
+        output.cam = cam
+        markers = packer.unpack_markers(config_ids, poses[i:i+1], cam)
+        output.markers = markers
+        images.append(renderer.render(markers))
+        outputs.append(output)
+    return images, outputs
+
+
+def matches(ellipse, reference, cam, max_distance = 2., max_size_error = 0.05):
+    """
+    Tests whether the ellipse has the centre (to within max_distance pixels)
+    and major axis (to within max_size_error) of the reference ellipse.
+
+    """
+
+    ((x, y), (b, a), alpha) = ellipse
+    ((rx, ry), (rb, ra), ralpha) = reference
+    distance = np.hypot(x - rx, y - ry) / cam.pixelsize
+    size_error = abs(max(a, b) - max(ra, rb)) / max(ra, rb)
+    return distance <= max_distance and size_error <= max_size_error
+
+
+def main():
+
+    n = 100
+    images, outputs = simulated_frames(n)
+    cam = outputs[0].cam
+    reference = None
+    print '%10s %10s %12s %10s %10s' % ('decimation', 'fps', 'ms/image', 'found', 'recall')
+    for pyramid in [1, 2, 4]:
+        pipeline = Bench_Pipeline(pyramid)
+        found = []
+        start = time.time()
+        for image, output in zip(images, outputs):
+            found.append(pipeline.process(image, output))
+        duration = time.time() - start
+        if reference is None:
+            reference = found
+        nr_reference = sum(len(ellipses) for ellipses in reference)
+        nr_recalled = 0
+        for ellipses, reference_ellipses in zip(found, reference):
+            for r in reference_ellipses:
+                if any(matches(e, r, cam) for e in ellipses):
+                    nr_recalled += 1
+        nr_found = sum(1 for ellipses in found if ellipses)
+        print '%10d %10.1f %12.3f %10s %10.3f' % (pyramid, n / duration,
+                1000. * duration / n, '%d/%d' % (nr_found, n),
+                float(nr_recalled) / max(nr_reference, 1))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Milovision: A camera pose estimation programme
+# 
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# bench_marker_filter.py
+"""
+:synopsis:  Times EllipseFitter.marker_filter on synthetic scenes of 10 to
+            10,000 ellipses, and checks its candidates against the reference
+            nested loop implementation for the smaller scenes, without and
+            with (random) fit residuals. Run from the
+            project root with: python -m admin_modules.bench_marker_filter
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import timeit
+import numpy as np
+
+from pipeline_modules import EllipseFitter
+
+
+class Bench_Ellipse_Fitter(EllipseFitter):
+    """ EllipseFitter with the sizes ratio of the simulated marker """
+
+    def sizes_ratio_bounds(self):
+        """ uses the outer/inner circle ratio of marker config 0 """
+
+        correct_ratio = 240. / 180.
+        lower = correct_ratio - self.max_sizes_ratio_error[0]
+        upper = correct_ratio + self.max_sizes_ratio_error[1]
+        return lower, upper
+
+
+def reference_filter(fitter, ellipses, residuals = None):
+    """ 
+    the original nested loop version of marker_filter; with residuals, the
+    poorly fitted ellipses are skipped and the candidates are sorted by
+    residual, as marker_filter does
+
+    """
+
+    lower, upper = fitter.sizes_ratio_bounds()
+    poor = [residuals is not None and residuals[k] > fitter.max_fit_residual
+            for k in xrange(len(ellipses))]
+    candidates = []
+    indices = []
+    for i in xrange(len(ellipses)):
+        (ax, ay), (amin, amaj), aalpha = ellipses[i]
+        if abs(amaj / amin) > fitter.max_aspect_ratio or poor[i]:
+            continue
+        for j in xrange(i+1, len(ellipses)):
+            (bx, by), (bmin, bmaj), balpha = ellipses[j]
+            if bmaj > amaj:
+                larger, lmaj, smaj = j, bmaj, amaj
+            else:
+                larger, lmaj, smaj = i, amaj, bmaj
+            if abs(bmaj / bmin) > fitter.max_aspect_ratio or poor[j]:
+                continue
+            if np.linalg.norm(np.array([ax - bx, ay - by])) > fitter.max_ctrs_distance:
+                continue
+            if not ((abs(amaj / amin) < 1.2) and (abs(bmaj / bmin) < 1.2)):
+                if not abs(aalpha - balpha) < fitter.max_relative_inclination:
+                    continue
+            ratio = abs(lmaj / smaj)
+            if not ((ratio > lower) and (ratio < upper)):
+                continue
+            if ellipses[larger] not in candidates:
+                candidates.append(ellipses[larger])
+                indices.append(larger)
+    if residuals is None:
+        return candidates
+    order = sorted(range(len(indices)), key = lambda k: residuals[indices[k]])
+    return ([candidates[k] for k in order],
+            np.array([residuals[indices[k]] for k in order]))
+
+
+def same_candidates(result, reference):
+    """ compares the lists, or (candidates, residuals) tuples, of both """
+
+    if isinstance(reference, list):
+        return result == reference
+    return (result[0] == reference[0] and
+            np.array_equal(result[1], reference[1]))
+
+
+def synthetic_scene(n, seed = 0):
+    """ 
+    Returns n ellipses in OpenCV representation: random clutter over a
+    1280x960 image, with a concentric (outer, inner) pair for every 10
+    ellipses.
+
+    """
+
+    rs = np.random.RandomState(seed)
+    ellipses = []
+    while len(ellipses) < n:
+        x, y = rs.uniform(0, 1280), rs.uniform(0, 960)
+        minor = rs.uniform(2., 200.)
+        major = minor * rs.uniform(1., 3.)
+        alpha = rs.uniform(0., 180.)
+        ellipses.append(((x, y), (minor, major), alpha))
+        if len(ellipses) % 10 == 0:
+            ratio = (240. / 180.) * rs.uniform(0.95, 1.05)
+            ellipses.append(((x + rs.uniform(-1., 1.), y),
+                (minor * ratio, major * ratio), alpha + rs.uniform(-5., 5.)))
+    return ellipses[:n]
+
+
+def main():
+
+    fitter = Bench_Ellipse_Fitter()
+    print '%8s %14s %14s %8s %10s' % ('n', 'vectorised(s)', 'reference(s)',
+            'equal', 'residuals')
+    for n in [10, 30, 100, 300, 1000, 3000, 10000]:
+        ellipses = synthetic_scene(n)
+        residuals = np.random.RandomState(n).exponential(1., n)
+        repeat = max(1, 1000 / n)
+        t_new = timeit.timeit(lambda: fitter.marker_filter(ellipses), number = repeat) / repeat
+        if n <= 1000:
+            t_ref = timeit.timeit(lambda: reference_filter(fitter, ellipses), number = 1)
+            equal = same_candidates(fitter.marker_filter(ellipses),
+                    reference_filter(fitter, ellipses))
+            equal_res = same_candidates(fitter.marker_filter(ellipses, residuals),
+                    reference_filter(fitter, ellipses, residuals))
+            print '%8d %14.6f %14.6f %8s %10s' % (n, t_new, t_ref, equal, equal_res)
+        else:
+            print '%8d %14.6f %14s %8s %10s' % (n, t_new, '-', '-', '-')
+
+
+if __name__ == '__main__':
+
+    main()
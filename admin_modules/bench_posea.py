@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Milovision: A camera pose estimation programme
+# 
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# bench_posea.py
+"""
+:synopsis:  Times the batched PoseEstimatorA solver against the per-ellipse
+            path for 1 to 1,000 ellipses per image, and checks that both give
+            the same candidate (centre, normal) pairs. Both paths only agree
+            when the first of the eqn. 16 orderings applies: for the other
+            two, the per-ellipse path pairs the reordered eigenvalues with
+            eigenvectors in the solver's order. For ellipses up to three
+            times the focal length, where these orderings occur, it counts
+            the candidates of either path whose circle is off the ellipse's
+            cone. Run from the project root with:
+            python -m admin_modules.bench_posea
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import timeit
+import numpy as np
+
+from pipeline_modules import PipelineModule, PoseEstimatorA
+from camera_values import GL_Camera_Vals
+from marker import GL_Marker
+
+
+class Bench_Pose_Estimator(PoseEstimatorA):
+    """ PoseEstimatorA with the simulated camera and marker, and no pipeline """
+
+    def __init__(self):
+        """ sets the focal length and radius as in simulation mode """
+
+        PipelineModule.__init__(self)
+        self.nrlopt1 = 0
+        self.nrlopt2 = 0
+        self.nrlopt3 = 0
+        cam = GL_Camera_Vals()
+        self.focal_length = cam.get_focal()
+        self.radius = GL_Marker(cam = cam).get_circle_radius()*2.075
+
+
+def per_ellipse(estimator, ellipses):
+    """ the original per-ellipse path of PoseEstimatorA.run """
+
+    results = []
+    for ellipse in ellipses:
+        E = estimator.get_quadratic(ellipse)
+        Q = estimator.get_obl_el_cone(E, estimator.focal_length)
+        l, V = estimator.get_chen_eigend(Q)
+        Cs, Ns = estimator.get_Cs_Ns(l, V, estimator.radius)
+        results.append(estimator.remove_impossible(Cs, Ns))
+    return results
+
+
+def synthetic_ellipses(n, seed = 0, max_axis = 300.):
+    """ 
+    Returns n ellipses in the pipeline's representation (centred image
+    coordinates, radians), centred within the simulated camera's image.
+
+    """
+
+    rs = np.random.RandomState(seed)
+    ellipses = []
+    for i in xrange(n):
+        x_0, y_0 = rs.uniform(-500., 500.), rs.uniform(-350., 350.)
+        a = rs.uniform(10., max_axis)
+        b = a * rs.uniform(0.3, 1.)
+        alpha = rs.uniform(0., np.pi)
+        ellipses.append(((x_0, y_0), (b, a), alpha))
+    return ellipses
+
+
+def same_pairs(estimator, ellipses, rtol = 1e-6):
+    """ 
+    Tests whether both paths give the same pairs for every ellipse. The
+    eigenvector signs of the two eigensolvers may differ, which can swap the
+    order of the two pairs, so the pairs are compared in sorted order.
+
+    """
+
+    all_Cs, all_Ns = estimator.solve(ellipses)
+    for (Cs, Ns), bCs, bNs in zip(per_ellipse(estimator, ellipses), all_Cs, all_Ns):
+        a = np.hstack((Cs, Ns))
+        b = np.hstack((bCs, bNs))
+        a = a[np.lexsort(a.T[::-1])]
+        b = b[np.lexsort(b.T[::-1])]
+        scale = np.max(np.abs(a), axis=0)
+        if not np.allclose(a / scale, b / scale, rtol = rtol, atol = rtol):
+            return False
+    return True
+
+
+def off_cone(estimator, ellipse, Cs, Ns, tol = 1e-6):
+    """ 
+    Returns the number of the given (centre, normal) pairs whose circle does
+    not lie on the oblique cone of the ellipse: the largest value of x^T Q x
+    over points x of the circle, relative to |x|^2 and the largest
+    eigenvalue of Q, exceeds tol.
+
+    """
+
+    E = estimator.get_quadratic(ellipse)
+    Q = estimator.get_obl_el_cone(E, estimator.focal_length)
+    scale = np.max(np.abs(np.linalg.eigvalsh(Q)))
+    t = np.linspace(0., 2. * np.pi, 16)
+    nr_off = 0
+    for C, N in zip(Cs, Ns):
+        N = N / np.linalg.norm(N)
+        u = np.cross(N, [1., 0., 0.])
+        u /= np.linalg.norm(u)
+        v = np.cross(N, u)
+        points = C + estimator.radius * (np.outer(np.cos(t), u) + np.outer(np.sin(t), v))
+        q = np.einsum('ni,ij,nj->n', points, Q, points)
+        q /= np.sum(np.square(points), axis=1)
+        nr_off += np.max(np.abs(q)) / scale > tol
+    return nr_off
+
+
+def orderings(estimator, ellipses):
+    """ 
+    Returns, per eqn. 16 ordering, the number of ellipses, those on which
+    both paths differ, and the candidates off the cone of the per-ellipse
+    and batched paths. Ellipses for which the per-ellipse path fails are
+    left out.
+
+    """
+
+    counts = np.zeros((3, 4), dtype = int)
+    for ellipse in ellipses:
+        before = np.array([estimator.nrlopt1, estimator.nrlopt2, estimator.nrlopt3])
+        try:
+            (Cs, Ns), = per_ellipse(estimator, [ellipse])
+        except SystemExit:
+            continue
+        after = np.array([estimator.nrlopt1, estimator.nrlopt2, estimator.nrlopt3])
+        k = np.argmax(after != before)
+        bCs, bNs = estimator.solve([ellipse])
+        counts[k] += (1, not same_pairs(estimator, [ellipse]),
+                off_cone(estimator, ellipse, Cs, Ns),
+                off_cone(estimator, ellipse, bCs[0], bNs[0]))
+    return counts
+
+
+def main():
+
+    estimator = Bench_Pose_Estimator()
+    print '%8s %14s %14s %8s' % ('n', 'batched(s)', 'per-ellipse(s)', 'equal')
+    for n in [1, 3, 10, 30, 100, 300, 1000]:
+        ellipses = synthetic_ellipses(n)
+        repeat = max(1, 1000 / n)
+        t_new = timeit.timeit(lambda: estimator.solve(ellipses), number = repeat) / repeat
+        t_ref = timeit.timeit(lambda: per_ellipse(estimator, ellipses), number = repeat) / repeat
+        equal = same_pairs(estimator, ellipses)
+        print '%8d %14.6f %14.6f %8s' % (n, t_new, t_ref, equal)
+
+    ellipses = synthetic_ellipses(1000, max_axis = 3. * estimator.focal_length)
+    print
+    print '%8s %8s %8s %14s %14s' % ('ordering', 'n', 'differ', 'off per-ell.',
+            'off batched')
+    for k, row in enumerate(orderings(estimator, ellipses)):
+        print '%8d %8d %8d %14d %14d' % ((k + 1,) + tuple(row))
+
+
+if __name__ == '__main__':
+
+    main()
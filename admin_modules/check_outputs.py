@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# check_outputs.py
+"""
+:synopsis:  Checks that stored outputs still load with the current
+            Pipeline_Output: reads the given pickles of outputs (by default
+            output/outputs.pickle, written by an early version) or recording
+            directories, gathers their columns as the printer does, and prints
+            what was found. Exits with an error if a file fails to load. Run
+            from the project root with:
+            python -m admin_modules.check_outputs [FILE...]
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import sys
+import pickle
+import numpy as np
+
+from output import Output_Reader, Output_Columns
+
+
+def check(filename):
+    """ loads the outputs in the given file; returns a summary line """
+
+    if filename.endswith('.pickle'):
+        outputs = pickle.load(open(filename, 'rb'))
+    else:
+        outputs = Output_Reader(filename)
+    columns = Output_Columns(outputs)
+    cam = outputs[-1].cam if len(outputs) else None
+    if len(outputs) and cam is None:
+        raise ValueError('outputs without a camera')
+    msg = '%s: %d outputs, %d with an actual pose, %d estimates, camera %s'
+    return msg % (filename, len(columns), np.count_nonzero(columns.has_actual),
+            len(columns.est_Cs), getattr(cam, 'camera_id', None))
+
+
+def main():
+
+    filenames = sys.argv[1:] or ['output/outputs.pickle']
+    failed = 0
+    for filename in filenames:
+        try:
+            print check(filename)
+        except Exception, e:
+            print '%s: failed to load (%s: %s)' % (filename, e.__class__.__name__, e)
+            failed += 1
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,153 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# latency.py
+"""
+:synopsis:  Provides a monotonic clock and the Stage_Timer class, which
+            records per-frame latencies of the pipeline stages in a
+            preallocated ring buffer and reports their percentiles.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+__author__ = "Joris Stork"
+
+import time
+import ctypes
+import ctypes.util
+import logging
+import numpy as np
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_CLOCK_MONOTONIC = 1
+
+try:
+    _librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+            use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+except (OSError, AttributeError):
+    _clock_gettime = None
+
+
+def monotonic():
+    """
+    Returns the time in seconds of a clock that is not affected by system
+    clock changes (CLOCK_MONOTONIC), or the wall clock time where that clock is
+    not available.
+
+    """
+
+    if _clock_gettime is None:
+        return time.time()
+    t = _timespec()
+    _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(t))
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class Stage_Timer(object):
+    """
+    Records the time spent in each stage of each frame in a ring buffer of
+    the last 'capacity' frames, which is allocated up front. Stages that are
+    not timed in a frame are left empty (nan) for that frame, and times of
+    unknown stages are ignored.
+
+    """
+
+    def __init__(self, stages = None, capacity = 10000):
+        """ allocates the ring buffer for the given stage names """
+
+        self.logger = logging.getLogger('Stage_Timer')
+        self.stages = list(stages)
+        self.columns = dict((stage, i) for i, stage in enumerate(self.stages))
+        self.capacity = capacity
+        self.times = np.empty((capacity, len(self.stages)))
+        self.times.fill(np.nan)
+        self.frame_nrs = np.zeros((capacity,), dtype=np.int64)
+        self.nr_frames = 0
+        self.row = self.times[0]
+
+
+    def next_frame(self):
+        """ starts the row of the next frame, overwriting the oldest """
+
+        index = self.nr_frames % self.capacity
+        self.row = self.times[index]
+        self.row.fill(np.nan)
+        self.frame_nrs[index] = self.nr_frames
+        self.nr_frames += 1
+
+
+    def add(self, stage, seconds):
+        """ adds the given time to the given stage of the current frame """
+
+        column = self.columns.get(stage)
+        if column is None:
+            return
+        if np.isnan(self.row[column]):
+            self.row[column] = seconds
+        else:
+            self.row[column] += seconds
+
+
+    def get(self, stage):
+        """ returns the time recorded for the given stage in the current frame """
+
+        column = self.columns.get(stage)
+        if column is None:
+            return np.nan
+        return self.row[column]
+
+
+    def recorded(self):
+        """ returns the frame numbers and times of the frames in the buffer """
+
+        n = min(self.nr_frames, self.capacity)
+        order = np.argsort(self.frame_nrs[:n])
+        return self.frame_nrs[:n][order], self.times[:n][order]
+
+
+    def percentiles(self, q = (50, 95, 99)):
+        """
+        Returns a list of (stage, nr of frames, mean, percentiles) tuples, in
+        seconds, over the frames in the buffer.
+
+        """
+
+        _, times = self.recorded()
+        stats = []
+        for stage in self.stages:
+            t = times[:, self.columns[stage]]
+            t = t[~np.isnan(t)]
+            if not len(t):
+                continue
+            stats.append((stage, len(t), np.mean(t), np.percentile(t, q)))
+        return stats
+
+
+    def report(self, logger = None):
+        """ logs the p50/p95/p99 latencies of each stage, in milliseconds """
+
+        logger = logger or self.logger
+        for stage, n, mean, (p50, p95, p99) in self.percentiles():
+            msg = '%s latency (ms) over %d frames: mean %.2f, p50 %.2f, p95 %.2f, p99 %.2f'
+            logger.info(msg % (stage, n, mean*1e3, p50*1e3, p95*1e3, p99*1e3))
+
+
+    def export_trace(self, filename):
+        """ writes the per-frame stage times (seconds) as csv """
+
+        frame_nrs, times = self.recorded()
+        header = 'frame,' + ','.join(self.stages)
+        data = np.column_stack((frame_nrs, times))
+        formats = ['%d'] + ['%.9f'] * len(self.stages)
+        np.savetxt(filename, data, fmt = formats, delimiter = ',',
+                header = header, comments = '')
+        self.logger.info('latency trace of %d frames written to %s' % (len(times), filename))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# merge_stats.py
+"""
+:synopsis:  Merges the accumulated stats (Output_Stats) of separate runs or
+            sweeps, e.g. output/stats.pickle and output/sweep/stats.pickle,
+            prints the combined stats and optionally saves them. Run from the
+            project root with:
+            python -m admin_modules.merge_stats [-o merged.pickle] [--report
+            DIR] STATS...
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import os
+from optparse import OptionParser
+
+from output import Output_Stats, Printer
+
+
+def main():
+
+    parser = OptionParser('usage: %prog [options] STATS...')
+    parser.add_option('-o', '--output', dest = 'output',
+            help = 'save the merged stats to the given file', type = 'string')
+    parser.add_option('--report', dest = 'report',
+            help = 'write the merged stats as stats.json and stats.csv to the given directory',
+            type = 'string')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no stats files given')
+
+    stats = Output_Stats()
+    for filename in args:
+        stats.merge(Output_Stats.load(filename))
+    printer = Printer()
+    printer.print_summary(stats.get_stats())
+    if options.output:
+        stats.save(options.output)
+    if options.report:
+        if not os.path.isdir(options.report):
+            os.makedirs(options.report)
+        printer.write_stats(stats.get_stats(), options.report)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -19,6 +19,47 @@ import numpy as np
 import sys
 
 
+# the cameras of this process, by camera id (see register_camera)
+_cameras = {}
+
+
+def register_camera(cam):
+    """
+    Makes the given camera the one that outputs with its camera id refer to
+    in this process, and returns the id. Cameras pickled without an id (by
+    older versions) are given the id of the camera whose values they have,
+    or else a new id of their own.
+
+    """
+
+    if getattr(cam, 'camera_id', None) is None:
+        if isinstance(cam, GL_Camera_Vals):
+            cam.camera_id = 'gl'
+        elif (getattr(cam, 'ipw', None), getattr(cam, 'pixelsize', None)) == (1280, 0.00375):
+            cam.camera_id = 'chameleon1'
+        else:
+            cam.camera_id = 'camera%d' % len(_cameras)
+    camera_id = cam.camera_id
+    _cameras[camera_id] = cam
+    return camera_id
+
+
+def get_camera(camera_id):
+    """
+    Returns the camera registered under the given id, or else a new camera
+    with the default values for that id (which is then registered), so that
+    outputs passed to other processes can refer to their camera by id.
+
+    """
+
+    if camera_id not in _cameras:
+        if camera_id == 'gl':
+            register_camera(GL_Camera_Vals())
+        else:
+            register_camera(Camera_Vals(camera_id = camera_id))
+    return _cameras[camera_id]
+
+
 # todo: define transparent attribute retrieval functions
 class Camera_Vals(object):
     """ camera object (parent class for simulated camera) """
@@ -29,6 +70,7 @@ class Camera_Vals(object):
         
         """
 
+        self.camera_id = camera_id
         if camera_id == 'chameleon1':
             self.ipw, self.iph = 1280, 960
             self.pixelsize = 0.00375
@@ -76,6 +118,7 @@ class GL_Camera_Vals(Camera_Vals):
     def __init__(self):
         """ sets default pixel and sim units, image dimensions """
 
+        self.camera_id = 'gl'
         self.ipw, self.iph = 1280, 960
         self.iuw, self.iuh = 1280, 960
         self.pixelsize = 1.
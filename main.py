@@ -18,6 +18,12 @@
 # standard and third party libraries
 import sys
 import os
+
+# the OpenGL platform is fixed on first import: use software rendering
+# without a display for headless simulation
+if '--headless' in sys.argv[1:]:
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'osmesa')
+
 import logging
 import cv2
 import signal
@@ -29,6 +35,7 @@ import multiprocessing
 
 # milovision libraries
 from pipeline import Pipeline
+from sweep import Sweep
 from admin_modules import loginit
 from admin_modules import argparse
 from output import Printer
@@ -62,7 +69,7 @@ def main():
 
     logger.info(' '.join(sys.argv[1:]))
 
-    if options.simulate == 0:
+    if options.simulate == 0 and not options.sweep:
         options.simulate = None
         l = DC1394Library()
     elif options.simulate > 0:
@@ -82,6 +89,14 @@ def main():
         logger.info('done. exiting')
         sys.exit(0)
 
+    if options.sweep:
+        logger.info('running sweep of %d poses' % options.sweep)
+        sweep = Sweep(options, nr_poses = options.sweep, seed = options.seed or 0,
+                chunk_size = options.chunk, nr_workers = options.workers)
+        sweep.run()
+        logger.info('done. exiting')
+        sys.exit(0)
+
     if args:
         try:
             image = cv2.imread('images/'+args[0], cv2.CV_LOAD_IMAGE_GRAYSCALE)
@@ -4,3 +4,4 @@
 
 from markers import Marker
 from markers import GL_Marker
+from markers import get_template
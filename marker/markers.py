@@ -7,7 +7,8 @@
 # markers.py
 """
 :synopsis:  Marker_Config, Marker, and Texture (sub)classes.  The __init__
-            functions define the (gl)marker configurations 
+            functions define the (gl)marker configurations. get_template
+            returns the shared marker of a configuration.
 
 .. moduleauthor:: Joris Stork <joris@wintermute.eu>
 
@@ -23,6 +24,30 @@ import math
 import sys
 import copy
 
+from camera_values import GL_Camera_Vals
+
+
+# the template markers of this process, by config id and camera id
+_templates = {}
+
+
+def get_template(config_id = 0, cam = None):
+    """ 
+    Returns the (shared, unposed) marker of the given configuration for the
+    given camera: a GL_Marker for the simulated camera, a Marker otherwise.
+    Its config holds the marker dimensions that pipeline outputs refer to by
+    config id.
+
+    """
+
+    key = config_id, getattr(cam, 'camera_id', None)
+    if key not in _templates:
+        if isinstance(cam, GL_Camera_Vals):
+            _templates[key] = GL_Marker(config_id = config_id, cam = cam)
+        else:
+            _templates[key] = Marker(config_id = config_id, cam = cam)
+    return _templates[key]
+
 
 class Marker_Config(object):
     """ stores key marker attributes; parent class to simulated version """
@@ -75,6 +100,7 @@ class Marker(object):
     def __init__(self, config_id = 0, cam = None, C = None, N = None):
         """ sets this marker's config and camera objects """
 
+        self.config_id = config_id
         self.config = Marker_Config(config_id, C, N)
         self.cam = cam
 
@@ -93,8 +119,7 @@ class Marker(object):
 
         C = self.get_C()
         if C is not None:
-            for i, item in enumerate(C):
-                C[i] = item * self.cam.unitsize
+            C = np.asarray(C) * self.cam.unitsize
         return C
 
 
@@ -112,8 +137,7 @@ class Marker(object):
 
         N = self.get_N()
         if N is not None:
-            for i, item in enumerate(N):
-                N[i] = item * self.cam.unitsize
+            N = np.asarray(N) * self.cam.unitsize
         return N
 
 
@@ -140,6 +164,7 @@ class GL_Marker(Marker):
         
         """
 
+        self.config_id = config_id
         self.config = GL_Marker_Config(config_id)
         self.cam = cam
         self.set_circle_sizes()
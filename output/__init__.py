@@ -2,4 +2,8 @@
 # encoding: utf-8
 
 from pipeline_output import Pipeline_Output
+from recorder import Output_Recorder, Output_Reader
+from display import Display
+from analysis import Output_Columns
+from accumulators import Output_Stats
 from printer import Printer
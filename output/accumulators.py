@@ -0,0 +1,253 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# accumulators.py
+"""
+:synopsis:  Contains the Output_Stats class, which accumulates the accuracy
+            statistics of the pipeline outputs as they are completed, in
+            constant memory, and the Running_Stats and Binned_Stats
+            accumulators it is made of. All of them can be pickled and merged,
+            so that the statistics of separate processes, sweep chunks or runs
+            can be combined.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import pickle
+import numpy as np
+from collections import OrderedDict
+
+from analysis import norms, angles
+
+
+def combine(n_a, mean_a, M2_a, n_b, mean_b, M2_b):
+    """
+    Returns the count, mean and sum of squared deviations of the union of two
+    sets of values, given those of each set (Chan et al.'s pairwise form of
+    Welford's update). Works elementwise on arrays; empty sets (n = 0) leave
+    the other set's values unchanged.
+
+    """
+
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    share = n_b / np.maximum(n, 1.)
+    mean = mean_a + delta * share
+    M2 = M2_a + M2_b + delta ** 2 * n_a * share
+    return n, mean, M2
+
+
+class Running_Stats(object):
+    """
+    Accumulates the count, mean, variance (through the sum of squared
+    deviations), minimum and maximum of a stream of values of the given
+    shape.
+
+    """
+
+    def __init__(self, shape = ()):
+        """ starts without values """
+
+        self.n = 0.
+        self.mean = np.zeros(shape)
+        self.M2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+
+    def add(self, values):
+        """ adds the given array of values (along its first axis) """
+
+        values = np.asarray(values, dtype = float)
+        if not len(values):
+            return
+        mean = values.mean(axis = 0)
+        M2 = ((values - mean) ** 2).sum(axis = 0)
+        self.n, self.mean, self.M2 = combine(self.n, self.mean, self.M2,
+                float(len(values)), mean, M2)
+        self.min = np.minimum(self.min, values.min(axis = 0))
+        self.max = np.maximum(self.max, values.max(axis = 0))
+
+
+    def merge(self, other):
+        """ adds the values accumulated by the given Running_Stats """
+
+        self.n, self.mean, self.M2 = combine(self.n, self.mean, self.M2,
+                other.n, other.mean, other.M2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+
+    def std(self):
+        """ returns the (population) standard deviation """
+
+        return np.sqrt(self.M2 / max(self.n, 1.))
+
+
+    def summary(self):
+        """ returns the max., min., mean and st. dev., as the printer does """
+
+        return OrderedDict([('max.', self.max), ('min.', self.min),
+            ('mean', self.mean), ('st. dev.', self.std())])
+
+
+class Binned_Stats(object):
+    """
+    Accumulates the count, mean and variance of a stream of values y in
+    nr_bins fixed bins of equal width over [lo, hi) of a second value x.
+    Values of x outside the range are counted in the first or last bin.
+
+    """
+
+    def __init__(self, lo = 0., hi = 1., nr_bins = 100):
+        """ sets the bins; starts without values """
+
+        self.lo = lo
+        self.hi = hi
+        self.nr_bins = nr_bins
+        self.n = np.zeros(nr_bins)
+        self.mean = np.zeros(nr_bins)
+        self.M2 = np.zeros(nr_bins)
+
+
+    def bounds(self):
+        """ returns the lower bounds of the bins, and the bin width """
+
+        bounds, step = np.linspace(self.lo, self.hi, self.nr_bins + 1, retstep = True)
+        return bounds[:-1], step
+
+
+    def add(self, x, y):
+        """ adds the values y at the given x (equal length arrays) """
+
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+        if not len(x):
+            return
+        step = (self.hi - self.lo) / self.nr_bins
+        bins = np.clip(((x - self.lo) / step).astype(int), 0, self.nr_bins - 1)
+        n = np.bincount(bins, minlength = self.nr_bins).astype(float)
+        mean = np.bincount(bins, weights = y, minlength = self.nr_bins) / np.maximum(n, 1.)
+        M2 = np.bincount(bins, weights = (y - mean[bins]) ** 2, minlength = self.nr_bins)
+        self.n, self.mean, self.M2 = combine(self.n, self.mean, self.M2, n, mean, M2)
+
+
+    def merge(self, other):
+        """ adds the values accumulated by the given Binned_Stats (same bins) """
+
+        if (self.lo, self.hi, self.nr_bins) != (other.lo, other.hi, other.nr_bins):
+            raise ValueError('cannot merge histograms with different bins')
+        self.n, self.mean, self.M2 = combine(self.n, self.mean, self.M2,
+                other.n, other.mean, other.M2)
+        return self
+
+
+    def std(self):
+        """ returns the (population) standard deviation per bin """
+
+        return np.sqrt(self.M2 / np.maximum(self.n, 1.))
+
+
+class Output_Stats(object):
+    """
+    Accumulates, per completed output (see Pipeline_Output.complete), the
+    statistics that the printer's print_stats computes from all outputs: the
+    distance and difference between actual and estimated centres, the angle
+    between actual and estimated normals, the angle of incidence and the
+    distance to the camera, over the matched estimates; and the mean error
+    and recognition rate in fixed bins of distance to the camera (mm) and
+    angle of incidence (deg), as in the printer's histograms.
+
+    """
+
+    def __init__(self, max_distance = 20000., nr_distance_bins = 200, nr_angle_bins = 90):
+        """ sets the histogram bins; starts without outputs """
+
+        self.nr_outputs = 0
+        self.nr_estimates = 0
+        self.depth = Running_Stats()
+        self.error = Running_Stats()
+        self.difference = Running_Stats((3,))
+        self.normal_angle = Running_Stats()
+        self.incidence = Running_Stats()
+        self.distance = Running_Stats()
+        self.error_by_distance = Binned_Stats(0., max_distance, nr_distance_bins)
+        self.error_by_angle = Binned_Stats(0., 90., nr_angle_bins)
+        self.recognition_by_distance = Binned_Stats(0., max_distance, nr_distance_bins)
+        self.recognition_by_angle = Binned_Stats(0., 90., nr_angle_bins)
+
+
+    def add(self, output):
+        """ adds the estimates of the given completed output """
+
+        self.nr_outputs += 1
+        eCs = output.get_est_Cs_flat_mm()
+        C = output.get_C_mm()
+        if not output.sim or C is None:
+            return
+        N = output.get_N_mm()
+        distance = np.linalg.norm(C)
+        incidence = np.degrees(angles(N[np.newaxis], -C[np.newaxis]))
+        recognised = [float(len(eCs) > 0)]
+        self.recognition_by_distance.add([distance], recognised)
+        self.recognition_by_angle.add(incidence, recognised)
+        n = len(eCs)
+        if not n:
+            return
+        self.nr_estimates += n
+        dif = C - eCs
+        error = norms(dif)
+        self.depth.add(np.repeat(C[2], n))
+        self.error.add(error)
+        self.difference.add(dif)
+        self.normal_angle.add(np.degrees(angles(N[np.newaxis], output.get_est_Ns_flat_mm())))
+        self.incidence.add(np.repeat(incidence, n))
+        self.distance.add(np.repeat(distance, n))
+        self.error_by_distance.add(np.repeat(distance, n), error)
+        self.error_by_angle.add(np.repeat(incidence, n), error)
+
+
+    def merge(self, other):
+        """ adds the outputs accumulated by the given Output_Stats """
+
+        self.nr_outputs += other.nr_outputs
+        self.nr_estimates += other.nr_estimates
+        for key in ['depth', 'error', 'difference', 'normal_angle', 'incidence',
+                'distance', 'error_by_distance', 'error_by_angle',
+                'recognition_by_distance', 'recognition_by_angle']:
+            getattr(self, key).merge(getattr(other, key))
+        return self
+
+
+    def get_stats(self):
+        """ returns the stats in the printer's form (see Printer.get_stats) """
+
+        stats = OrderedDict()
+        stats['nr. poses generated'] = self.nr_outputs
+        stats['nr. estimates'] = self.nr_estimates
+        stats['min depth'] = self.depth.min
+        stats['max depth'] = self.depth.max
+        stats['distance (C-estC)(mm)'] = self.error.summary()
+        stats['difference (C-estC)(mm)'] = OrderedDict([('mean', self.difference.mean)])
+        stats['angle (norm, estnorm)(deg)'] = self.normal_angle.summary()
+        stats['angle of incidence(deg)'] = self.incidence.summary()
+        stats['distance (marker-cam)(mm)'] = self.distance.summary()
+        return stats
+
+
+    def save(self, path = 'output/stats.pickle'):
+        """ pickles the accumulators to the given file """
+
+        pickle.dump(self, open(path, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+
+    @classmethod
+    def load(cls, path = 'output/stats.pickle'):
+        """ returns the accumulators pickled to the given file """
+
+        return pickle.load(open(path, 'rb'))
@@ -0,0 +1,173 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# analysis.py
+"""
+:synopsis:  Contains the Output_Columns class, which gathers the actual and
+            estimated centres and normals of a sequence of pipeline outputs
+            into flat arrays, and the vectorised functions the printer computes
+            its errors, angles and binned statistics with.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import numpy as np
+
+from recorder import Output_Reader
+
+
+def norms(V):
+    """ returns the lengths of the rows of the nx3 array V """
+
+    return np.sqrt((V * V).sum(axis = 1))
+
+
+def angles(A, B):
+    """ returns the angles (rad) between the rows of the nx3 arrays A and B """
+
+    cos = (A * B).sum(axis = 1) / (norms(A) * norms(B))
+    return np.arccos(np.clip(cos, -1., 1.))
+
+
+def binned_stats(X, Y, nr_bins = 100):
+    """
+    Divides the range of X into nr_bins equal bins and returns the lower bin
+    bounds, the bin width, and the number, mean and standard deviation of the
+    values of Y whose X falls in each bin (0 for empty bins).
+
+    """
+
+    bounds, step = np.linspace(np.min(X), np.max(X), nr_bins + 1, retstep = True)
+    bounds = bounds[:-1]
+    bins = np.digitize(X, bounds) - 1
+    counts = np.bincount(bins, minlength = nr_bins)
+    occupied = np.maximum(counts, 1)
+    means = np.bincount(bins, weights = Y, minlength = nr_bins) / occupied
+    deviations = Y - means[bins]
+    stds = np.sqrt(np.bincount(bins, weights = deviations ** 2,
+        minlength = nr_bins) / occupied)
+    return bounds, step, counts, means, stds
+
+
+class Output_Columns(object):
+    """
+    Holds, for n outputs, the actual centre and normal (nx3, NaN without an
+    actual marker) and the number of estimates of each output, and the m
+    estimated centres and normals of all outputs (mx3) with the index of the
+    output each belongs to. Recorded outputs are read from the Output_Reader
+    in chunks of chunk_size records, and only the columns needed; other
+    outputs in a single pass, filling arrays that are preallocated for two
+    estimates per output and grown as needed.
+
+    """
+
+    def __init__(self, outputs = None, chunk_size = 65536):
+        """ gathers the columns of the given outputs """
+
+        if isinstance(outputs, Output_Reader):
+            self.read_records(outputs, chunk_size)
+        else:
+            self.read_outputs(outputs)
+        self.has_actual = ~np.isnan(self.C[:,0])
+
+
+    def read_outputs(self, outputs):
+        """ fills the columns from a sequence of Pipeline_Output objects """
+
+        n = len(outputs)
+        self.C = np.empty((n, 3))
+        self.N = np.empty((n, 3))
+        self.times = np.empty((n,))
+        self.counts = np.zeros((n,), dtype = int)
+        est_Cs = np.empty((2 * n, 3))
+        est_Ns = np.empty((2 * n, 3))
+        k = 0
+        for i, output in enumerate(outputs):
+            C = output.get_C_mm()
+            if C is not None:
+                self.C[i] = C
+                self.N[i] = output.get_N_mm()
+            else:
+                self.C[i] = self.N[i] = np.nan
+            self.times[i] = output.end_time - output.start_time
+            eCs = output.get_est_Cs_flat_mm()
+            m = len(eCs)
+            if k + m > len(est_Cs):
+                size = max(2 * len(est_Cs), k + m)
+                est_Cs = np.resize(est_Cs, (size, 3))
+                est_Ns = np.resize(est_Ns, (size, 3))
+            est_Cs[k:k+m] = eCs
+            est_Ns[k:k+m] = output.get_est_Ns_flat_mm()
+            self.counts[i] = m
+            k += m
+        self.est_Cs = est_Cs[:k]
+        self.est_Ns = est_Ns[:k]
+        self.owners = np.repeat(np.arange(n), self.counts)
+
+
+    def read_records(self, reader, chunk_size = 65536):
+        """ fills the columns from an Output_Reader, chunk by chunk """
+
+        n = len(reader)
+        self.C = np.empty((n, 3))
+        self.N = np.empty((n, 3))
+        self.times = np.empty((n,))
+        self.counts = np.array(reader.columns['nr_estimates'], dtype = int)
+        self.est_Cs = np.empty((self.counts.sum(), 3))
+        self.est_Ns = np.empty((self.counts.sum(), 3))
+        names = 'C', 'N', 'start_time', 'end_time', 'nr_estimates', 'est_Cs', 'est_Ns'
+        k = 0
+        for start, c in reader.chunks(chunk_size, names):
+            stop = start + len(c['C'])
+            self.C[start:stop] = c['C']
+            self.N[start:stop] = c['N']
+            self.times[start:stop] = c['end_time'] - c['start_time']
+            max_estimates = c['est_Cs'].shape[1]
+            recorded = np.arange(max_estimates) < c['nr_estimates'][:,np.newaxis]
+            m = np.count_nonzero(recorded)
+            self.est_Cs[k:k+m] = c['est_Cs'][recorded]
+            self.est_Ns[k:k+m] = c['est_Ns'][recorded]
+            k += m
+        self.owners = np.repeat(np.arange(n), self.counts)
+
+
+    def __len__(self):
+
+        return len(self.counts)
+
+
+    def get(self, get = None, match = False):
+        """
+        Returns a dict of the requested data classes, as the printer's
+        get_data describes: 'actual Cs', 'actual Ns', 'est. Cs', 'est. Ns' and
+        (unmatched only) 'recognition', the latter 1 for each output with an
+        actual marker and at least one estimate and 0 for the others. Unmatched,
+        there is one row of actual values per output with an actual marker,
+        aligned with 'recognition'; the printer's get_data used to repeat
+        each actual vector three times (once per coordinate).
+
+        """
+
+        if match:
+            estimates = self.has_actual[self.owners]
+            owners = self.owners[estimates]
+            actual = {'actual Cs': self.C[owners], 'actual Ns': self.N[owners]}
+            est = {'est. Cs': self.est_Cs[estimates], 'est. Ns': self.est_Ns[estimates]}
+        else:
+            actual = {'actual Cs': self.C[self.has_actual],
+                    'actual Ns': self.N[self.has_actual]}
+            est = {'est. Cs': self.est_Cs, 'est. Ns': self.est_Ns}
+        data = {}
+        for key in get:
+            if key in actual:
+                data[key] = actual[key]
+            elif key in est:
+                data[key] = est[key]
+            elif key == 'recognition' and not match:
+                recognised = self.counts[self.has_actual] > 0
+                data[key] = recognised.astype(float)
+        return data
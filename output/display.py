@@ -0,0 +1,104 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# display.py
+"""
+:synopsis:  Contains the Display class, a thread that shows the pipeline's
+            images in OpenCV windows, so that the pipeline loop never waits on
+            the display.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import logging
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class Display(threading.Thread):
+    """
+    Keeps a single slot per window holding the latest image posted for it:
+    a newer image replaces one that was not shown yet (which is counted as
+    dropped). The thread shows the images at no more than max_fps refreshes
+    per second. Each slot holds two buffers, which the thread swaps so that
+    it never holds the lock while drawing.
+
+    """
+
+    def __init__(self, max_fps = 30):
+        """ sets the refresh rate and the (empty) slots """
+
+        threading.Thread.__init__(self, name = 'display')
+        self.daemon = True
+        self.logger = logging.getLogger('Display')
+        self.interval = 1. / max_fps
+        self.lock = threading.Lock()
+        self.posted = threading.Event()
+        self.running = True
+        self.slots = {}
+        self.windows = []
+        self.nr_posted = 0
+        self.nr_shown = 0
+        self.nr_dropped = 0
+
+
+    def show(self, name, image):
+        """ posts a copy of the image for the named window; never blocks """
+
+        with self.lock:
+            slot = self.slots.get(name)
+            if slot is None or slot[0].shape != image.shape or slot[0].dtype != image.dtype:
+                slot = [np.empty_like(image), np.empty_like(image), False]
+                self.slots[name] = slot
+            elif slot[2]:
+                self.nr_dropped += 1
+            np.copyto(slot[0], image)
+            slot[2] = True
+            self.nr_posted += 1
+        self.posted.set()
+
+
+    def run(self):
+        """ shows the latest images until stopped, at the capped rate """
+
+        while self.running:
+            self.posted.wait(self.interval)
+            if not self.running:
+                break
+            self.posted.clear()
+            start = time.time()
+            fresh = []
+            with self.lock:
+                for name, slot in self.slots.items():
+                    if slot[2]:
+                        slot[0], slot[1] = slot[1], slot[0]
+                        slot[2] = False
+                        fresh.append((name, slot[1]))
+            for name, image in fresh:
+                if name not in self.windows:
+                    self.windows.append(name)
+                cv2.imshow(name, image)
+                self.nr_shown += 1
+            cv2.waitKey(1)
+            remaining = self.interval - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        for name in self.windows:
+            cv2.destroyWindow(name) # opencv bug: only closes windows at exit
+
+
+    def stop(self):
+        """ stops the thread, closes its windows and logs the frame counts """
+
+        self.running = False
+        self.posted.set()
+        if self.is_alive():
+            self.join()
+        msg = 'images posted: %d, shown: %d, dropped: %d'
+        self.logger.info(msg % (self.nr_posted, self.nr_shown, self.nr_dropped))
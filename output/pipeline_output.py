@@ -15,16 +15,40 @@
 
 import logging
 import time
+import copy
 import numpy as np
 
+from camera_values import get_camera, register_camera
+
+
+# the slot names of each output class, in pickling order (see get_slots)
+_slots = {}
+
+
+def get_slots(cls):
+    """ returns the names of the slots of the given class and its bases """
+
+    if cls not in _slots:
+        _slots[cls] = [key for base in reversed(cls.__mro__)
+                for key in base.__dict__.get('__slots__', ())]
+    return _slots[cls]
+
 
 class Pipeline_Output(object):
     """ 
     Holds all relevant pose estimation and performance data emerging from the
-    pipeline.
+    pipeline. An output is made for every image and passed between
+    processes, so it holds no object graphs: the camera is referred to by its
+    camera id (see camera_values.get_camera) and the markers by their config
+    ids (see marker.get_template), and the actual and estimated poses are
+    kept as small arrays of centres and normals in mm.
     
     """
 
+    __slots__ = ('sim', 'cam_id', 'config_ids', 'Cs', 'Ns', 'est_Cs', 'est_Ns',
+            'tracked_C', 'tracked_N', 'pose_index', 'stage_times', 'start_time',
+            'end_time')
+
     def __init__(self, sim = False):
         """ 
         Sets simulator, camera, marker and timestamp attributes. Records time at
@@ -34,19 +58,120 @@ class Pipeline_Output(object):
 
         self.start_time = time.time()
         self.sim = sim
-        self.cam = None
-        self.markers = []
-        self.est_markers = []
+        self.cam_id = None
+        self.config_ids = []
+        self.Cs = None
+        self.Ns = None
+        self.est_Cs = None
+        self.est_Ns = None
+        self.stage_times = {}
+        self.pose_index = None
+        self.tracked_C = None
+        self.tracked_N = None
         self.end_time = None
 
 
+    def __getstate__(self):
+        """ returns the values of the slots, for pickling and copying """
+
+        return tuple(getattr(self, key) for key in get_slots(type(self)))
+
+
+    def __setstate__(self, state):
+        """ 
+        Restores the values of the slots. Outputs pickled as a dict of camera
+        and marker objects (before outputs had slots) are converted.
+
+        """
+
+        if not isinstance(state, dict):
+            for key, value in zip(get_slots(type(self)), state):
+                setattr(self, key, value)
+            return
+        Pipeline_Output.__init__(self)
+        state = dict(state)
+        markers = state.pop('markers', None)
+        est_markers = state.pop('est_markers', None)
+        for key, value in state.items():
+            setattr(self, key, value)
+        if markers:
+            # markers of older versions have no config_id; all used config 0
+            config_ids = [getattr(marker, 'config_id', 0) for marker in markers]
+            if self.sim:
+                self.set_poses(config_ids, [marker.get_C_mm() for marker in markers],
+                        [marker.get_N_mm() for marker in markers])
+            else:
+                self.set_poses(config_ids)
+        if est_markers:
+            self.est_Cs = np.array([m.get_C_mm() for m in est_markers],
+                    dtype = float).reshape((-1,3))
+            self.est_Ns = np.array([m.get_N_mm() for m in est_markers],
+                    dtype = float).reshape((-1,3))
+
+
+    def __deepcopy__(self, memo):
+        """ 
+        Returns a copy of this output. The slots hold only numbers, ids, and
+        lists, dicts and arrays of numbers, so shallow copies of the latter
+        suffice.
+
+        """
+
+        other = object.__new__(type(self))
+        for key in get_slots(type(self)):
+            value = getattr(self, key)
+            if isinstance(value, (np.ndarray, list, dict)):
+                value = copy.copy(value)
+            setattr(other, key, value)
+        return other
+
+
+    @property
+    def cam(self):
+        """ the camera's key parameters, shared by the outputs of the camera """
+
+        if self.cam_id is None:
+            return None
+        return get_camera(self.cam_id)
+
+
+    @cam.setter
+    def cam(self, cam):
+
+        self.cam_id = None if cam is None else register_camera(cam)
+
+
+    @property
+    def markers(self):
+        """ 
+        The template markers (see marker.get_template) of the markers in the
+        image, which hold their configurations but not their poses. Setting
+        markers keeps their config ids and, if simulated, their poses.
+
+        """
+
+        # imported here: the marker module needs OpenGL, which the analysis
+        # of recorded outputs does not
+        from marker import get_template
+        cam = self.cam
+        return [get_template(config_id, cam) for config_id in self.config_ids]
+
+
+    @markers.setter
+    def markers(self, markers):
+
+        self.set(markers = markers)
+
+
     def set(self, sim = False, cam = None, markers = None, estimates = None):
         """ 
         sets:
             sim: (boolean) flag to indicate whether this was a simulation
             cam: (GL_Camera_Vals or Real_Camera_Vals) camera's key parameters 
-            markers: (Marker or GL_Marker) fiducial marker object
-            est_markers: (Marker) pipeline pose estimation values 
+            markers: (Marker or GL_Marker) fiducial marker objects, of which
+                the config ids and, if simulated, the poses are kept
+            estimates: (Cs, Ns) pipeline pose estimation values, in the
+                camera's units
 
         """
 
@@ -54,16 +179,46 @@ class Pipeline_Output(object):
             self.sim = sim
         if cam:
             self.cam = cam
-        if markers:
-            self.markers = markers
-        if est_markers:
-            self.est_markers = estimates
+        if markers is not None:
+            config_ids = [marker.config_id for marker in markers]
+            if self.sim and markers:
+                Cs = [marker.get_C_mm() for marker in markers]
+                Ns = [marker.get_N_mm() for marker in markers]
+                self.set_poses(config_ids, Cs, Ns)
+            else:
+                self.set_poses(config_ids)
+        if estimates is not None:
+            Cs, Ns = estimates
+            unitsize = self.cam.unitsize
+            self.est_Cs = np.asarray(Cs, dtype = float).reshape((-1,3)) * unitsize
+            self.est_Ns = np.asarray(Ns, dtype = float).reshape((-1,3)) * unitsize
 
 
-    def complete(self, failed = False):
-        """ records time at which all values have been filled in """
+    def set_poses(self, config_ids, Cs = None, Ns = None):
+        """ 
+        Sets the config ids of the markers in the image and, if given, their
+        actual centres and normals (mx3, in mm).
+
+        """
+
+        self.config_ids = list(config_ids)
+        if Cs is None:
+            self.Cs = self.Ns = None
+        else:
+            self.Cs = np.asarray(Cs, dtype = float).reshape((-1,3))
+            self.Ns = np.asarray(Ns, dtype = float).reshape((-1,3))
+
+
+    def complete(self, failed = False, stats = None):
+        """ 
+        records time at which all values have been filled in, and adds the
+        output to the given statistics accumulators (Output_Stats), if any
+        
+        """
 
         self.end_time = time.time()
+        if stats is not None:
+            stats.add(self)
 
 
     def time(self):
@@ -76,40 +231,71 @@ class Pipeline_Output(object):
         """ prepares output for next pipeline loop """
 
         self.start_time = time.time()
-        self.markers = []
-        self.est_markers = []
+        self.config_ids = []
+        self.Cs = self.Ns = None
+        self.est_Cs = self.est_Ns = None
+        self.stage_times = {}
+        self.pose_index = None
+        self.tracked_C = None
+        self.tracked_N = None
+
+
+    def get_C_mm(self):
+        """ returns the actual centre of the (first) marker in mm, or None """
+
+        if self.Cs is None or not len(self.Cs):
+            return None
+        return self.Cs[0]
+
+
+    def get_N_mm(self):
+        """ returns the actual normal of the (first) marker in mm, or None """
+
+        if self.Ns is None or not len(self.Ns):
+            return None
+        return self.Ns[0]
+
+
+    def get_tracked_C_mm(self):
+        """ returns the centre of the tracked pose in mm, or None """
+
+        if self.tracked_C is None:
+            return None
+        return self.tracked_C * self.cam.unitsize
+
+
+    def get_tracked_N_mm(self):
+        """ returns the normal of the tracked pose (as est. normals), or None """
+
+        if self.tracked_N is None:
+            return None
+        return self.tracked_N * self.cam.unitsize
 
 
     def get_est_Cs_flat_mm(self):
         """ 
         Returns estimated centres in a nx3 flat array of 3d vectors (useful for
         single marker). Note: posea always generates two estimates per
-        est_marker.
+        ellipse.
         
         """
 
-        eCs = np.zeros((len(self.est_markers)*2,3))
-        for i, m in enumerate(self.est_markers): # any nr of markers
-            for j, e in enumerate(m.get_C_mm()): # two centre estimates
-                for k, c in enumerate(e):        # three coordinates
-                    eCs[i*2+j,k] = c
-        return eCs
+        if self.est_Cs is None:
+            return np.zeros((0,3))
+        return self.est_Cs
 
 
     def get_est_Ns_flat_mm(self):
         """ 
         Returns estimated normals in a nx3 flat array of 3d vectors (useful for
         single marker). Note: posea always generates two estimates per
-        est_marker.
+        ellipse.
         
         """
 
-        enrms = np.zeros((len(self.est_markers)*2,3))
-        for i, m in enumerate(self.est_markers): # any nr of markers
-            for j, n in enumerate(m.get_N_mm()): # two normal estimates
-                for k, c in enumerate(n):        # three coordinates
-                    enrms[i*2+j,k] = c
-        return enrms
+        if self.est_Ns is None:
+            return np.zeros((0,3))
+        return self.est_Ns
 
 
     def get_data(self, stub= False, match= False, get= None):
@@ -150,17 +336,18 @@ class Pipeline_Output(object):
         recognised = 0
 
         if match and ('recognition' in get):
-            self.logger.error('tried to retrieve recognition in matched mode')
+            logging.getLogger('Pipeline_Output').error(
+                    'tried to retrieve recognition in matched mode')
             return None
 
         eCs = self.get_est_Cs_flat_mm()
         nr_eCs = len(eCs)
-        C = self.markers[0].get_C_mm()
-        nr_Cs = len(C)
+        C = self.get_C_mm()
+        nr_Cs = 0 if C is None else len(C)
         eNs = self.get_est_Ns_flat_mm()
         nr_eNs = len(eNs)
-        N = self.markers[0].get_N_mm()
-        nr_Ns = len(N)
+        N = self.get_N_mm()
+        nr_Ns = 0 if N is None else len(N)
 
         if 'est. Cs' in get:
             if nr_eCs:
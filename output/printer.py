@@ -22,15 +22,103 @@ import logging
 from mpl_toolkits.mplot3d import axes3d
 import pickle
 import time
+import os
+import re
+import csv
+import json
+import multiprocessing
+from collections import OrderedDict
 
 # milovision modules
-from output import Pipeline_Output
+from output import Pipeline_Output, Output_Recorder, Output_Reader
+from analysis import Output_Columns, norms, angles, binned_stats
+
+
+def summary(values):
+    """ returns the max., min., mean and st. dev. of the values """
+
+    return OrderedDict([('max.', np.max(values)), ('min.', np.min(values)),
+        ('mean', np.mean(values)), ('st. dev.', np.std(values))])
+
+
+def draw_histogram(bounds = None, means = None, width = None, std = None,
+        title = '', xlabel = '', ylabel = '', label_bars = False):
+    """ draws the bin means (with std error bars, if given) over the bins """
+
+    fig = plt.figure()
+    ax = plt.subplot(111)
+    if std is None:
+        rects = ax.bar(bounds, means, width, color='b')
+    else:
+        rects = ax.bar(bounds, means, width, color='b', yerr=std, ecolor='r')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+    if label_bars:
+        for rect in rects:
+            height = rect.get_height()
+            ax.text(rect.get_x()+rect.get_width()/2., 1.05*height, '%d'%int(height), ha= 'center', va= 'bottom')
+    return fig
+
+
+def draw_scatter(x = None, y = None, xlabel = '', ylabel = ''):
+    """ draws a 2d scatterplot of y against x """
+
+    fig = plt.figure()
+    ax = plt.subplot(111)
+    ax.scatter(x, y)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+    return fig
+
+
+def draw_point_cloud(clouds = None):
+    """ draws the camera and the given (label, nx3 array) point sets in 3d """
+
+    fig = plt.figure()
+    ax = fig.gca(projection='3d')
+    ax.scatter3D(0, 0, 0, c = 'm', marker = 'p')
+    ax.grid(True)
+    ax.plot([],[],[],'p',c='m', label='Camera')
+    cl = 'g', 'b', 'r'      # colours
+    m = '+', 'o', '^'       # plot markers
+    s = '1', '4', '1'       # marker sizes
+    for i, (key,v) in enumerate(clouds):
+        ax.scatter3D(v[:,0],v[:,1],v[:,2], c = cl[i], marker = m[i])
+        ax.plot([],[],[],m[i],c=cl[i], label=key)
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    ax.set_zlabel('z')
+    ax.legend()
+    return fig
+
+
+def init_report_worker():
+    """ worker process initialiser: selects the non-interactive backend """
+
+    plt.switch_backend('Agg')
+
+
+def render_figure(job):
+    """ draws the figure of the given (filename, draw, kwargs) job to file """
+
+    filename, draw, kwargs = job
+    fig = draw(**kwargs)
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
 
 class Printer(object):
     """ 
     Contains: convenience functions to extract relevant data for plots and
     stats; plotting and statistics generating functions; and a main routine in
-    "final" that determines the kinds of output to be generated.
+    "final" that determines the kinds of output to be generated. In batch
+    report mode (the report option) the plots are saved to files in the report
+    directory, rendered in parallel, instead of being shown, and the stats are
+    saved with them.
     
     """
 
@@ -39,6 +127,11 @@ class Printer(object):
         
         self.logger = logging.getLogger('Printer')
         self.pipe = pipe
+        self.columns = None
+        self.columns_of = None
+        self.report = getattr(getattr(pipe, 'options', None), 'report', None)
+        self.figures = []
+        self.max_points = 100000
 
 
     def in_loop(self, output):
@@ -53,102 +146,65 @@ class Printer(object):
         return np.arccos(np.dot(a/np.linalg.norm(a),b/np.linalg.norm(b)))
 
 
+    def get_columns(self, outputs):
+        """
+        Returns the Output_Columns of the given outputs, which are gathered
+        once and reused for as long as the same outputs are printed.
+
+        """
+
+        if self.columns is None or self.columns_of is not outputs:
+            self.columns = Output_Columns(outputs)
+            self.columns_of = outputs
+        return self.columns
+
+
     def get_Cs(self, outputs, indices = None):
         """ returns actual marker centres as numpy array """
 
+        Cs = self.get_columns(outputs).C
         if indices:
-            Cs = np.zeros((len(indices), 3))
-            o = [] 
-            for index in indices:
-                o.append(outputs[index])
-            outputs = o
-        else:
-            Cs = np.zeros((len(outputs), 3))
-        for i, output in enumerate(outputs):
-            Cs[i] = output.markers.get_C_mm()
-        return Cs
+            return Cs[list(indices)]
+        return Cs.copy()
 
 
     def get_Ns(self, outputs, indices = None):
         """ returns actual marker normals as numpy array """
 
+        Ns = self.get_columns(outputs).N
         if indices:
-            Ns = np.zeros((len(indices), 3))
-            o = [] 
-            for index in indices:
-                o.append(outputs[index])
-            outputs = o
-        else:
-            Ns = np.zeros((len(outputs), 3))
-        for i, output in enumerate(outputs):
-            Ns[i] = output.markers.get_normal_mm()
-        return Ns
+            return Ns[list(indices)]
+        return Ns.copy()
 
 
     def get_est_Cs(self, outputs):
         """ returns estimated marker centres as numpy array """
 
-        est_Cs = []
-        for i, output in enumerate(outputs):
-            ecs = output.get_est_Cs_flat_mm()
-            if ecs.any():
-                for ec in ecs:
-                    est_Cs.append(ec)
-        return np.array(est_Cs)
+        return self.get_columns(outputs).est_Cs.copy()
 
 
     def get_est_Ns(self, outputs):
         """ returns estimated marker normals as numpy array """
 
-        est_Ns = []
-        for i, output in enumerate(outputs):
-            ens = output.get_est_Ns_flat_mm()
-            if ens.any():
-                for en in ens:
-                    est_Ns.append(en)
-        return np.array(est_Ns)
+        return self.get_columns(outputs).est_Ns.copy()
 
 
     def get_times(self, outputs):
         """ returns ordered array of times elapsed per output """
 
-        times = np.zeros((len(outputs), ))
-        for i, output in enumerate(outputs):
-            times[i] = output.time()
-        return times
+        return self.get_columns(outputs).times.copy()
 
 
     def get_data(self, outputs, get= None, match= False):
         """ 
         Collects data of the required classes for all non-empty output objects
-        into a single dict with nx3 array values. 
+        into a single dict with nx3 array values ('recognition': n values).
         NB: with the 'match' flag set the actual values are repeated as many
         times as there are estimates per output object.
         
         """
 
-        o = outputs[0]
-        temp= o.get_data(stub=True, get= get, match= match)
-
-        nr_vectors = {key:0 for key in get}
-
-        for o in outputs:
-            batch = o.get_data(get= get, match= match)
-            if batch == None:
-                continue
-            for key, value in batch.items():
-                temp[key].append(value)
-                nr_vectors[key] += len(value)
-
-        data = {}
-        for key, value in temp.items():
-            data[key] = np.zeros((nr_vectors[key],3))
-            k = 0
-            for output_vector_set in value:
-                for vector in output_vector_set:
-                    data[key][k] = vector
-                    k += 1
-        return data
+        return self.get_columns(outputs).get(get= get, match= match)
 
 
     def unwrap_cfg(self, options, setting):
@@ -182,8 +238,6 @@ class Printer(object):
         match = (data_cfg == 'matched')
         nr_bins = 100
 
-        plt_data = {xmode:np.zeros((nr_bins,)), ymode:np.zeros((nr_bins,))}
-
         if data_cfg == 'recognition':
             get = kCs, keCs, kNs, krs
         if data_cfg == 'matched':
@@ -192,61 +246,26 @@ class Printer(object):
 
         Y = np.zeros((data[kCs].shape[0],))
         if ymode == 'mean error':
-            for i, (C, eC) in enumerate(zip(data[kCs],data[keCs])):
-                dif = C - eC
-                Y[i] = np.linalg.norm(dif)
+            Y = norms(data[kCs] - data[keCs])
         elif ymode == 'recognition rate':
             Y = data[krs].flatten()
 
         X = np.zeros(data[kCs].shape[0])
-
         if xmode == 'angle':
-            for i, (C, N) in enumerate(zip(data[kCs],data[kNs])):
-                X[i] = self.get_angle(-C,N)
-
+            X = angles(-data[kCs], data[kNs])
         elif xmode == 'distance to cam':
-            for i, C in enumerate(data[kCs]):
-                X[i] = np.linalg.norm(C)
-
-        Xmin, Xmax = np.min(X), np.max(X)
-        bin_bounds, step = np.linspace(Xmin, Xmax, nr_bins+1, retstep= True)
-        plt_data[xmode] = bin_bounds[:-1] # bin boundary values
-        X_bin_indices = np.digitize(X, plt_data[xmode])
-        bincount = np.zeros((nr_bins,))
-
-        bins = [[] for x in xrange(nr_bins)]
-        for i, y in enumerate(Y):
-            plt_data[ymode][X_bin_indices[i]-1] += y
-            bincount[X_bin_indices[i]-1] += 1
-            bins[X_bin_indices[i]-1].append(y)
-        std = np.zeros((nr_bins,))
-        for i in xrange(nr_bins):
-            if bins[i]:
-                std[i] = np.std(bins[i])
-            
-        for i, total in enumerate(plt_data[ymode]):
-            if (1. * total * bincount[i]) == 0:
-                continue
-            plt_data[ymode][i] = total / bincount[i]
-
-        fig = plt.figure()
-        ax = plt.subplot(111)
-        rwidth = step 
-        if ymode == 'recognition rate':
-            rects = ax.bar(plt_data[xmode], plt_data[ymode], rwidth, color='b')
-        else:
-            rects = ax.bar(plt_data[xmode], plt_data[ymode], rwidth, color='b', yerr=std, ecolor='r')
+            X = norms(data[kCs])
 
-        ax.set_title('%s against %s' % (ymode, xmode))
-        ax.set_xlabel(xmode+xmode_unit)
-        ax.set_ylabel(ymode+ymode_unit)
-        ax.grid(True)
-        if data_cfg == 'arecognition':
-            for rect in rects:
-                height = rect.get_height()
-                ax.text(rect.get_x()+rect.get_width()/2., 1.05*height, '%d'%int(height), ha= 'center', va= 'bottom')
+        if not len(X):
+            self.logger.warning('no data for %s against %s histogram' % (ymode, xmode))
+            return
+        bounds, step, _, means, std = binned_stats(X, Y, nr_bins)
 
-        plt.show()
+        title = '%s against %s' % (ymode, xmode)
+        self.plot(title, draw_histogram, bounds = bounds, means = means,
+                width = step, std = None if ymode == 'recognition rate' else std,
+                title = title, xlabel = xmode+xmode_unit, ylabel = ymode+ymode_unit,
+                label_bars = (data_cfg == 'arecognition'))
 
 
     def scatter(self, outputs, options, units, setting):
@@ -267,14 +286,10 @@ class Printer(object):
         match = (data_cfg == 'matched')
         data = self.get_data(outputs, get= get, match= match)
         keys = data.keys()
-        fig = plt.figure()
-        ax = plt.subplot(111)
-        ax.scatter(data[keys[0]][:,2], data[keys[1]][:,2])
-        ax.set_xlabel(keys[0]+' '+xmode+xmode_unit)
-        ax.set_ylabel(keys[1]+' '+ymode+ymode_unit)
-        ax.grid(True)
-        self.logger.info('displaying point cloud')
-        plt.show()
+        self.plot('%s vs %s scatterplot' % (xmode, ymode), draw_scatter,
+                x = self.thin(data[keys[0]][:,2]), y = self.thin(data[keys[1]][:,2]),
+                xlabel = keys[0]+' '+xmode+xmode_unit,
+                ylabel = keys[1]+' '+ymode+ymode_unit)
 
 
     def point_cloud(self, outputs, options, units, setting):
@@ -293,28 +308,107 @@ class Printer(object):
         get = 'actual Cs', 'est. Cs'
         match = (data_cfg == 'matched')
         data = self.get_data(outputs, match= match, get= get)
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
-        ax.scatter3D(0, 0, 0, c = 'm', marker = 'p')
-        ax.grid(True)
-        ax.plot([],[],[],'p',c='m', label='Camera')
-        cl = 'g', 'b', 'r'      # colours
-        m = '+', 'o', '^'       # plot markers
-        s = '1', '4', '1'       # marker sizes
-        for i, (key,v) in enumerate(data.items()):
-            ax.scatter3D(v[:,0],v[:,1],v[:,2], c = cl[i], marker = m[i])
-            ax.plot([],[],[],m[i],c=cl[i], label=key)
-        ax.set_xlabel('x')
-        ax.set_ylabel('y')
-        ax.set_zlabel('z')
-        ax.legend()
-        self.logger.info('displaying point cloud')
+        clouds = [(key, self.thin(v)) for key, v in data.items()]
+        self.plot('point cloud', draw_point_cloud, clouds = clouds)
+
+
+    def thin(self, points):
+        """ 
+        Returns every k-th of the given points, with k such that at most
+        max_points are plotted.
+        
+        """
+
+        step = int(np.ceil(len(points) / float(self.max_points)))
+        if step > 1:
+            self.logger.info('plotting every %d-th of %d points' % (step, len(points)))
+        return points[::max(step, 1)]
+
+
+    def plot(self, name, draw, **kwargs):
+        """
+        Draws and shows the named figure with the given drawing function and
+        arguments or, in batch report mode, keeps it to be saved with the
+        others by save_figures.
+
+        """
+
+        if self.report:
+            self.figures.append((name, draw, kwargs))
+            return
+        self.logger.info('displaying %s' % name)
+        draw(**kwargs)
         plt.show()
 
 
+    def save_figures(self):
+        """
+        Renders the figures kept in batch report mode to png files in the
+        report directory, in a pool of worker processes.
+
+        """
+
+        if not self.figures:
+            return
+        start = time.time()
+        jobs = []
+        for name, draw, kwargs in self.figures:
+            filename = re.sub('[^a-z0-9]+', '_', name.lower()).strip('_') + '.png'
+            jobs.append((os.path.join(self.report, filename), draw, kwargs))
+        nr_workers = min(self.pipe.options.workers or multiprocessing.cpu_count(),
+                len(jobs))
+        pool = multiprocessing.Pool(nr_workers, init_report_worker)
+        try:
+            for filename in pool.imap_unordered(render_figure, jobs):
+                self.logger.info('figure saved to %s' % filename)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        self.figures = []
+        msg = '%d figures rendered in %.1f s by %d workers'
+        self.logger.info(msg % (len(jobs), time.time() - start, nr_workers))
+
+
+    def get_stats(self, outputs, options, setting):
+        """
+        Returns the simulation stats of the selected data, as an ordered dict
+        of values and of ordered dicts of summary statistics.
+
+        """
+
+        _, _, data_cfg = self.unwrap_cfg(options, setting)
+        get = 'actual Cs', 'est. Cs', 'actual Ns', 'est. Ns'
+        match = (data_cfg == 'matched')
+        data = self.get_data(outputs, get= get, match = match)
+
+        dif = data['actual Cs'] - data['est. Cs']
+        dist = norms(dif)
+        dist_to_cam = norms(data['actual Cs'])
+        normal_angles = np.degrees(angles(data['actual Ns'], data['est. Ns']))
+        incidence_angles = np.degrees(angles(data['actual Ns'], -data['actual Cs']))
+
+        stats = OrderedDict()
+        stats['focal length'] = outputs[-1].cam.get_focal_mm()
+        stats['recorded on'] = time.ctime()
+        stats['nr. poses generated'] = len(outputs)
+        stats['nr. estimates'] = data['est. Cs'].shape[0]
+        stats['min depth'] = np.min(data['actual Cs'][:,2])
+        stats['max depth'] = np.max(data['actual Cs'][:,2])
+        stats['distance (C-estC)(mm)'] = summary(dist)
+        stats['difference (C-estC)(mm)'] = OrderedDict([('mean', np.mean(dif, axis=0))])
+        stats['angle (norm, estnorm)(deg)'] = summary(normal_angles)
+        stats['angle of incidence(deg)'] = summary(incidence_angles)
+        stats['distance (marker-cam)(mm)'] = summary(dist_to_cam)
+        return stats
+
+
     def print_stats(self, outputs, options, units, setting):
         """   
-        Prints stats from the selected data, as plain text to stdout.
+        Prints stats from the selected data, as plain text to stdout and, in
+        batch report mode, to stats.json and stats.csv in the report directory.
         'options' determines the types of data available.
         'setting' determines which data types are required
         'units' are the units of measurement strings corresponding to the
@@ -322,66 +416,124 @@ class Printer(object):
         
         """
 
-        _, _, data_cfg = self.unwrap_cfg(options, setting)
-        get = 'actual Cs', 'est. Cs', 'actual Ns', 'est. Ns'
-        match = (data_cfg == 'matched')
-        data = self.get_data(outputs, get= get, match = match)
-        nr_ests = data['est. Cs'].shape[0]
-        normal_angles = np.zeros((nr_ests,))
-        incidence_angles = np.zeros((nr_ests,))
-
-        if self.pipe.options.simulate:
-
-            dist = np.zeros((nr_ests,))
-            dif = np.zeros((nr_ests, 3))
-            dist_to_cam = np.zeros((nr_ests,))
-            for i in xrange(nr_ests):
-                dif[i] = data['actual Cs'][i] - data['est. Cs'][i]
-                dist[i] = np.linalg.norm(dif[i])
-                dist_to_cam[i] = np.linalg.norm(data['actual Cs'][i])
-
-            print '\n --- simulation data ---'
-            print '\n focal length: ',outputs[-1].cam.get_focal_mm()
-            for i in xrange(len(data['actual Cs'])):
-                ci = data['actual Cs'][i]
-                ni = data['actual Ns'][i]
-                eni = data['est. Ns'][i]
-                normal_angles[i] = self.get_angle(ni,eni)
-                incidence_angles[i] = self.get_angle(ni,-ci)
-
-            print '\n --- simulation stats ---'
-            print '\nrecorded on: ',time.ctime()
-            print '\nnr. poses generated: ',len(outputs)
-            print '\nnr. estimates: ',nr_ests
-            print '\nmin depth: ',np.min(data['actual Cs'][:,2])
-            print '\nmax depth: ',np.max(data['actual Cs'][:,2])
-            print '\n-- distance (C-estC)(mm):'
-            print 'max.: ',np.max(dist)
-            print 'min.: ',np.min(dist)
-            print 'mean: ',np.mean(dist)
-            print 'st. dev.: ',np.std(dist)
-            print '\n -- difference (C-estC)(mm):'
-            print 'mean:\n',np.mean(dif, axis=0)
-            print '\n--angle (norm, estnorm)(deg):'
-            print 'max.: ',np.degrees(np.max(normal_angles))
-            print 'min.: ',np.degrees(np.min(normal_angles))
-            print 'mean: ',np.degrees(np.mean(normal_angles))
-            print 'st. dev.: ',np.degrees(np.std(normal_angles))
-            print '\n--angle of incidence(deg):'
-            print 'max.: ',np.degrees(np.max(incidence_angles))
-            print 'min.: ',np.degrees(np.min(incidence_angles))
-            print 'mean: ',np.degrees(np.mean(incidence_angles))
-            print 'st.dev.: ',np.degrees(np.std(incidence_angles))
-            print '\n--distance (marker-cam)(mm):'
-            print 'max.: ',np.max(dist_to_cam)
-            print 'min.: ',np.min(dist_to_cam)
-            print 'mean: ',np.mean(dist_to_cam)
-            print 'st.dev.: ',np.std(dist_to_cam)
-            print '\n'
-
-        else:
+        if not self.pipe.options.simulate:
             print '\n-- printout not configured --\n'
+            return
+
+        stats = self.get_stats(outputs, options, setting)
+        self.print_summary(stats)
+        if self.report:
+            self.write_stats(stats)
+
+
+    def print_summary(self, stats):
+        """
+        Prints the given stats (as returned by get_stats or by
+        Output_Stats.get_stats) as plain text to stdout.
+
+        """
+
+        print '\n --- simulation stats ---'
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                print '\n--%s:' % key
+                for name, v in value.items():
+                    print '%s: ' % name, v
+            else:
+                print '\n%s: ' % key, value
+        print '\n'
+
+
+    def write_stats(self, stats, path = None):
+        """
+        Writes the given stats to stats.json, nested as they are, and to
+        stats.csv, one (section, statistic, value) row per number, in the
+        given directory (default: the report directory).
+
+        """
+
+        path = path or self.report
+        rows = []
+        tree = OrderedDict()
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                tree[key] = OrderedDict()
+                for name, v in value.items():
+                    tree[key][name] = np.asarray(v).tolist()
+                    if np.ndim(v):
+                        for axis, component in zip('xyz', v):
+                            rows.append((key, '%s %s' % (name, axis), component))
+                    else:
+                        rows.append((key, name, v))
+            else:
+                tree[key] = np.asarray(value).tolist()
+                rows.append(('', key, value))
+        filename = os.path.join(path, 'stats.json')
+        with open(filename, 'w') as f:
+            json.dump(tree, f, indent = 2)
+        with open(os.path.join(path, 'stats.csv'), 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(('section', 'statistic', 'value'))
+            writer.writerows(rows)
+        self.logger.info('stats written to %s' % filename)
+
+
+
+    def print_latencies(self):
+        """ 
+        Prints the mean and p50/p95/p99 latencies (ms) of each pipeline stage
+        over the most recent frames, as plain text to stdout.
+
+        """
+
+        timer = getattr(self.pipe, 'timer', None)
+        if timer is None or not timer.nr_frames:
+            return
+        print '\n --- stage latencies (ms) ---\n'
+        print '%-16s %8s %8s %8s %8s %8s' % ('stage', 'frames', 'mean', 'p50', 'p95', 'p99')
+        for stage, n, mean, (p50, p95, p99) in timer.percentiles():
+            print '%-16s %8d %8.2f %8.2f %8.2f %8.2f' % (stage, n, mean*1e3,
+                    p50*1e3, p95*1e3, p99*1e3)
+        print '\n'
+
+
+    def save_outputs(self, outputs, filename):
+        """ 
+        Records the outputs to the given .rec directory (see Output_Recorder),
+        or pickles them to any other filename, unless they were recorded
+        during the run.
+        
+        """
+
+        if isinstance(outputs, Output_Reader):
+            self.logger.info('outputs recorded to %s' % outputs.path)
+            return
+        if filename.endswith('.rec'):
+            recorder = Output_Recorder(path = filename)
+            for output in outputs:
+                recorder.append(output)
+            recorder.close()
+            return
+        pickle.dump(outputs, open(filename, 'wb'))
+        self.logger.info('outputs saved to disk')
+
+
+    def load_outputs(self):
+        """ 
+        Returns the outputs of the replay option's recording directory or
+        sweep result table (default: output/outputs.rec), read lazily and
+        restricted to the range option's records. Falls back on the pickled
+        outputs of older runs if there is no such recording.
+        
+        """
 
+        path = getattr(self.pipe.options, 'replay', None) or 'output/outputs.rec'
+        first, stop = getattr(self.pipe.options, 'range', None) or (0, None)
+        if os.path.exists(path):
+            return Output_Reader(path, first, stop)
+        outputs = pickle.load(open('output/outputs.pickle', 'rb'))[first:stop]
+        self.logger.info('outputs loaded from disk')
+        return outputs
 
 
     def final(self, outputs = None):
@@ -399,19 +551,19 @@ class Printer(object):
         options = {}
         units = {}
         settings = []
+        if self.report and not os.path.isdir(self.report):
+            os.makedirs(self.report)
+        self.print_latencies()
         if not self.pipe.options.simulate:
-            pickle.dump(outputs, open('output/outputs_fwcam.pickle', 'wb'))
-            self.logger.info('outputs saved to disk')
+            self.save_outputs(outputs, 'output/outputs_fwcam.pickle')
             data_cfg = 'estCs'
             if not outputs:
                 return
         else:
             if not outputs:
-                outputs = pickle.load(open('output/outputs.pickle', 'rb'))
-                self.logger.info('outputs loaded from disk')
+                outputs = self.load_outputs()
             else:
-                pickle.dump(outputs, open('output/outputs.pickle', 'wb'))
-                self.logger.info('outputs saved to disk')
+                self.save_outputs(outputs, 'output/outputs.rec')
 
             options['xmodes'] = 'distance to cam','angle', 'depth'
             options['ymodes'] = 'mean error','recognition rate', 'depth'
@@ -435,3 +587,4 @@ class Printer(object):
             settings.append({'xmodes':1,'ymodes':1,'data_cfgs':1})
             for setting in settings:
                 self.histogram(outputs, options, units, setting)
+            self.save_figures()
@@ -0,0 +1,299 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# recorder.py
+"""
+:synopsis:  Contains the Output_Recorder class, which streams compact
+            fixed-width records of the pipeline outputs to a columnar file on
+            disk, and the Output_Reader class, which reads such a file (or a
+            sweep's result table) lazily, by record or in chunks.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import logging
+import os
+import pickle
+import numpy as np
+
+from pipeline_output import Pipeline_Output
+from camera_values import GL_Camera_Vals
+
+
+# the modules whose run times are recorded, in column order
+STAGES = 'ContourFinder', 'EllipseFitter', 'PoseEstimatorA', 'PoseTracker'
+
+
+def get_columns(max_estimates = 8):
+    """
+    Returns the record layout as a list of (name, dtype, shape) tuples.
+    Estimates beyond max_estimates per output are not recorded.
+
+    """
+
+    return [
+            ('pose_index', 'i8', ()),          # -1: not from a pose sequence
+            ('start_time', 'f8', ()),
+            ('end_time', 'f8', ()),
+            ('C', 'f8', (3,)),                  # actual centre (mm)
+            ('N', 'f8', (3,)),                  # actual normal
+            ('nr_estimates', 'i4', ()),
+            ('est_Cs', 'f8', (max_estimates, 3)),
+            ('est_Ns', 'f8', (max_estimates, 3)),
+            ('track_C', 'f8', (3,)),            # tracked centre (mm)
+            ('track_N', 'f8', (3,)),            # tracked normal
+            ('stage_times', 'f8', (len(STAGES),)),
+            ]
+
+
+def fill_record(records, i, output, max_estimates = 8):
+    """
+    Writes the values of the given (completed) output into row i of the given
+    records, which are either a dict of column arrays or a structured array
+    with the columns of get_columns. Returns False if estimates were truncated.
+
+    """
+
+    pose_index = getattr(output, 'pose_index', None)
+    records['pose_index'][i] = -1 if pose_index is None else pose_index
+    records['start_time'][i] = output.start_time
+    records['end_time'][i] = output.end_time
+    C = output.get_C_mm()
+    if output.sim and C is not None:
+        records['C'][i] = C
+        records['N'][i] = output.get_N_mm()
+    else:
+        records['C'][i] = np.nan
+        records['N'][i] = np.nan
+    eCs = output.get_est_Cs_flat_mm()
+    eNs = output.get_est_Ns_flat_mm()
+    n = min(len(eCs), max_estimates)
+    records['nr_estimates'][i] = n
+    records['est_Cs'][i,:n] = eCs[:n]
+    records['est_Ns'][i,:n] = eNs[:n]
+    records['est_Cs'][i,n:] = np.nan
+    records['est_Ns'][i,n:] = np.nan
+    tracked_C = output.get_tracked_C_mm()
+    if tracked_C is None:
+        records['track_C'][i] = np.nan
+        records['track_N'][i] = np.nan
+    else:
+        records['track_C'][i] = tracked_C
+        records['track_N'][i] = output.get_tracked_N_mm()
+    stage_times = getattr(output, 'stage_times', {})
+    for j, stage in enumerate(STAGES):
+        records['stage_times'][i,j] = stage_times.get(stage, np.nan)
+    return len(eCs) <= max_estimates
+
+
+class Output_Recorder(object):
+    """
+    Buffers the records of up to 'window' outputs in preallocated arrays, and
+    appends them to one file per column in the given directory whenever the
+    buffer is full. The layout, camera and number of records are kept in a
+    separate meta file.
+
+    """
+
+    def __init__(self, path = 'output/outputs.rec', window = 1000, max_estimates = 8):
+        """ creates (or empties) the record directory and the buffers """
+
+        self.logger = logging.getLogger('Output_Recorder')
+        self.path = path
+        self.window = window
+        self.max_estimates = max_estimates
+        self.columns = get_columns(max_estimates)
+        self.buffers = {}
+        for name, dtype, shape in self.columns:
+            self.buffers[name] = np.zeros((window,) + shape, dtype = dtype)
+        self.nr_buffered = 0
+        self.nr_records = 0
+        self.nr_truncated = 0
+        self.cam = None
+        self.sim = False
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, dtype, shape in self.columns:
+            open(os.path.join(path, name + '.bin'), 'wb').close()
+        self.write_meta()
+
+
+    def append(self, output):
+        """ adds the record of the given (completed) output to the buffer """
+
+        if self.cam is None:
+            self.cam, self.sim = output.cam, output.sim
+        if not fill_record(self.buffers, self.nr_buffered, output,
+                self.max_estimates):
+            self.nr_truncated += 1
+        self.nr_buffered += 1
+        if self.nr_buffered == self.window:
+            self.flush()
+
+
+    def flush(self):
+        """ appends the buffered records to the column files """
+
+        if not self.nr_buffered:
+            return
+        for name, dtype, shape in self.columns:
+            f = open(os.path.join(self.path, name + '.bin'), 'ab')
+            self.buffers[name][:self.nr_buffered].tofile(f)
+            f.close()
+        self.nr_records += self.nr_buffered
+        self.nr_buffered = 0
+        self.write_meta()
+
+
+    def write_meta(self):
+        """ writes layout, camera and record count, so partial runs are read """
+
+        meta = {
+                'columns': self.columns,
+                'nr_records': self.nr_records,
+                'cam': self.cam,
+                'sim': self.sim,
+                }
+        pickle.dump(meta, open(os.path.join(self.path, 'meta.pickle'), 'wb'))
+
+
+    def close(self):
+        """ flushes the remaining records """
+
+        self.flush()
+        if self.nr_truncated:
+            msg = 'estimates truncated to %d in %d outputs'
+            self.logger.warning(msg % (self.max_estimates, self.nr_truncated))
+        self.logger.info('%d outputs recorded to %s' % (self.nr_records, self.path))
+
+
+class Recorded_Output(Pipeline_Output):
+    """
+    A Pipeline_Output rebuilt from one record, so that the printer can use
+    recorded outputs as it uses live ones.
+
+    """
+
+    __slots__ = ('track_C', 'track_N')
+
+    def __init__(self, reader = None, index = 0):
+        """ reads the values of the given record """
+
+        Pipeline_Output.__init__(self, sim = reader.sim)
+        c = reader.columns
+        self.cam = reader.cam
+        self.start_time = float(c['start_time'][index])
+        self.end_time = float(c['end_time'][index])
+        if 'pose_index' in c and c['pose_index'][index] >= 0:
+            self.pose_index = int(c['pose_index'][index])
+        if not np.isnan(c['C'][index,0]):
+            self.Cs = np.array(c['C'][index:index+1])
+            self.Ns = np.array(c['N'][index:index+1])
+        n = c['nr_estimates'][index]
+        self.est_Cs = np.array(c['est_Cs'][index,:n])
+        self.est_Ns = np.array(c['est_Ns'][index,:n])
+        self.track_C = self.track_N = None
+        if 'track_C' in c and not np.isnan(c['track_C'][index,0]):
+            self.track_C = np.array(c['track_C'][index])
+            self.track_N = np.array(c['track_N'][index])
+        self.stage_times = {}
+        for j, stage in enumerate(STAGES[:c['stage_times'].shape[1]]):
+            self.stage_times[stage] = float(c['stage_times'][index,j])
+
+
+    def get_tracked_C_mm(self):
+        """ returns the recorded tracked centre, or None """
+
+        return None if self.track_C is None else np.copy(self.track_C)
+
+
+    def get_tracked_N_mm(self):
+        """ returns the recorded tracked normal, or None """
+
+        return None if self.track_N is None else np.copy(self.track_N)
+
+
+class Output_Reader(object):
+    """
+    Memory-maps the column files written by an Output_Recorder, or the
+    columns of a sweep's result table (a .npy file), optionally restricted to
+    the records first:stop. Builds a Recorded_Output for each record only
+    when it is accessed, and supports len(), indexing and iteration, like the
+    list of outputs it replaces. For analysis, chunks() reads selected
+    columns in bounded chunks of records, without building any outputs.
+
+    """
+
+    def __init__(self, path = 'output/outputs.rec', first = 0, stop = None):
+        """ reads the meta file (if any) and maps the columns """
+
+        self.logger = logging.getLogger('Output_Reader')
+        self.path = path
+        if path.endswith('.npy'):
+            table = np.load(path, mmap_mode = 'r')
+            nr_records = len(table)
+            self.cam = GL_Camera_Vals()
+            self.sim = True
+            columns = dict((name, table[name]) for name in table.dtype.names)
+        else:
+            meta = pickle.load(open(os.path.join(path, 'meta.pickle'), 'rb'))
+            nr_records = meta['nr_records']
+            self.cam = meta['cam']
+            self.sim = meta['sim']
+            columns = {}
+            for name, dtype, shape in meta['columns']:
+                filename = os.path.join(path, name + '.bin')
+                if nr_records:
+                    columns[name] = np.memmap(filename, dtype = dtype, mode = 'r',
+                            shape = (nr_records,) + shape)
+                else:
+                    columns[name] = np.zeros((0,) + shape, dtype = dtype)
+        first, stop, _ = slice(first, stop).indices(nr_records)
+        self.first = first
+        self.nr_records = max(stop - first, 0)
+        self.columns = {}
+        for name, column in columns.items():
+            self.columns[name] = column[first:first + self.nr_records]
+        msg = '%d outputs found in %s (records %d to %d of %d)'
+        self.logger.info(msg % (self.nr_records, path, first,
+            first + self.nr_records, nr_records))
+
+
+    def __len__(self):
+
+        return self.nr_records
+
+
+    def __getitem__(self, index):
+
+        if index < 0:
+            index += self.nr_records
+        if not 0 <= index < self.nr_records:
+            raise IndexError('record index out of range')
+        return Recorded_Output(reader = self, index = index)
+
+
+    def __iter__(self):
+
+        for index in xrange(self.nr_records):
+            yield Recorded_Output(reader = self, index = index)
+
+
+    def chunks(self, size = 65536, names = None):
+        """
+        Yields (index of first record, dict of column arrays) for successive
+        chunks of at most size records, with only the named columns (default:
+        all), read into memory one chunk at a time.
+
+        """
+
+        names = names or self.columns.keys()
+        for start in xrange(0, self.nr_records, size):
+            stop = min(start + size, self.nr_records)
+            yield start, dict((name, np.array(self.columns[name][start:stop]))
+                    for name in names)
@@ -29,10 +29,22 @@ import Image
 from pipeline_modules import ContourFinder
 from pipeline_modules import EllipseFitter
 from pipeline_modules import PoseEstimatorA
-from simulator import GL_Simulator
-from output import Pipeline_Output, Printer
-from camera_values import Camera_Vals
+from pipeline_modules import PoseTracker
+from simulator import GL_Simulator, Numpy_Simulator, Frame_Ring
+from pipeline_pool import Pipeline_Pool
+from output import Pipeline_Output, Printer, Output_Recorder, Output_Reader, Output_Stats
+from output import Display
+from camera_values import Camera_Vals, GL_Camera_Vals
 from marker import Marker
+from admin_modules.latency import Stage_Timer, monotonic
+
+
+# the stages of the main loop whose latencies are recorded
+STAGES = ('capture', 'sim wait', 'ContourFinder', 'EllipseFitter',
+        'PoseEstimatorA', 'PoseTracker', 'display', 'frame')
+
+# the number of DMA buffers in the camera's ring
+DMA_BUFFERS = 4
 
 
 class Pipeline(object):
@@ -50,7 +62,7 @@ class Pipeline(object):
         self.logger = logging.getLogger('Pipeline')
         self.options = options
         self.logger.info('initialised')
-        self.windows = []
+        self.display = None
         self.modules = []
         self.loops = 0
         self.single_img = False
@@ -60,6 +72,21 @@ class Pipeline(object):
         self.new_output = False
         self.start = time.time()
         self.ellipses = None
+        self.pose_candidates = None
+        self.prev_ellipses = None
+        self.predicted_ellipses = None
+        self.pool = None
+        self.ring = None
+        self.ring_slot = None
+        self.lease = None
+        self.last_frame = None
+        self.frame_period = None
+        self.nr_captured = 0
+        self.nr_dropped = 0
+        self.nr_duplicated = 0
+        self.recorder = None
+        self.stats = Output_Stats()
+        self.timer = Stage_Timer(stages = STAGES)
         self.already_shutting_down = False
 
 
@@ -88,6 +115,8 @@ class Pipeline(object):
         self.end = time.time()
         self.running = False
         self.logger.info('stopping pipeline')
+        if self.pool:
+            self.pool.close()
         if self.options.simulate is not None:
             self.logger.info('waiting for simulator')
             for process in self.processes:
@@ -99,10 +128,13 @@ class Pipeline(object):
     def cleanup(self):
         """ closes any OpenCV windows and/or camera to enable a clean exit """
 
-        for window in self.windows:
-            cv2.destroyWindow(window) # opencv bug: only closes windows at exit
+        if self.display:
+            self.display.stop()
         if hasattr(self, 'fwcam'):
             if self.fwcam:
+                if self.lease is not None:
+                    self.lease.release()
+                    self.lease = None
                 self.fwcam.stop()
         self.logger.info('cleanup completed')
 
@@ -129,10 +161,24 @@ class Pipeline(object):
             if (len(self.modules) > 0) and self.loops > 0:
                 avcts = self.modules[0].nr_conts / self.loops
                 self.modules[0].logger.info('avg contours /img: %f' % avcts)
+                if self.modules[0].track_interval:
+                    msg = 'region searches: %d of %d images'
+                    self.modules[0].logger.info(msg % (self.modules[0].nr_roi_searches, self.loops))
+                if self.modules[0].decimation > 1:
+                    searches = self.modules[0].nr_pyramid_searches
+                    msg = 'pyramid searches: %d of %d images, %f regions /search'
+                    self.modules[0].logger.info(msg % (searches, self.loops,
+                        float(self.modules[0].nr_regions) / max(searches, 1)))
             if (len(self.modules) > 1) and self.loops > 0:
                 avels = self.modules[1].nr_ellipses / (self.loops * 1.0)
                 avmels = self.modules[1].nr_candidates / (self.loops * 1.0)
+                if self.modules[1].prefilter_contours:
+                    saved = self.modules[1].nr_prefiltered / (self.loops * 1.0)
+                    self.modules[1].logger.info('fits saved by contour pre-filter /img: %f' % saved)
                 self.modules[1].logger.info('pre-filter ellipses /img: %f' % avels)
+                poor = self.modules[1].nr_poor_fits / (self.loops * 1.0)
+                self.modules[1].logger.info('poor fits (residual > %.1f px) /img: %f' %
+                        (self.modules[1].max_fit_residual, poor))
                 self.modules[1].logger.info('post-filter ellipses /img: %f' % avmels)
             if len(self.modules) > 2:
                 msg = 'used lopt1 %d times' % self.modules[2].nrlopt1
@@ -141,13 +187,199 @@ class Pipeline(object):
                 self.modules[2].logger.info(msg)
                 msg = 'used lopt3 %d times' % self.modules[2].nrlopt3
                 self.modules[2].logger.info(msg)
+            if len(self.modules) > 3 and self.loops > 0:
+                tracker = self.modules[3]
+                msg = 'tracked %d of %d images (%d without pose solve), %d resets'
+                tracker.logger.info(msg % (tracker.nr_tracked, self.loops,
+                    self.modules[2].nr_skipped, tracker.nr_resets))
+        if self.fwcam and self.nr_captured:
+            msg = 'captured %d images (%s): %d frames dropped (%d by the queue), %d duplicated'
+            self.logger.info(msg % (self.nr_captured, self.options.capture,
+                self.nr_dropped, self.fwcam.frames_dropped, self.nr_duplicated))
+        if self.pool:
+            self.pool.report()
+        self.timer.report(self.logger)
+        if self.options.trace:
+            self.timer.export_trace(self.options.trace)
+        if self.options.simulate is not None and self.stats.nr_outputs:
+            self.stats.save()
+            msg = 'stats of %d outputs (%d estimates) saved to output/stats.pickle'
+            self.logger.info(msg % (self.stats.nr_outputs, self.stats.nr_estimates))
         self.cleanup()
+        outputs = self.outputs
+        if self.recorder:
+            self.recorder.close()
+            outputs = Output_Reader(self.recorder.path)
         printer = Printer(pipe = self)
-        printer.final(outputs = self.outputs)
+        printer.final(outputs = outputs)
         self.logger.info('shutdown completed')
         sys.exit(0)
 
 
+    def record_output(self):
+        """ 
+        Records the latest (completed) output if outputs are being recorded,
+        after which only that output is kept in memory.
+
+        """
+
+        if self.recorder:
+            self.recorder.append(self.outputs[-1])
+            del self.outputs[:-1]
+
+
+    def grab_image(self):
+        """ 
+        Returns the camera's next image, as given by the capture policy:
+        "sample" takes the current image, and the other policies the oldest
+        image in the camera's queue. In zero copy mode this is a view of the
+        camera's DMA buffer, leased until the next call, and otherwise a copy.
+
+        """
+
+        if self.options.capture != 'sample':
+            image = self.fwcam.shot()
+        elif self.options.zerocopy:
+            image = self.fwcam.lease_image()
+        else:
+            image = self.fwcam.current_image
+        self.count_frame(image)
+        if self.options.zerocopy:
+            if self.lease is not None:
+                self.lease.release()
+            self.lease = image
+            return np.asarray(image)
+        elif self.options.capture != 'sample':
+            return np.asarray(image)
+        return np.copy(np.asarray(image))
+
+
+    def count_frame(self, image):
+        """ 
+        Counts the frames skipped since the previous image, from the gap
+        between their bus timestamps, or a duplicate if the image is the
+        previous one (same timestamp and ring buffer position) again.
+
+        """
+
+        key = image.timestamp, image.id
+        if self.last_frame is not None:
+            if key == self.last_frame:
+                self.nr_duplicated += 1
+            elif self.frame_period and image.timestamp:
+                gap = image.timestamp - self.last_frame[0]
+                missed = int(round(gap / self.frame_period)) - 1
+                if missed > 0:
+                    self.nr_dropped += missed
+        self.last_frame = key
+        self.nr_captured += 1
+
+
+    def receive_sim_frame(self, incoming):
+        """ 
+        Returns the image in the frame ring slot named in the given simulator
+        message, and a new output object holding the packed marker poses and
+        the index of the pose in the generator's sequence or table. The
+        slot of the previous image is returned to the simulator, so each image
+        may be used in place until the next one is received.
+
+        """
+
+        _, slot_nr, start_time, config_ids, poses, pose_index = incoming
+        if self.ring_slot is not None:
+            self.ring.release(self.ring_slot)
+        self.ring_slot = slot_nr
+        output = Pipeline_Output(sim = True)
+        output.start_time = start_time
+        output.pose_index = pose_index
+        output.cam_id = self.init_output.cam_id
+        output.set_poses(config_ids, *self.ring.unpack_poses(poses, self.init_output.cam))
+        return self.ring.frame(slot_nr), output
+
+
+    def start_capture(self):
+        """ 
+        Starts the camera with the queue required by the capture policy:
+            sample: no queue; the current image is taken when needed
+            newest: a queue of one image, always replaced by the newest
+            drop-oldest: a bounded queue that drops its oldest image when full
+            lossless: an unbounded queue
+
+        """
+
+        policy = self.options.capture
+        zero_copy = bool(self.options.zerocopy)
+        if policy == 'sample':
+            self.fwcam.start(DMA_BUFFERS, interactive = True, zero_copy = zero_copy)
+        elif policy == 'newest':
+            self.fwcam.start(DMA_BUFFERS, zero_copy = zero_copy, queue_size = 1,
+                    drop_oldest = True)
+        elif policy == 'drop-oldest':
+            queue_size = self.options.queue
+            if zero_copy and queue_size > DMA_BUFFERS - 2:
+                # leave a buffer for the image being processed and one for
+                # the camera to write into
+                queue_size = DMA_BUFFERS - 2
+                msg = 'queue of %d images reduced to %d in zero copy mode'
+                self.logger.warning(msg % (self.options.queue, queue_size))
+            self.fwcam.start(DMA_BUFFERS, zero_copy = zero_copy,
+                    queue_size = queue_size, drop_oldest = True)
+        else:
+            self.fwcam.start(DMA_BUFFERS, zero_copy = zero_copy, queue_size = 0)
+        self.frame_period = 1e6 / self.fwcam.fps
+        self.logger.info('capture policy: %s' % policy)
+
+
+    def next_frame(self):
+        """ 
+        Returns the next image and a new output object from the real or
+        simulated camera, or None if the simulator has sent a stop message.
+
+        """
+
+        if self.fwcam:
+            return self.grab_image(), copy.deepcopy(self.init_output)
+        incoming = self.q2pipe.get()
+        if 'stop' in incoming:
+            return None
+        elif 'simulslot' in incoming:
+            return self.receive_sim_frame(incoming)
+        else:
+            self.logger.error('unknown in queue: \'%s\''% incoming)
+            self.shutdown()
+
+
+    def run_parallel(self):
+        """ 
+        Alternative main loop for the --workers option. Hands each image to
+        the pool of worker processes, which run the modules, and collects the
+        outputs in frame order. Images are not displayed in this mode.
+
+        """
+
+        if self.options.windows:
+            self.logger.warning('no image display with parallel workers')
+        if self.options.simulate is not None:
+            output = self.outputs.pop()
+        else:
+            output = copy.deepcopy(self.init_output)
+        self.pool = Pipeline_Pool(pipe = self, nr_workers = self.options.workers,
+                frame = self.orig)
+        self.pool.submit(self.orig, output)
+        while self.running:
+            frame = self.next_frame()
+            if frame is None:
+                self.running = False
+                continue
+            self.pool.submit(*frame)
+            while self.pool.collect():
+                pass
+            if time.time() - self.start >= self.options.simtime:
+                self.running = False
+        self.pool.close()
+        self.shutdown()
+
+
     def run(self):
         """ 
         Main application function. Starts image stream from real or simulated
@@ -160,31 +392,47 @@ class Pipeline(object):
         """
 
         self.running = True
+        if self.options.record:
+            self.recorder = Output_Recorder(window = self.options.record)
         if self.fwcam and not self.single_img:
-            self.fwcam.start(interactive = True)
+            self.start_capture()
             time.sleep(1)
-            self.orig = np.copy(np.asarray(self.fwcam.current_image))
+            self.orig = self.grab_image()
             self.canv = np.copy(self.orig)
             self.init_output = Pipeline_Output(sim=False)
             self.init_output.cam = Camera_Vals(camera_id = 'chameleon1')
-            self.init_output.markers.append(Marker(cam=self.init_output.cam))
+            self.init_output.markers = [Marker(cam=self.init_output.cam)]
         elif self.options.simulate is not None:
             self.q2sim = multiprocessing.Queue()
             self.q2pipe = multiprocessing.Queue()
             queues = self.q2sim, self.q2pipe
-            args = queues, self.options
-            process = multiprocessing.Process(name='child', target=GL_Simulator, args=args)
+            cam = GL_Camera_Vals()
+            self.ring = Frame_Ring(shape = (cam.iph, cam.ipw))
+            args = queues, self.options, self.ring
+            if self.options.renderer == 'numpy':
+                target = Numpy_Simulator
+            else:
+                target = GL_Simulator
+            process = multiprocessing.Process(name='child', target=target, args=args)
             self.processes.append(process)
             process.start()
             self.init_output = Pipeline_Output(sim = True)
             self.q2sim.put(copy.deepcopy(self.init_output))
+            self.init_output.cam = cam
             incoming = self.q2pipe.get()
             if 'stop' in incoming:
                 self.shutdown()
-            elif 'simulglob' in incoming:
-                _, self.orig, output = incoming
-                self.outputs.append(copy.deepcopy(output))
-                self.init_output.cam = self.outputs[0].cam
+            elif 'simulslot' in incoming:
+                self.orig, output = self.receive_sim_frame(incoming)
+                self.outputs.append(output)
+
+        if self.options.workers and not self.single_img:
+            if self.options.filter:
+                self.logger.warning('no pose filter with parallel workers')
+            if self.options.track:
+                self.logger.warning('no region tracking (-k) with parallel workers')
+            self.logger.info('running with %d workers' % self.options.workers)
+            self.run_parallel()
 
         m = []
         if self.options.nr_modules == 0:
@@ -196,51 +444,71 @@ class Pipeline(object):
                 self.modules.append(EllipseFitter(pipeline = self))
             if self.options.nr_modules >=3:
                 self.modules.append(PoseEstimatorA(pipeline = self))
+                if self.options.filter:
+                    tracker = PoseTracker(pipeline = self, estimator = self.modules[-1])
+                    self.modules[-1].tracker = tracker
+                    self.modules.append(tracker)
         self.logger.info('running with %d modules' % self.options.nr_modules)
 
         if self.options.windows:
-            for module in self.modules:
-                if not (module.__class__.__name__ == 'PoseEstimatorA'):
-                    self.windows.append(module.__class__.__name__)
+            self.display = Display(max_fps = self.options.refresh)
+            self.display.start()
 
         if self.single_img:
             for module in self.modules:
                 module.run()
                 if self.options.windows:
-                    cv2.imshow(module.__class__.__name__, self.canv)
-                    cv2.waitKey(2)
+                    self.display.show(module.__class__.__name__, self.canv)
                     time.sleep(5)
                 self.shutdown()
 
         while self.running:
+            timer = self.timer
+            timer.next_frame()
+            frame_start = monotonic()
             if self.fwcam:
-                self.orig = np.copy(np.asarray(self.fwcam.current_image))
+                self.orig = self.grab_image()
+                timer.add('capture', monotonic() - frame_start)
                 if self.options.windows:
-                    cv2.imshow("original", self.orig)
+                    start = monotonic()
+                    self.display.show('original', self.orig)
+                    timer.add('display', monotonic() - start)
             elif (self.options.simulate is not None) and self.outputs[-1].end_time:
                 incoming = self.q2pipe.get()
+                timer.add('sim wait', monotonic() - frame_start)
                 if 'stop' in incoming:
                     self.running = False
                     continue
-                elif 'simulglob' in incoming:
-                    _, self.orig, output = incoming
-                    self.outputs.append(copy.deepcopy(output))
+                elif 'simulslot' in incoming:
+                    self.orig, output = self.receive_sim_frame(incoming)
+                    self.outputs.append(output)
                     self.new_output = True
                 else:
                     self.logger.error('unknown in queue: \'%s\''% incoming)
                     self.shutdown()
-            self.canv = np.copy(self.orig)
+            if self.options.zerocopy and self.modules:
+                # ContourFinder replaces the canvas without reading it
+                self.canv = self.orig
+            else:
+                self.canv = np.copy(self.orig)
+            stage_times = {}
             for module in self.modules:
-                module.run()
                 classname = module.__class__.__name__
-                if not (self.options.windows and classname == 'PoseEstimatorA'):
-                    cv2.imshow(module.__class__.__name__, self.canv)
+                start = monotonic()
+                module.run()
+                stage_times[classname] = monotonic() - start
+                timer.add(classname, stage_times[classname])
+                if self.options.windows and classname not in ('PoseEstimatorA', 'PoseTracker'):
+                    start = monotonic()
+                    self.display.show(classname, self.canv)
+                    timer.add('display', monotonic() - start)
             self.loops += 1
-            self.outputs[-1].complete()
-            if self.ellipses:
-                self.ellipses = None
-            if self.options.windows:
-                cv2.waitKey(2)
+            self.outputs[-1].stage_times = stage_times
+            self.outputs[-1].complete(stats = self.stats)
+            self.record_output()
+            self.prev_ellipses = self.ellipses
+            self.ellipses = None
+            timer.add('frame', monotonic() - frame_start)
             if time.time() - self.start >= self.options.simtime:
                 self.running = False
         self.shutdown()
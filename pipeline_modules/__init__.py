@@ -3,6 +3,8 @@
 #
 
 from pipeline_module import PipelineModule
+from ellipse_batch import Ellipse_Batch, Pose_Candidates
 from contour import ContourFinder
 from ellipse import EllipseFitter
 from posea import PoseEstimatorA
+from tracker import PoseTracker
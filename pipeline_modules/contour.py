@@ -29,27 +29,192 @@ class ContourFinder(PipelineModule):
     """
 
     def __init__(self, pipeline = None):
-        """ The pipeline logs the number of ellipses.  """
+        """ 
+        The pipeline logs the number of ellipses. Sets the tracking mode
+        parameters: the number of images between full image searches, and the
+        margin around the last ellipses (a factor of their size, plus pixels).
+        Sets the pyramid mode parameters: the decimation factor of the coarse
+        search (1: off), and the minimum length of its contours.
+        
+        """
         
         PipelineModule.__init__(self, pipeline = pipeline)
         self.nr_conts = 0.0
+        self.track_interval = getattr(self.pipe.options, 'track', None) or 0
+        self.roi_margin = 1.5
+        self.roi_min_margin = 16
+        self.max_roi_fraction = 0.5
+        self.since_full_search = 0
+        self.nr_roi_searches = 0
+        self.decimation = max(getattr(self.pipe.options, 'pyramid', None) or 1, 1)
+        self.min_coarse_length = 5
+        self.nr_pyramid_searches = 0
+        self.nr_regions = 0
 
 
-    def run(self):
+    def to_pixels(self, ellipse, cam):
+        """ 
+        Converts an ellipse from the pipeline's representation (see
+        EllipseFitter.convert_representation) back to image pixels. Returns
+        the centre and the larger axis.
+
+        """
+
+        ((x_0, y_0), (b, a), alpha) = ellipse
+        x = x_0 / cam.pixelsize + cam.ipw / 2.
+        y = cam.iph / 2. - y_0 / cam.pixelsize
+        return x, y, max(a, b) / cam.pixelsize
+
+
+    def predict_roi(self):
         """ 
-        Applies the following steps to the pipeline's original image:
+        Returns the region (x0, y0, x1, y1) around the ellipse predicted by
+        the PoseTracker, if any, or else around the ellipses accepted in the
+        previous image, or None if the whole image is to be searched:
+        when tracking is off, when no ellipses were accepted, every
+        track_interval images, or if the region would not be much smaller
+        than the image.
+
+        """
+
+        previous = getattr(self.pipe, 'predicted_ellipses', None)
+        if not previous:
+            previous = getattr(self.pipe, 'prev_ellipses', None)
+        if not self.track_interval or not previous:
+            return None
+        if self.since_full_search >= self.track_interval:
+            return None
+
+        cam = self.pipe.init_output.cam
+        h, w = self.pipe.orig.shape[:2]
+        x0, y0, x1, y1 = w, h, 0, 0
+        for ellipse in previous:
+            x, y, axis = self.to_pixels(ellipse, cam)
+            r = self.roi_margin * axis / 2. + self.roi_min_margin
+            x0, y0 = min(x0, x - r), min(y0, y - r)
+            x1, y1 = max(x1, x + r), max(y1, y + r)
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(w, int(np.ceil(x1))), min(h, int(np.ceil(y1)))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        if (x1 - x0) * (y1 - y0) > self.max_roi_fraction * w * h:
+            return None
+        return x0, y0, x1, y1
+
+
+    def find_contours(self, image, offset = (0, 0)):
+        """ 
+        Applies the following steps to the given image:
             1. contrast stretching
             2. blur
             3. edge detection (Canny)
             4. find contours
             
-        The result is saved to the pipeline's canvas image.
+        Returns the edge image and the contours, shifted by the offset.
+
+        """
+
+        edges = cv2.equalizeHist(image)
+        edges = cv2.GaussianBlur(edges, (7,7), sigma1 = 1.4, sigma2 = 1.4)
+        edges = cv2.Canny(edges, 50, 150)
+        conts, hierarchy = cv2.findContours(edges, cv2.RETR_LIST,
+                cv2.CHAIN_APPROX_TC89_L1, offset = offset)
+        return edges, conts
+
+
+    def merge_regions(self, regions):
+        """ merges overlapping regions (x0, y0, x1, y1) until none overlap """
+
+        regions = list(regions)
+        merged = True
+        while merged:
+            merged = False
+            for i in xrange(len(regions)):
+                for j in xrange(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                        regions[i] = (min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3]))
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+
+    def coarse_regions(self):
+        """ 
+        Returns the regions (x0, y0, x1, y1) of the original image around the
+        contours found in a copy of the image decimated by the decimation
+        factor, with a margin of roi_min_margin pixels and overlapping regions
+        merged; or None if the regions would not be much smaller than the
+        image.
+
+        """
+
+        d = self.decimation
+        h, w = self.pipe.orig.shape[:2]
+        small = cv2.resize(self.pipe.orig, (w // d, h // d),
+                interpolation = cv2.INTER_AREA)
+        edges, conts = self.find_contours(small)
+        m = self.roi_min_margin + d
+        regions = []
+        for cont in conts:
+            if len(cont) < self.min_coarse_length:
+                continue
+            x, y, bw, bh = cv2.boundingRect(cont)
+            regions.append((max(0, x * d - m), max(0, y * d - m),
+                min(w, (x + bw) * d + m), min(h, (y + bh) * d + m)))
+        regions = self.merge_regions(regions)
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        if area > self.max_roi_fraction * w * h:
+            return None
+        return regions
+
+
+    def search_regions(self, regions):
+        """ 
+        Finds the contours in the given regions of the original image only.
+        The edges (outside the regions: black) are saved to the canvas.
+
+        """
+
+        self.pipe.canv = np.zeros_like(self.pipe.orig)
+        self.conts = []
+        for x0, y0, x1, y1 in regions:
+            crop = np.ascontiguousarray(self.pipe.orig[y0:y1, x0:x1])
+            edges, conts = self.find_contours(crop, offset = (x0, y0))
+            self.pipe.canv[y0:y1, x0:x1] = edges
+            self.conts.extend(conts)
+
+
+    def run(self):
+        """ 
+        Finds the contours in the pipeline's original image, or, in tracking
+        mode, only in the region around the ellipses of the previous image.
+        In pyramid mode, a full image search first finds contours in a
+        decimated copy of the image, and then searches only the regions around
+        them at full resolution. The edges (outside the searched regions:
+        black) and contours are saved to the pipeline's canvas image.
 
         """
 
-        self.pipe.canv = cv2.equalizeHist(self.pipe.orig)
-        self.pipe.canv = cv2.GaussianBlur(self.pipe.canv, (7,7), sigma1 = 1.4, sigma2 = 1.4)
-        self.pipe.canv = cv2.Canny(self.pipe.canv, 50, 150)
-        self.conts, hierarchy = cv2.findContours(self.pipe.canv, cv2.RETR_LIST, cv2.CHAIN_APPROX_TC89_L1)
+        roi = self.predict_roi()
+        if roi is None:
+            self.since_full_search = 0
+            regions = None
+            if self.decimation > 1:
+                regions = self.coarse_regions()
+            if regions is None:
+                self.pipe.canv, self.conts = self.find_contours(self.pipe.orig)
+            else:
+                self.nr_pyramid_searches += 1
+                self.nr_regions += len(regions)
+                self.search_regions(regions)
+        else:
+            self.since_full_search += 1
+            self.nr_roi_searches += 1
+            self.search_regions([roi])
         self.nr_conts += len(self.conts) * 1.0
         cv2.drawContours(self.pipe.canv, self.conts, -1, (128, 128, 128))
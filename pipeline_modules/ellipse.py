@@ -14,12 +14,11 @@
 """
 
 import logging
-import copy
 import cv2
 from pipeline_module import PipelineModule
+from ellipse_batch import Ellipse_Batch, pack_ellipses
 import sys
 import numpy as np
-import math
 
 
 class EllipseFitter(PipelineModule):
@@ -27,15 +26,32 @@ class EllipseFitter(PipelineModule):
 
     def __init__(self, pipeline = None):
         """ 
-        Sets ellipse filtering parameters and initialises accounting variables.
+        Sets contour and ellipse filtering parameters and initialises
+        accounting variables. The contour pre-filter is off unless the
+        --prefilter option is given: its area tests also reject the edges of
+        rings seen at a steep angle, which findContours traces on both sides.
         
         """
 
         PipelineModule.__init__(self, pipeline = pipeline)
         self.nr_ellipses = 0.0
         self.nr_candidates = 0
+        self.nr_prefiltered = 0
+        self.nr_poor_fits = 0
+        self.residuals = np.zeros(0)
 
         self.min_contour_length = 10
+        options = getattr(self.pipe, 'options', None)
+        self.prefilter_contours = bool(getattr(options, 'prefilter', None))
+        # contour pre-filter: bounding box side (pixels), roundness (4 pi
+        # area / perimeter^2), convexity (area / hull area), closure gap
+        # (distance between the end points / perimeter)
+        self.min_bbox_side = 4
+        self.min_roundness = 0.05
+        self.min_convexity = 0.4
+        self.max_closure_gap = 0.2
+        # mean Sampson distance (pixels) of a contour to its ellipse
+        self.max_fit_residual = 3.0
         self.max_aspect_ratio = 10.
         self.max_relative_inclination = 30.
         self.max_ctrs_distance = 4.
@@ -46,175 +62,255 @@ class EllipseFitter(PipelineModule):
     def convert_representation(self, ellipses = None):
         """ 
         Converts ellipse attributes to the pipeline's conventions regarding
-        units of measurement and the camera's coordinate basis. 
+        units of measurement and the camera's coordinate basis, in one
+        operation on the packed ellipses. Returns an Ellipse_Batch.
         
         """
 
-        e = copy.deepcopy(ellipses)
-        for i, ellipse in enumerate(e):
-            ((x_0, y_0), (b, a), alpha) = ellipse
-            x_0 -= self.pipe.outputs[-1].cam.ipw / 2.
-            x_0 *= self.pipe.outputs[-1].cam.pixelsize
-            y_0 = self.pipe.outputs[-1].cam.iph - y_0
-            y_0 -= self.pipe.outputs[-1].cam.iph / 2.
-            y_0 *= self.pipe.outputs[-1].cam.pixelsize
-            a *= self.pipe.outputs[-1].cam.pixelsize
-            b *= self.pipe.outputs[-1].cam.pixelsize
-            alpha = math.radians(alpha)
-            e[i] = ((x_0, y_0), (b, a), alpha)
-        return e
-
-
-    def ellipse_to_dict(self, ellipse):
-        """ converts the OpenCV ellipse representation to a dict """
-
-        temp = copy.deepcopy(ellipse)
-        ed = {}
-        ed['minor'], ed['major'] = temp[1][0], temp[1][1]
-        ed['ctr'] = np.asarray(temp[0])
-        ed['alpha'] = temp[2]
-        ed['object'] = ellipse
-        return ed
-
-
-    def larger_smaller(self, a, b):
-        """ returns a and b in the order: largest, smallest """
-
-        if b['major'] > a['major']:
-            return b, a
-        else:
-            return a, b
+        return Ellipse_Batch.pack(ellipses).converted(self.pipe.outputs[-1].cam)
+
 
+    def pack_ellipses(self, ellipses = None):
+        """ 
+        Packs the OpenCV ellipse representation ((x,y),(minor,major),alpha)
+        into an nx5 array with columns x, y, minor, major, alpha.
 
-    def aspect_ratio(self, e):
-        """ returns the aspect ratio of the given ellipse """
+        """
 
-        return abs(e['major'] / e['minor'])
+        return pack_ellipses(ellipses)
 
 
-    def aspect_ratio_ok(self, e):
+    def contour_features(self, conts):
         """ 
-        Tests whether aspect ratio of the given ellipse is within a
-        pre-determined limit
-        
+        Returns, for the given contours, the arrays of their bounding box
+        widths and heights, perimeters, areas and closure gaps (the distance
+        between their first and last points), computed at once over the
+        concatenated contour points.
+
         """
 
-        aspect_ratio = self.aspect_ratio(e)
-        return aspect_ratio <= self.max_aspect_ratio
+        lengths = np.array([len(cont) for cont in conts])
+        starts = np.cumsum(lengths) - lengths
+        points = np.concatenate(conts).reshape((-1, 2)).astype(float)
+        following = np.arange(1, len(points) + 1)
+        following[starts + lengths - 1] = starts
+        step = points[following] - points
+        segments = np.sqrt(np.sum(np.square(step), axis=1))
+        cross = points[:,0] * points[following,1] - points[following,0] * points[:,1]
+
+        lower = np.minimum.reduceat(points, starts)
+        upper = np.maximum.reduceat(points, starts)
+        widths, heights = (upper - lower + 1).T
+        perimeters = np.add.reduceat(segments, starts)
+        areas = np.abs(np.add.reduceat(cross, starts)) / 2.
+        gaps = segments[starts + lengths - 1]
+        return widths, heights, perimeters, areas, gaps
+
+
+    def prefilter(self, conts):
+        """ 
+        Returns the contours that could be the edge of an ellipse, rejecting
+        at once those whose bounding box is too small or too elongated (see
+        max_aspect_ratio), which do not enclose enough area for their
+        perimeter (such as open edge fragments, which findContours traces
+        on both sides), or which are not closed; and then those of the others
+        that are not convex enough.
 
+        """
 
-    def distance_ok(self, a, b):
+        if not conts:
+            return []
+        widths, heights, perimeters, areas, gaps = self.contour_features(conts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roundness = 4. * np.pi * areas / np.square(perimeters)
+            closure = gaps / perimeters
+            elongation = np.maximum(widths, heights) / np.minimum(widths, heights)
+        keep = ((np.minimum(widths, heights) >= self.min_bbox_side) &
+                (elongation <= self.max_aspect_ratio) &
+                (roundness >= self.min_roundness) &
+                (closure <= self.max_closure_gap))
+
+        plausible = []
+        for i in np.flatnonzero(keep):
+            hull_area = cv2.contourArea(cv2.convexHull(conts[i]))
+            if hull_area and areas[i] / hull_area >= self.min_convexity:
+                plausible.append(conts[i])
+        return plausible
+
+
+    def fit_residuals(self, conts, ellipses):
         """ 
-        Tests whether the distance between the centres of the given ellipses is
-        within a pre-determined limit. nb: np.linalg.norm returns an absolute
-        value.
-        
+        Returns the mean Sampson distance (in pixels) of the points of each
+        contour to the (OpenCV) ellipse fitted to it, computed in one pass over
+        the concatenated contour points: the algebraic distance of each point,
+        in the frame of its ellipse, divided by the norm of its gradient.
+
         """
 
-        return np.linalg.norm(a['ctr'] - b['ctr']) <= self.max_ctrs_distance
+        if not conts:
+            return np.zeros(0)
+        lengths = np.array([len(cont) for cont in conts])
+        points = np.concatenate(conts).reshape((-1, 2)).astype(float)
+        packed = np.repeat(self.pack_ellipses(ellipses), lengths, axis=0)
+        x_0, y_0, width, height, alpha = packed.T
+        cos, sin = np.cos(np.radians(alpha)), np.sin(np.radians(alpha))
+        dx, dy = points[:,0] - x_0, points[:,1] - y_0
+        p = (dx * cos + dy * sin) / np.square(width / 2.)
+        q = (dy * cos - dx * sin) / np.square(height / 2.)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            algebraic = p * (dx * cos + dy * sin) + q * (dy * cos - dx * sin) - 1.
+            sampson = np.abs(algebraic) / (2. * np.sqrt(np.square(p) + np.square(q)))
+        starts = np.cumsum(lengths) - lengths
+        return np.add.reduceat(sampson, starts) / lengths
 
 
-    def relative_inclination_ok(self, a, b):
-        """ 
-        Tests whether the difference between the inclinations of the two given
-        ellipses is within a pre-determined limit.
-        This is not used for near-circular ellipses.
-        
-        """
+    def aspect_ratios(self, packed):
+        """ returns the aspect ratios of the given packed ellipses """
 
-        return abs(a['alpha'] - b['alpha']) < self.max_relative_inclination
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.abs(packed[:,3] / packed[:,2])
 
 
-    def sizes_ratio_ok(self, larger = None, smaller = None):
+    def sizes_ratio_bounds(self):
         """ 
-        Tests whether ratio of sizes of given ellipses is within a
-        pre-determined range.
-        
+        Returns the (exclusive) lower and upper bounds of the acceptable ratio
+        of sizes (outer/inner) of a pair of ellipses.
+
         """
 
         outer = self.pipe.outputs[-1].markers[-1].config.outer_circle_diam * 1.
         inner = self.pipe.outputs[-1].markers[-1].config.inner_circle_diam * 1.
         correct_ratio = outer / inner 
-        ratio = abs(larger['major'] / smaller['major'])
-        not_too_small = ratio > (correct_ratio - self.max_sizes_ratio_error[0])
-        not_too_big = ratio < (correct_ratio + self.max_sizes_ratio_error[1])
-        return not_too_small and not_too_big
+        lower = correct_ratio - self.max_sizes_ratio_error[0]
+        upper = correct_ratio + self.max_sizes_ratio_error[1]
+        return lower, upper
 
 
-    def both_circular(self, a, b):
+    def neighbour_pairs(self, ctrs):
         """ 
-        Tests whether given ellipses have an aspect ratio smaller than a pre-determined limit.
-        
-        """
-
-        return (self.aspect_ratio(a) < 1.2) and (self.aspect_ratio(b) < 1.2)
+        Returns index arrays (i, j), i < j, of all pairs of ellipses whose
+        centres lie within max_ctrs_distance of each other, ordered as in a
+        nested loop over i and j. The centres are sorted along the x axis so
+        that each centre is only compared with the window of centres whose x
+        coordinates are within max_ctrs_distance (a sweep-and-prune index).
 
+        """
 
-    def marker_filter(self, ellipses = None):
+        d = self.max_ctrs_distance
+        order = np.argsort(ctrs[:,0], kind='mergesort')
+        xs = ctrs[order,0]
+        lo = np.searchsorted(xs, xs - d, side='left')
+        hi = np.searchsorted(xs, xs + d, side='right')
+        counts = hi - lo
+        total = counts.sum()
+        if total == 0:
+            return np.zeros((0,), dtype=int), np.zeros((0,), dtype=int)
+
+        # expand every window [lo, hi) into explicit (sorted) pair positions
+        firsts = np.repeat(np.arange(len(xs)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        seconds = np.repeat(lo, counts) + offsets
+
+        i, j = order[firsts], order[seconds]
+        keep = i < j
+        i, j = i[keep], j[keep]
+        dists = np.sqrt(np.sum(np.square(ctrs[i] - ctrs[j]), axis=1))
+        keep = dists <= d
+        i, j = i[keep], j[keep]
+        pair_order = np.lexsort((j, i))
+        return i[pair_order], j[pair_order]
+
+
+    def marker_filter(self, ellipses = None, residuals = None):
         """ 
         Compares every ellipse (a) with every other (b), and returns those that
         pass various tests relating to aspect ratio, sizes, location and
-        inclination. 
+        inclination. Pairs are pruned on the distance between their centres
+        before the remaining tests are applied to all pairs at once. The larger
+        ellipse of each matching pair is returned, once, in the order in which
+        a nested loop over (a, b) would first encounter it.
+
+        If the fit residuals of the ellipses (see fit_residuals) are given,
+        ellipses with a residual above max_fit_residual are not compared, and
+        the candidates are returned in order of increasing residual, together
+        with their residuals.
     
         """
 
+        if len(ellipses) < 2:
+            return [] if residuals is None else ([], np.zeros(0))
+
+        packed = self.pack_ellipses(ellipses)
+        aspect = self.aspect_ratios(packed)
+        aspect_ok = aspect <= self.max_aspect_ratio
+        if residuals is not None:
+            aspect_ok &= residuals <= self.max_fit_residual
+        circular = aspect < 1.2
+
+        i, j = self.neighbour_pairs(packed[:,:2])
+        keep = aspect_ok[i] & aspect_ok[j]
+        i, j = i[keep], j[keep]
+
+        # inclination only matters if at least one ellipse is not circular
+        inclination = np.abs(packed[i,4] - packed[j,4])
+        keep = (circular[i] & circular[j]) | (inclination < self.max_relative_inclination)
+        i, j = i[keep], j[keep]
+        if not len(i):
+            return [] if residuals is None else ([], np.zeros(0))
+
+        j_larger = packed[j,3] > packed[i,3]
+        larger = np.where(j_larger, j, i)
+        smaller = np.where(j_larger, i, j)
+        lower, upper = self.sizes_ratio_bounds()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.abs(packed[larger,3] / packed[smaller,3])
+        larger = larger[(ratio > lower) & (ratio < upper)]
+
+        _, first = np.unique(larger, return_index=True)
         candidates = []
+        indices = []
+        for index in larger[np.sort(first)]:
+            if ellipses[index] not in candidates:
+                candidates.append(ellipses[index])
+                indices.append(index)
 
-        for i in xrange(len(ellipses)):
-            conditions = []
-
-            a = self.ellipse_to_dict(ellipses[i])
-            if not self.aspect_ratio_ok(a):
-                continue
-
-            for j in xrange(len(ellipses) - (i+1)):
-                conditions = []
-
-                b = self.ellipse_to_dict(ellipses[j+i+1])
-                larger, smaller = self.larger_smaller(a, b)
-
-                if not self.aspect_ratio_ok(b):
-                    continue
-                if not self.distance_ok(a,b):
-                    continue
-                if not self.both_circular(a,b):
-                    if not self.relative_inclination_ok(a, b):
-                        continue
-                if not self.sizes_ratio_ok(larger, smaller):
-                    continue
-
-                if larger['object'] not in candidates:
-                    candidates.append(larger['object'])
-
-        return candidates
+        if residuals is None:
+            return candidates
+        order = np.argsort(residuals[indices], kind='mergesort')
+        return [candidates[i] for i in order], residuals[indices][order]
 
 
     def run(self):
         """ 
-        The main function. Rejects contours below a pre-determined length;
-        filters the remainder; converts the remaining ellipses to the pipeline's
-        representational convention; and draws these ellipses over the current
-        camera image in an OpenCV window before saving them to the pipeline.
+        The main function. Rejects contours below a pre-determined length and,
+        with --prefilter, those the pre-filter finds implausible; filters the
+        ellipses fitted to the remainder, on their fit residuals among other
+        tests, and ranks them by residual; draws the remaining ellipses over
+        the current camera image in an OpenCV window; and saves them to the
+        pipeline as an Ellipse_Batch in the pipeline's representational
+        convention.
         
         """
 
         ellipses = []
+        plausible = []
         if self.pipe.modules[0].__class__.__name__ == 'ContourFinder':
-            for cont in self.pipe.modules[0].conts:
-                if len(cont) < self.min_contour_length:
-                    continue
+            conts = [cont for cont in self.pipe.modules[0].conts
+                    if len(cont) >= self.min_contour_length]
+            plausible = self.prefilter(conts) if self.prefilter_contours else conts
+            self.nr_prefiltered += len(conts) - len(plausible)
+            for cont in plausible:
                 ellipses.append(cv2.fitEllipse(cont))
             self.nr_ellipses +=  len(ellipses)
         else:
             self.logger.error('no ContourFinder in pipeline')
             self.pipe.shutdown()
 
-        candidates = self.marker_filter(ellipses)
+        residuals = self.fit_residuals(plausible, ellipses)
+        self.nr_poor_fits += np.count_nonzero(residuals > self.max_fit_residual)
+        candidates, self.residuals = self.marker_filter(ellipses, residuals)
         self.nr_candidates += len(candidates)
-        converted_candidates = self.convert_representation(ellipses=candidates)
-
-        self.pipe.ellipses = []
-        for conv_candidate, candidate in zip(converted_candidates, candidates):
+        for candidate in candidates:
             cv2.ellipse(
                     img = self.pipe.canv,
                     box = candidate,
@@ -222,4 +318,5 @@ class EllipseFitter(PipelineModule):
                     thickness = 2,
                     lineType = cv2.CV_AA # antialiased
                     )
-            self.pipe.ellipses.append(conv_candidate)
+        self.pipe.ellipses = self.convert_representation(ellipses=candidates)
+        self.pipe.ellipses.residuals = self.residuals
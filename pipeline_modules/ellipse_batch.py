@@ -0,0 +1,150 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# ellipse_batch.py
+"""
+:synopsis:  Contains the Ellipse_Batch and Pose_Candidates classes, the array
+            representations of the ellipses and candidate poses that
+            EllipseFitter, PoseEstimatorA and PoseTracker pass on to each other
+            through the pipeline.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import numpy as np
+
+
+def pack_ellipses(ellipses = None):
+    """
+    Packs a list of ellipses in the OpenCV representation
+    ((x,y),(minor,major),alpha) into an nx5 array with columns x, y, minor,
+    major, alpha.
+
+    """
+
+    packed = np.array([(x, y, minor, major, alpha) for
+        ((x, y), (minor, major), alpha) in ellipses], dtype = float)
+    return packed.reshape((-1, 5))
+
+
+class Ellipse_Batch(object):
+    """
+    Holds n ellipses as an nx5 array with columns x_0, y_0, b, a, alpha, and
+    optionally their fit residuals. Indexing with an integer (or iteration)
+    gives the ellipse in the tuple representation ((x_0, y_0), (b, a), alpha);
+    any other index gives an Ellipse_Batch of the selected ellipses.
+
+    """
+
+    __slots__ = ('data', 'residuals')
+
+
+    def __init__(self, data = None, residuals = None):
+        """ sets the ellipse array (default: no ellipses) and residuals """
+
+        if data is None:
+            data = np.zeros((0, 5))
+        self.data = data
+        self.residuals = residuals
+
+
+    @classmethod
+    def pack(cls, ellipses = None, residuals = None):
+        """ returns the batch of the given list of ellipse tuples """
+
+        return cls(pack_ellipses(ellipses), residuals)
+
+
+    def __len__(self):
+
+        return len(self.data)
+
+
+    def __getitem__(self, index):
+
+        if isinstance(index, (int, long, np.integer)):
+            x_0, y_0, b, a, alpha = self.data[index]
+            return ((x_0, y_0), (b, a), alpha)
+        residuals = None if self.residuals is None else self.residuals[index]
+        return Ellipse_Batch(self.data[index], residuals)
+
+
+    def __iter__(self):
+
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+    @property
+    def centres(self):
+        """ the nx2 array of centres """
+
+        return self.data[:,0:2]
+
+
+    @property
+    def axes(self):
+        """ the nx2 array of axes (b, a) """
+
+        return self.data[:,2:4]
+
+
+    @property
+    def alpha(self):
+        """ the array of angles """
+
+        return self.data[:,4]
+
+
+    def largest(self):
+        """ returns the index of the ellipse with the largest axis """
+
+        return int(np.argmax(self.axes.max(axis = 1)))
+
+
+    def converted(self, cam = None):
+        """
+        Returns the batch in the pipeline's representation for the given
+        camera (see EllipseFitter.convert_representation): centred on the
+        image centre with the y axis pointing up, scaled by the pixel size,
+        with angles in radians.
+
+        """
+
+        data = self.data * [cam.pixelsize, -cam.pixelsize, cam.pixelsize,
+                cam.pixelsize, np.pi / 180.]
+        data[:,0] -= cam.ipw / 2. * cam.pixelsize
+        data[:,1] += cam.iph / 2. * cam.pixelsize
+        return Ellipse_Batch(data, self.residuals)
+
+
+class Pose_Candidates(object):
+    """
+    Holds the two candidate centres and normals of the circles of n
+    ellipses, as nx2x3 arrays, as found by PoseEstimatorA.
+
+    """
+
+    __slots__ = ('Cs', 'Ns')
+
+
+    def __init__(self, Cs = None, Ns = None):
+        """ sets the candidate arrays (default: no candidates) """
+
+        self.Cs = np.zeros((0, 2, 3)) if Cs is None else Cs
+        self.Ns = np.zeros((0, 2, 3)) if Ns is None else Ns
+
+
+    def __len__(self):
+
+        return len(self.Cs)
+
+
+    def __getitem__(self, index):
+        """ returns the (2x3) candidate centres and normals of one ellipse """
+
+        return self.Cs[index], self.Ns[index]
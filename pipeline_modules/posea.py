@@ -17,10 +17,12 @@
 
 import logging
 import copy
+import sys
+import itertools
 import cv2
 from pipeline_module import PipelineModule
+from ellipse_batch import Ellipse_Batch, Pose_Candidates
 import numpy as np
-from marker import Marker
 import Image
 
 
@@ -35,11 +37,15 @@ class PoseEstimatorA(PipelineModule):
         """ 
         Initialises accounting variables, then sets focal length and circle
         radius values according to whether the camera is simulated or not.
-        The pipeline logs the number of ellipses.
+        The pipeline logs the number of ellipses. A PoseTracker, if set, may
+        have the solve skipped when its prediction matches the ellipses.
         
         """
         
         PipelineModule.__init__(self, pipeline = pipeline)
+        self.tracker = None
+        self.skipped = False
+        self.nr_skipped = 0
         self.nrlopt1 = 0
         self.nrlopt2 = 0
         self.nrlopt3 = 0
@@ -198,6 +204,143 @@ class PoseEstimatorA(PipelineModule):
         return c_result, n_result
 
 
+    def get_quadratics(self, ellipses):
+        """ 
+        Batched version of get_quadratic: returns the nx3x3 stack of ellipse
+        matrices for the given nx5 array of ellipses (x_0, y_0, b, a, alpha).
+
+        """
+
+        x_0, y_0, b, a, alpha = ellipses.T
+
+        if np.any(b == 0.0) or np.any(a == 0.0):
+            i = np.flatnonzero((b == 0.0) | (a == 0.0))[0]
+            self.logger.error('b = %f, a = %f' % (b[i],a[i]))
+            sys.exit(0)
+
+        cos, sin = np.cos(alpha), np.sin(alpha)
+        R_e = np.empty((len(ellipses), 2, 2))
+        R_e[:,0,0], R_e[:,0,1] = cos, -sin
+        R_e[:,1,0], R_e[:,1,1] = sin, cos
+        inv_sq = np.column_stack((1.0 / np.power(a,2), 1.0 / np.power(b,2)))
+        M = np.einsum('nij,nj,nkj->nik', R_e, inv_sq, R_e)
+        X_0 = np.column_stack((x_0, y_0))
+
+        E = np.empty((len(ellipses), 3, 3))
+        E[:,:2,:2] = M
+        E[:,:2,2] = np.einsum('nij,nj->ni', M, X_0)
+        E[:,2,:2] = E[:,:2,2]
+        E[:,2,2] = np.einsum('ni,ni->n', X_0, E[:,:2,2]) - 1.0
+        return E
+
+
+    def get_obl_el_cones(self, E, f):
+        """ batched version of get_obl_el_cone, for an nx3x3 stack E """
+
+        Q = np.copy(E)
+        Q[:,:2,2] /= -f
+        Q[:,2,:2] /= -f
+        Q[:,2,2] /= f*f
+        return Q
+
+
+    def get_chen_eigends(self, Q):
+        """ 
+        Batched version of get_chen_eigend. Uses the symmetric eigensolver on
+        the whole nx3x3 stack, then picks, per ellipse, the first of the three
+        orderings that satisfies Chen et al. eqn. 16. The eigenvectors are
+        always reordered with their eigenvalues. get_chen_eigend pairs the
+        second and third orderings with the eigenvectors in the solver's
+        order, which gives poses off the ellipse's cone (see bench_posea).
+        These orderings only occur for ellipses about as large as the focal
+        length, i.e. for markers very close to the camera.
+
+        """
+
+        l, V = np.linalg.eigh(Q)
+
+        rows = np.arange(len(l))
+        rev_abs_sort_ind = np.argsort(np.power(np.abs(l), -1), axis=1)
+        perms = np.array([[0, 1, 2], [1, 2, 0], [0, 2, 1]])
+        candidates = rev_abs_sort_ind[:, perms]                     # n x 3 x 3
+        l_opts = l[rows[:,None,None], candidates]
+        ok = (l_opts[:,:,0] * l_opts[:,:,1] > 0) & (l_opts[:,:,1] * l_opts[:,:,2] < 0)
+        if not np.all(np.any(ok, axis=1)):
+            self.logger.error('could not satisfy Chen et al. eqn. 16')
+            sys.exit(0)
+        choice = np.argmax(ok, axis=1)
+        self.nrlopt1 += np.sum(choice == 0)
+        self.nrlopt2 += np.sum(choice == 1)
+        self.nrlopt3 += np.sum(choice == 2)
+
+        order = candidates[rows, choice]                            # n x 3
+        l = l_opts[rows, choice]
+        V = V[rows[:,None,None], np.arange(3)[None,:,None], order[:,None,:]]
+        return l, V
+
+
+    def get_all_Cs_Ns(self, l, V, r):
+        """ 
+        Batched version of get_Cs_Ns: evaluates all eight (s1, s2, s3) sign
+        combinations for every ellipse at once. Returns nx8x3 arrays of
+        centres and normals, in the same order as get_Cs_Ns.
+
+        """
+
+        signs = np.array(list(itertools.product([1.0, -1.0], repeat=3)))
+        s1, s2, s3 = signs[:,0], signs[:,1], signs[:,2]
+        l0, l1, l2 = l[:,0:1], l[:,1:2], l[:,2:3]
+
+        z0 = (s3 * l1 * r) / np.sqrt(-l0 * l2)                      # n x 8
+        a = np.sqrt((l0-l1)/(l0-l2))
+        b = np.sqrt((l1-l2)/(l0-l2))
+
+        temp = np.zeros((len(l), 8, 3))
+        temp[:,:,0] = s2 * (l2/l1) * a
+        temp[:,:,2] = -s1 * (l0/l1) * b
+        Cs = z0[:,:,None] * np.einsum('nij,nkj->nki', V, temp)
+
+        temp[:,:,0] = s2 * a
+        temp[:,:,2] = -s1 * b
+        Ns = np.einsum('nij,nkj->nki', V, temp)
+
+        return Cs, Ns
+
+
+    def remove_all_impossible(self, Cs, Ns):
+        """ 
+        Batched version of remove_impossible: masks out the (centre, normal)
+        pairs of markers behind the camera or facing away from it, and returns
+        the remaining two pairs per ellipse as nx2x3 arrays.
+
+        """
+
+        possible = (Ns[:,:,2] < 0.0) & (Cs[:,:,2] > 0.0)
+        if not np.all(np.sum(possible, axis=1) == 2):
+            self.logger.error('nr(candidate (C,N) pairs) not 2')
+            self.pipe.shutdown()
+            sys.exit(1)
+        n = len(Cs)
+        return Cs[possible].reshape((n, 2, 3)), Ns[possible].reshape((n, 2, 3))
+
+
+    def solve(self, ellipses):
+        """ 
+        Returns the two candidate centres and normals (each nx2x3) for the
+        given Ellipse_Batch (or list of ellipses), solving all ellipses at
+        once.
+
+        """
+
+        if not isinstance(ellipses, Ellipse_Batch):
+            ellipses = Ellipse_Batch.pack(ellipses)
+        E = self.get_quadratics(ellipses.data)
+        Q = self.get_obl_el_cones(E, self.focal_length)
+        l, V = self.get_chen_eigends(Q)
+        Cs, Ns = self.get_all_Cs_Ns(l, V, self.radius)
+        return self.remove_all_impossible(Cs, Ns)
+
+
     def run(self):
         """ 
         Proceeds in the following steps:
@@ -212,25 +355,30 @@ class PoseEstimatorA(PipelineModule):
                 eigendecomposition to satisfy equation 16 in Chen et al.
             4.  eliminates the impossible pairs, to obtain two candidate pairs.
 
+        All ellipses of the image are processed together (see solve), and
+        their candidates are saved to the pipeline as Pose_Candidates. The
+        steps are skipped, leaving no estimates, if the tracker accepts its
+        predicted ellipse for this image.
+
         """
 
 
         if not self.pipe.ellipses and (self.pipe.options.simulate is None):
             self.pipe.outputs.append(copy.deepcopy(self.pipe.init_output))
 
-        est_markers = []
-        for ellipse in self.pipe.ellipses:
-            E = self.get_quadratic(ellipse)
-            Q = self.get_obl_el_cone(E, self.focal_length)
-            l, V = self.get_chen_eigend(Q)
-            Cs, Ns = self.get_Cs_Ns(l,V,self.radius)
-            Cs, Ns = self.remove_impossible(Cs, Ns)
-            cam = self.pipe.init_output.cam
-            em = Marker(cam = cam, C = Cs, N = Ns)
-            est_markers.append(em)
+        estimates = None
+        self.pipe.pose_candidates = Pose_Candidates()
+        self.skipped = bool(self.tracker and
+                self.tracker.accepts_prediction(self.pipe.ellipses))
+        if self.skipped:
+            self.nr_skipped += 1
+        elif self.pipe.ellipses:
+            all_Cs, all_Ns = self.solve(self.pipe.ellipses)
+            self.pipe.pose_candidates = Pose_Candidates(all_Cs, all_Ns)
+            estimates = all_Cs, all_Ns
         if self.pipe.options.simulate:
-            self.pipe.outputs[-1].est_markers = est_markers
+            self.pipe.outputs[-1].set(estimates = estimates)
         else:
             output = copy.deepcopy(self.pipe.init_output)
-            output.est_markers = [est_marker]
+            output.set(estimates = estimates)
             self.pipe.outputs.append(output)
@@ -0,0 +1,266 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# tracker.py
+"""
+:synopsis:  Contains the PoseTracker PipelineModule, which follows the pose
+            of a single marker over successive images and resolves the two-fold
+            ambiguity of PoseEstimatorA's estimates.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+import math
+import cv2
+import numpy as np
+from pipeline_module import PipelineModule
+from ellipse_batch import Ellipse_Batch
+
+
+class Alpha_Beta_Track(object):
+    """
+    A constant velocity (alpha-beta) filter over a marker's centre and
+    normal, with the accumulated cost of the measurements assigned to it.
+
+    """
+
+    def __init__(self, C = None, N = None, alpha = 0.5, beta = 0.1):
+        """ starts the track at the given centre and normal, at rest """
+
+        self.C = np.array(C, dtype = float)
+        self.N = np.array(N, dtype = float) / np.linalg.norm(N)
+        self.dC = np.zeros(3)
+        self.dN = np.zeros(3)
+        self.alpha = alpha
+        self.beta = beta
+        self.cost = 0.0
+        self.nr_updates = 0
+
+
+    def predict(self):
+        """ returns the centre and normal predicted for the next image """
+
+        N = self.N + self.dN
+        return self.C + self.dC, N / np.linalg.norm(N)
+
+
+    def distance(self, C, N):
+        """
+        Returns the distance of the given pose(s) from the prediction: the
+        distance between centres relative to the predicted depth, plus one
+        minus the cosine of the angle between the normals.
+
+        """
+
+        Cp, Np = self.predict()
+        dC = np.sqrt(((np.atleast_2d(C) - Cp) ** 2).sum(axis = 1)) / np.linalg.norm(Cp)
+        dN = 1. - np.dot(np.atleast_2d(N), Np) / np.sqrt((np.atleast_2d(N) ** 2).sum(axis = 1))
+        return dC + dN
+
+
+    def update(self, C = None, N = None):
+        """ corrects the prediction with the given pose, or coasts without one """
+
+        Cp, Np = self.predict()
+        if C is None:
+            self.C, self.N = Cp, Np
+            return
+        N = np.asarray(N, dtype = float) / np.linalg.norm(N)
+        rC = C - Cp
+        rN = N - Np
+        self.C = Cp + self.alpha * rC
+        self.dC = self.dC + self.beta * rC
+        N = Np + self.alpha * rN
+        self.N = N / np.linalg.norm(N)
+        self.dN = self.dN + self.beta * rN
+        self.nr_updates += 1
+
+
+class PoseTracker(PipelineModule):
+    """
+    Follows one marker with an Alpha_Beta_Track per candidate pose of its
+    outer ellipse, and keeps the track whose measurements were the most
+    consistent once confirm_frames images have been seen. The confirmed
+    track's (smoothed) pose is saved to the output; its prediction for the
+    next image seeds ContourFinder's search region (see --track) and, when it
+    matches the next image's ellipse to within max_residual pixels, replaces
+    PoseEstimatorA's solve for that image. The pose is then updated with the
+    centre that the ellipse measures, and saved as the image's estimate.
+
+    """
+
+    def __init__(self, pipeline = None, estimator = None):
+        """ sets filter and gating parameters and accounting variables """
+
+        PipelineModule.__init__(self, pipeline = pipeline)
+        self.estimator = estimator
+        self.alpha = 0.5
+        self.beta = 0.1
+        self.confirm_frames = 5
+        self.max_distance = 0.25
+        self.max_misses = 3
+        self.max_residual = 1.0             # pixels
+        self.nr_points = 16
+        self.tracks = []
+        self.misses = 0
+        self.prediction = None
+        self.nr_tracked = 0
+        self.nr_resets = 0
+
+
+    def confirmed(self):
+        """ returns the confirmed track, or None """
+
+        if len(self.tracks) == 1 and self.tracks[0].nr_updates >= self.confirm_frames:
+            return self.tracks[0]
+        return None
+
+
+    def reset(self):
+        """ drops the tracks, after which the next estimates start new ones """
+
+        if self.tracks:
+            self.nr_resets += 1
+        self.tracks = []
+        self.misses = 0
+        self.prediction = None
+
+
+    def project(self, C, N):
+        """
+        Returns the ellipse, in the pipeline's representation (see
+        EllipseFitter.convert_representation), of the circle of the estimator's
+        radius with the given centre and normal. PoseEstimatorA reads the axes
+        of an ellipse as its semi-axes (hence its doubled radius), so the axes
+        of the projection are halved; the ellipse is fitted with the y axis of
+        the image, as EllipseFitter fits it, so that the angles agree.
+
+        """
+
+        f = self.estimator.focal_length
+        r = self.estimator.radius
+        u = np.cross(N, [1., 0., 0.] if abs(N[0]) < 0.9 else [0., 1., 0.])
+        u /= np.linalg.norm(u)
+        v = np.cross(N, u)
+        theta = np.linspace(0., 2. * np.pi, self.nr_points, endpoint = False)
+        points = C + r * (np.outer(np.cos(theta), u) + np.outer(np.sin(theta), v))
+        projected = f * points[:,:2] / points[:,2:3]
+        projected[:,1] *= -1.
+        (x_0, y_0), (b, a), alpha = cv2.fitEllipse(
+                projected.astype(np.float32).reshape((-1, 1, 2)))
+        return ((x_0, -y_0), (b / 2., a / 2.), math.radians(alpha))
+
+
+    def accepts_prediction(self, ellipses):
+        """
+        Returns True if the confirmed track's prediction matches the outer
+        ellipse of the given ellipses, in centre and axes, to within
+        max_residual pixels, so that the pose need not be solved.
+
+        """
+
+        if self.prediction is None or not ellipses or self.confirmed() is None:
+            return False
+        ((x_0, y_0), (b, a), alpha) = ellipses[ellipses.largest()]
+        ((px, py), (pb, pa), palpha) = self.prediction
+        residual = max(abs(x_0 - px), abs(y_0 - py),
+                abs(min(a, b) - min(pa, pb)), abs(max(a, b) - max(pa, pb)))
+        return residual <= self.max_residual * self.pipe.init_output.cam.pixelsize
+
+
+    def measure(self, track):
+        """
+        Returns the centre of the marker that the outer ellipse of the image
+        measures, for a track whose prediction matched it (see
+        accepts_prediction): the ray through the ellipse's centre, at the
+        predicted depth scaled by the ratio of the predicted to the measured
+        major axis.
+
+        """
+
+        ((x_0, y_0), (b, a), alpha) = self.pipe.ellipses[self.pipe.ellipses.largest()]
+        ((px, py), (pb, pa), palpha) = self.prediction
+        f = self.estimator.focal_length
+        Cp, Np = track.predict()
+        depth = Cp[2] * max(pa, pb) / max(a, b)
+        return np.array([x_0 * depth / f, y_0 * depth / f, depth])
+
+
+    def candidates(self):
+        """ returns the (2x3) candidate centres and normals of the outer ellipse """
+
+        candidates = getattr(self.pipe, 'pose_candidates', None)
+        if not candidates or not self.pipe.ellipses:
+            return None, None
+        return candidates[self.pipe.ellipses.largest()]
+
+
+    def update(self, Cs, Ns):
+        """
+        Assigns its nearest candidate to each track (a track without one
+        within max_distance coasts at a cost), and keeps only the cheapest
+        track once the tracks have seen confirm_frames images.
+
+        """
+
+        if not self.tracks:
+            self.tracks = [Alpha_Beta_Track(C, N, self.alpha, self.beta)
+                    for C, N in zip(Cs, Ns)]
+            return
+        for track in self.tracks:
+            distances = track.distance(Cs, Ns)
+            j = np.argmin(distances)
+            if distances[j] <= self.max_distance:
+                track.cost += distances[j]
+                track.update(Cs[j], Ns[j])
+            else:
+                track.cost += self.max_distance
+                track.update()
+        if len(self.tracks) > 1 and self.tracks[0].nr_updates >= self.confirm_frames:
+            self.tracks = [min(self.tracks, key = lambda track: track.cost)]
+
+
+    def run(self):
+        """
+        Updates the tracks with the current estimates (or with the centre
+        that the ellipse measures if PoseEstimatorA skipped its solve), saves
+        the confirmed pose to the output, and predicts the ellipse of the next
+        image.
+
+        """
+
+        output = self.pipe.outputs[-1]
+        if self.estimator.skipped:
+            track = self.tracks[0]
+            track.update(self.measure(track), track.predict()[1])
+        else:
+            Cs, Ns = self.candidates()
+            if Cs is None:
+                self.misses += 1
+                if self.misses > self.max_misses:
+                    self.reset()
+                for track in self.tracks:
+                    track.update()
+            else:
+                self.misses = 0
+                track = self.confirmed()
+                if track is not None and track.distance(Cs, Ns).min() > self.max_distance:
+                    self.reset()
+                self.update(Cs, Ns)
+
+        track = self.confirmed()
+        if track is None:
+            self.prediction = None
+            self.pipe.predicted_ellipses = None
+            return
+        output.tracked_C = track.C.copy()
+        output.tracked_N = track.N.copy()
+        if self.estimator.skipped:
+            output.set(estimates = (track.C[np.newaxis], track.N[np.newaxis]))
+        self.nr_tracked += 1
+        self.prediction = self.project(*track.predict())
+        self.pipe.predicted_ellipses = Ellipse_Batch.pack([self.prediction])
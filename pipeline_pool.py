@@ -0,0 +1,364 @@
+#
+# Milovision: A camera pose estimation programme
+# 
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# pipeline_pool.py
+""" 
+:synopsis:  Contains the Pipeline_Pool class, which runs the pipeline modules
+            on successive frames in a pool of worker processes, and the
+            Pipeline_Worker class, the minimal pipeline that each worker
+            process runs its modules against.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+# standard and third party libraries
+import numpy as np
+import time
+import multiprocessing
+import logging
+from Queue import Empty
+from multiprocessing.sharedctypes import RawArray
+
+# milovision libraries
+from admin_modules.latency import monotonic
+from pipeline_modules import ContourFinder
+from pipeline_modules import EllipseFitter
+from pipeline_modules import PoseEstimatorA
+from output import Output_Stats
+
+
+class Pipeline_Worker(object):
+    """ 
+    Holds the attributes that the pipeline modules expect of a pipeline, for
+    one frame at a time, within a worker process.
+
+    """
+
+    def __init__(self, options = None, init_output = None, index = 0):
+        """ sets logger, options and the initial output object """
+
+        self.logger = logging.getLogger('Pipeline_Worker')
+        self.options = options
+        self.init_output = init_output
+        self.index = index
+        self.modules = []
+        self.outputs = []
+        self.ellipses = None
+        self.pose_candidates = None
+        self.orig = None
+        self.canv = None
+        self.running = True
+        self.stats = Output_Stats()
+        self.nr_frames = 0
+        self.busy = 0.0
+
+
+    def shutdown(self):
+        """ called by modules on failure; stops this worker only """
+
+        self.logger.error('worker %d shutting down' % self.index)
+        self.running = False
+
+
+    def init_modules(self):
+        """ 
+        Initialises the modules once the first output is available, as
+        PoseEstimatorA reads the camera and marker from it.
+        
+        """
+
+        if self.options.nr_modules >=1:
+            self.modules.append(ContourFinder(pipeline = self))
+        if self.options.nr_modules >=2:
+            self.modules.append(EllipseFitter(pipeline = self))
+        if self.options.nr_modules >=3:
+            self.modules.append(PoseEstimatorA(pipeline = self))
+
+
+    def process(self, frame, output):
+        """ runs the modules on the given frame; returns the completed output """
+
+        start = time.time()
+        self.outputs = [output]
+        if not self.modules:
+            self.init_modules()
+        self.orig = frame
+        self.canv = np.copy(self.orig)
+        stage_times = {}
+        for module in self.modules:
+            module_start = monotonic()
+            module.run()
+            stage_times[module.__class__.__name__] = monotonic() - module_start
+        self.ellipses = None
+        output = self.outputs[-1]
+        output.stage_times = stage_times
+        output.complete(stats = self.stats)
+        self.nr_frames += 1
+        self.busy += time.time() - start
+        return output
+
+
+    def counters(self):
+        """ returns the modules' accounting variables, for the shutdown stats """
+
+        counters = {}
+        for module in self.modules:
+            for key in ['nr_conts', 'nr_prefiltered', 'nr_ellipses', 'nr_poor_fits',
+                    'nr_candidates', 'nrlopt1', 'nrlopt2', 'nrlopt3']:
+                if hasattr(module, key):
+                    counters[key] = getattr(module, key)
+        return counters
+
+
+def run_worker(index, options, init_output, slots, shape, dtype, tasks, results,
+        current):
+    """ 
+    Worker process main function. Takes (frame number, slot, output) tasks
+    until it receives None, and runs the modules on the frame in the given
+    shared memory slot. Writes the frame and slot numbers of each task to
+    the shared current array before processing it, so that the pool can
+    reclaim the slot if the worker dies, and stops at the first frame that
+    raises an exception, or once a module has shut the worker down.
+
+    """
+
+    worker = Pipeline_Worker(options = options, init_output = init_output, index = index)
+    frames = [np.frombuffer(slot, dtype = dtype).reshape(shape) for slot in slots]
+    start = time.time()
+    while worker.running:
+        task = tasks.get()
+        if task is None:
+            break
+        frame_nr, slot_nr, output = task
+        current[:] = frame_nr, slot_nr
+        try:
+            output = worker.process(frames[slot_nr], output)
+        except Exception:
+            worker.logger.exception('worker %d failed on frame %d' % (index, frame_nr))
+            results.put(('failed', index, frame_nr, slot_nr))
+            break
+        results.put(('frame', index, frame_nr, slot_nr, output))
+    duration = time.time() - start
+    results.put(('done', index, worker.nr_frames, worker.busy, duration,
+        worker.counters(), worker.stats))
+
+
+class Pipeline_Pool(object):
+    """ 
+    Hands successive frames to a pool of worker processes through shared
+    memory slots, and appends the resulting outputs to the pipeline's outputs
+    in frame order. The frame of a worker that fails or dies is skipped and
+    its slot reclaimed; once no worker is left, the pipeline is stopped.
+
+    """
+
+    def __init__(self, pipe = None, nr_workers = 2, frame = None):
+        """ 
+        Allocates two shared memory slots per worker, each the size of the
+        given frame, and starts the workers.
+
+        """
+
+        self.logger = logging.getLogger('Pipeline_Pool')
+        self.pipe = pipe
+        self.nr_workers = nr_workers
+        self.shape = frame.shape
+        self.dtype = frame.dtype
+        self.slots = [RawArray('B', frame.nbytes) for i in xrange(2 * nr_workers)]
+        self.frames = [np.frombuffer(slot, dtype = self.dtype).reshape(self.shape)
+                for slot in self.slots]
+        self.free_slots = range(len(self.slots))
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.submitted = 0
+        self.next_frame = 0
+        self.pending = {}
+        self.skipped = set()
+        # the slots of the submitted frames without a result, by frame nr
+        self.outstanding = {}
+        # the (frame nr, slot nr) that each worker last took
+        self.current = [RawArray('l', [-1, -1]) for i in xrange(nr_workers)]
+        self.dead = set()
+        self.timeout = 1.0
+        self.failed = False
+        self.stats = {}
+        self.closed = False
+
+        self.processes = []
+        for index in xrange(nr_workers):
+            args = (index, pipe.options, pipe.init_output, self.slots, self.shape,
+                    self.dtype, self.tasks, self.results, self.current[index])
+            process = multiprocessing.Process(name='child', target=run_worker, args=args)
+            self.processes.append(process)
+            process.start()
+        self.logger.info('started %d workers' % nr_workers)
+
+
+    def submit(self, frame, output):
+        """ 
+        Copies the frame into a free slot (waiting for one if necessary) and
+        queues it, with its output object, for the workers. The frame is
+        dropped if no worker is left.
+
+        """
+
+        while not self.free_slots and not self.failed:
+            self.collect(block = True)
+        if self.failed:
+            return
+        slot_nr = self.free_slots.pop()
+        self.frames[slot_nr][:] = frame
+        self.outstanding[self.submitted] = slot_nr
+        self.tasks.put((self.submitted, slot_nr, output))
+        self.submitted += 1
+
+
+    def collect(self, block = False):
+        """ 
+        Handles one message from the workers, if available, and appends any
+        outputs that are now in order to the pipeline's outputs. Returns False
+        if there was no message, after checking for dead workers (see
+        check_workers). A blocking call waits for at most the timeout.
+
+        """
+
+        try:
+            result = self.results.get(block, self.timeout)
+        except Empty:
+            self.check_workers()
+            return False
+        self.handle(result)
+        return True
+
+
+    def handle(self, result):
+        """ handles the given message from a worker """
+
+        if result[0] == 'frame':
+            _, index, frame_nr, slot_nr, output = result
+            if self.outstanding.pop(frame_nr, None) is None:
+                return
+            self.free_slots.append(slot_nr)
+            self.pending[frame_nr] = output
+            self.flush()
+        elif result[0] == 'failed':
+            _, index, frame_nr, slot_nr = result
+            if self.outstanding.pop(frame_nr, None) is None:
+                return
+            self.logger.error('worker %d failed; skipping frame %d' % (index, frame_nr))
+            self.skip(frame_nr, slot_nr)
+        elif result[0] == 'done':
+            _, index, nr_frames, busy, duration, counters, stats = result
+            self.stats[index] = nr_frames, busy, duration, counters
+            self.pipe.stats.merge(stats)
+
+
+    def flush(self):
+        """ appends the outputs that are now in order to the pipeline's outputs """
+
+        while self.next_frame in self.pending or self.next_frame in self.skipped:
+            if self.next_frame in self.skipped:
+                self.skipped.remove(self.next_frame)
+                self.next_frame += 1
+                continue
+            output = self.pending.pop(self.next_frame)
+            self.pipe.timer.next_frame()
+            for stage, seconds in output.stage_times.items():
+                self.pipe.timer.add(stage, seconds)
+            self.pipe.outputs.append(output)
+            self.pipe.record_output()
+            self.pipe.loops += 1
+            self.next_frame += 1
+
+
+    def skip(self, frame_nr, slot_nr):
+        """ gives back the slot of a frame that will not be processed """
+
+        self.free_slots.append(slot_nr)
+        self.skipped.add(frame_nr)
+        self.flush()
+
+
+    def check_workers(self):
+        """ 
+        Handles the workers that have stopped since the last check: skips the
+        frame that a worker was still processing when it died, and reclaims
+        its slot. Once no worker is left, also skips the queued frames, and
+        stops the pipeline with an error.
+
+        """
+
+        stopped = [index for index, process in enumerate(self.processes)
+                if index not in self.dead and not process.is_alive()]
+        if not stopped:
+            return
+        # the last messages of the stopped workers
+        while True:
+            try:
+                self.handle(self.results.get(False))
+            except Empty:
+                break
+        for index in stopped:
+            self.dead.add(index)
+            frame_nr, slot_nr = self.current[index]
+            if frame_nr in self.outstanding:
+                del self.outstanding[frame_nr]
+                self.logger.error('worker %d died; skipping frame %d' % (index, frame_nr))
+                self.skip(frame_nr, slot_nr)
+        if len(self.dead) < self.nr_workers:
+            return
+        self.failed = True
+        for frame_nr, slot_nr in sorted(self.outstanding.items()):
+            self.skip(frame_nr, slot_nr)
+        self.outstanding = {}
+        if not self.closed:
+            self.logger.error('no workers left; stopping the pipeline')
+            self.pipe.running = False
+
+
+    def close(self):
+        """ waits for all queued frames, then stops and joins the workers """
+
+        if self.closed:
+            return
+        self.closed = True
+        for process in self.processes:
+            self.tasks.put(None)
+        while len(self.stats) < self.nr_workers and not self.failed:
+            self.collect(block = True)
+        while self.collect():
+            pass
+        for process in self.processes:
+            process.join()
+        self.logger.info('workers stopped')
+
+
+    def report(self):
+        """ logs per-worker throughput and the modules' combined statistics """
+
+        totals = {}
+        for index, (nr_frames, busy, duration, counters) in sorted(self.stats.items()):
+            rate = nr_frames / duration if duration else 0.0
+            busy_rate = nr_frames / busy if busy else 0.0
+            msg = 'worker %d: %d images, %f fps (%f fps while busy)'
+            self.logger.info(msg % (index, nr_frames, rate, busy_rate))
+            for key, value in counters.items():
+                totals[key] = totals.get(key, 0) + value
+        loops = self.pipe.loops * 1.0
+        if loops and 'nr_conts' in totals:
+            self.logger.info('avg contours /img: %f' % (totals['nr_conts'] / loops))
+        if loops and 'nr_ellipses' in totals:
+            if getattr(self.pipe.options, 'prefilter', None):
+                saved = totals.get('nr_prefiltered', 0) / loops
+                self.logger.info('fits saved by contour pre-filter /img: %f' % saved)
+            self.logger.info('pre-filter ellipses /img: %f' % (totals['nr_ellipses'] / loops))
+            poor = totals.get('nr_poor_fits', 0) / loops
+            self.logger.info('poor fits /img: %f' % poor)
+            self.logger.info('post-filter ellipses /img: %f' % (totals['nr_candidates'] / loops))
+        for key in ['nrlopt1', 'nrlopt2', 'nrlopt3']:
+            if key in totals:
+                self.logger.info('used %s %d times' % (key[2:], totals[key]))
@@ -26,7 +26,7 @@ from _dc1394core import _dll
 from ctypes import *
 
 
-from numpy import fromstring, ndarray
+from numpy import fromstring, frombuffer, ndarray
 from threading import *
 
 from Queue import Queue, Full
@@ -159,17 +159,69 @@ class Image(ndarray):
         "the frame position in the ring buffer"
         return self._id
 
+    @property
+    def leased(self):
+        "True if this image is a view of a leased DMA buffer (zero copy mode)"
+        return getattr(self, '_lease_owner', None) is not None
+
+    def release(self):
+        """
+        Ends the lease on this image in zero copy mode. The DMA buffer is
+        given back to the driver once all leases on it are released and it is
+        no longer the camera's current image; after that the contents of the
+        image are undefined. Does nothing for copied images.
+        """
+        owner = getattr(self, '_lease_owner', None)
+        if owner is None:
+            return
+        self._lease_owner = None
+        owner.release(self._frame)
+
+class FrameQueue(Queue):
+    """
+    The queue of pictures of a camera in serial mode. If drop_oldest is
+    true, a full queue discards (and releases) its oldest picture to make room
+    for a new one, instead of raising Full, and counts it in dropped.
+    """
+    def __init__(self, maxsize = 0, drop_oldest = False):
+        Queue.__init__(self, maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put_frame(self, img):
+        if not self.drop_oldest:
+            self.put_nowait(img)
+            return
+        self.mutex.acquire()
+        try:
+            while self.maxsize > 0 and self._qsize() >= self.maxsize:
+                old = self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+                old.release()
+            self._put(img)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        finally:
+            self.mutex.release()
+
 class _CamAcquisitonThread(Thread):
-    def __init__(self,cam, condition ):
+    def __init__(self,cam, condition, zero_copy = False ):
         """
         This class is created and launched whenever a camera is start()ed.
         It continously acquires the pictures from the camera and sets a
         condition to inform other threads of the arrival of a new picture
+
+        In zero copy mode the pictures are views of the DMA ring buffer
+        instead of copies. A buffer is only given back to the driver when it
+        has been superseded by a newer picture and all leases on it have been
+        released (see Camera.lease_image and Image.release).
         """
         Thread.__init__(self)
 
         self._cam = cam
         self._should_abort = False
+        self._zero_copy = zero_copy
 
         self._last_frame = None
         self._condition = condition
@@ -177,8 +229,66 @@ class _CamAcquisitonThread(Thread):
         #create a lock object from the threading module; see LockType.__doc__
         self._abortLock = Lock()
 
+        # lease counts of the DMA buffers held by consumers, by address
+        self._leases = {}
+        self._leaseLock = Lock()
+
         self.start()
 
+    def _frame_key(self, frame):
+        return cast(frame, c_void_p).value
+
+    def lease(self, img):
+        """
+        Takes a lease on the DMA buffer of the given (zero copy) picture, so
+        that it is not given back to the driver until released. Returns a new
+        view of the picture that holds the lease.
+        """
+        self._leaseLock.acquire()
+        key = self._frame_key(img._frame)
+        current = self._last_frame
+        if not self._leases.get(key) and (current is None or
+                self._frame_key(current) != key):
+            self._leaseLock.release()
+            raise CameraError("The picture's buffer was given back to the driver!")
+        self._leases[key] = self._leases.get(key, 0) + 1
+        self._leaseLock.release()
+        leased = img.view(Image)
+        leased.__dict__.update(img.__dict__)
+        leased._lease_owner = self
+        return leased
+
+    def release(self, frame):
+        """
+        Ends one lease on the given DMA buffer, and gives it back to the
+        driver if it is neither leased nor the current picture.
+        """
+        self._leaseLock.acquire()
+        key = self._frame_key(frame)
+        if not self._leases.get(key):
+            # not leased (any more): the buffer is not ours to give back
+            self._leaseLock.release()
+            return
+        self._leases[key] -= 1
+        if not self._leases[key]:
+            del self._leases[key]
+            current = self._last_frame
+            if current is None or self._frame_key(current) != key:
+                self._cam._dll.dc1394_capture_enqueue(self._cam._cam, frame)
+        self._leaseLock.release()
+
+    def _recycle(self, frame):
+        """
+        Gives the buffer of a superseded picture back to the driver unless
+        it is leased, in which case the last release gives it back.
+        """
+        if not frame:
+            return
+        self._leaseLock.acquire()
+        if not self._leases.get(self._frame_key(frame)):
+            self._cam._dll.dc1394_capture_enqueue(self._cam._cam, frame)
+        self._leaseLock.release()
+
     def abort(self):
         self._abortLock.acquire()
         self._should_abort = True
@@ -197,11 +307,6 @@ class _CamAcquisitonThread(Thread):
             if sa:
                 break
 
-            if self._last_frame:
-                self._cam._dll.dc1394_capture_enqueue(
-                    self._cam._cam, self._last_frame
-                )
-
             #the actual image acquisition:
             frame = POINTER(video_frame_t)()
             self._cam._dll.dc1394_capture_dequeue(self._cam._cam,
@@ -212,35 +317,56 @@ class _CamAcquisitonThread(Thread):
             Dtype = c_char*frame.contents.image_bytes
             buf = Dtype.from_address(frame.contents.image)
 
-            self._last_frame = frame
-
             self._condition.acquire()
             #generate an Image class from the buffer:
-            img = fromstring(buf, dtype=self._cam.mode.dtype).reshape(
-                self._cam.mode.shape
-            ).view(Image)
+            if self._zero_copy:
+                img = frombuffer(buf, dtype=self._cam.mode.dtype).reshape(
+                    self._cam.mode.shape
+                ).view(Image)
+                img._frame = frame
+            else:
+                img = fromstring(buf, dtype=self._cam.mode.dtype).reshape(
+                    self._cam.mode.shape
+                ).view(Image)
 
             img._position, img._packet_size, img._packets_per_frame, \
                 img._timestamp, img._frames_behind, img._id = \
                 frame.contents.position, frame.contents.packet_size, \
                 frame.contents.packets_per_frame, frame.contents.timestamp, \
                 frame.contents.frames_behind,frame.contents.id
+
+            # Publish the new picture. Its predecessor is only given back to
+            # the driver after this, and leases on the current picture are
+            # taken while holding the condition (see Camera.lease_image), so
+            # no consumer can lease a buffer that the driver writes into
+            self._leaseLock.acquire()
+            previous = self._last_frame
+            self._last_frame = frame
+            self._leaseLock.release()
             self._cam._current_img = img
 
             # is the camera streaming to a queue?
-            if self._cam._queue:
-                # Will throw an exception if you're to slow while processing
-                self._cam._queue.put_nowait(img)
+            if self._cam._queue is not None:
+                # The queue holds a lease, to be released by the consumer
+                # Will throw an exception if you're to slow while processing,
+                # unless the queue drops its oldest pictures (as it must in
+                # zero copy mode, see start)
+                if self._zero_copy:
+                    self._cam._queue.put_frame(self.lease(img))
+                else:
+                    self._cam._queue.put_frame(img)
 
             self._condition.notifyAll()
             self._condition.release()
 
+            self._recycle(previous)
+
         # Return the last frame
-        if self._last_frame:
-            self._cam._dll.dc1394_capture_enqueue(
-                self._cam._cam, self._last_frame
-        )
+        self._leaseLock.acquire()
+        last = self._last_frame
         self._last_frame = None
+        self._leaseLock.release()
+        self._recycle(last)
 
 
 ##################################
@@ -615,7 +741,8 @@ class Camera(object):
     def __del__(self):
         self.close()
 
-    def start( self, bufsize = 4, interactive = False ):
+    def start( self, bufsize = 4, interactive = False, zero_copy = False,
+               queue_size = 1000, drop_oldest = False ):
         """
         Start the camera in free running acquisition
 
@@ -625,6 +752,21 @@ class Camera(object):
                       is also much lower.
         interactive - If this is true, shot() is not supported and no queue
                       overrun can occure
+        zero_copy   - If this is true, pictures are views of the DMA buffers
+                      rather than copies. Use lease_image() instead of
+                      current_image, and release() every leased picture and
+                      every picture from shot() once it has been processed.
+                      Buffers that are held back cannot be filled by the
+                      camera, so hold at most bufsize - 1 of them.
+        queue_size  - the number of pictures the queue for shot() holds (0:
+                      unbounded). In zero copy mode the queue must be bounded
+                      to at most bufsize - 2 pictures, which leaves a buffer
+                      for the picture being processed and one for the camera,
+                      and must drop its oldest pictures: a full queue that
+                      raised Full would keep the buffer it was given.
+        drop_oldest - If this is true, a full queue discards its oldest
+                      picture rather than raising Full (see frames_dropped).
+                      A queue of size 1 then always holds the newest picture.
         """
         if self.running:
             return
@@ -632,6 +774,11 @@ class Camera(object):
         if not self._cam:
             raise CameraError("The camera is not opened!")
 
+        if zero_copy and not interactive and \
+                not (drop_oldest and 0 < queue_size <= bufsize - 2):
+            raise CameraError("In zero copy mode the queue must drop its " \
+                    "oldest pictures and hold at most %d!" % (bufsize - 2))
+
         # Set video mode and everything: done by the actual fsets in
         #self.mode, self.isospeed and self.fps
         #self._dll.dc1394_video_set_iso_speed( self._cam, self._wanted_speed )
@@ -643,10 +790,10 @@ class Camera(object):
         # Start the acquisition
         self._dll.dc1394_video_set_transmission( self._cam, 1 )
 
-        self._queue = None if interactive else Queue(1000)
+        self._queue = None if interactive else FrameQueue(queue_size, drop_oldest)
 
         # Now, start the Worker thread
-        self._worker = _CamAcquisitonThread( self, self._new_image )
+        self._worker = _CamAcquisitonThread( self, self._new_image, zero_copy )
 
         self._running_lock.acquire()
         self._running = True
@@ -849,6 +996,26 @@ class Camera(object):
         self._new_image.release()
         return i
 
+    def lease_image(self):
+        """
+        Threadsafe access to the current image of the camera, as a leased
+        view of its DMA buffer (zero copy mode only). The buffer is not given
+        back to the driver until the image's release() method is called.
+        """
+        self._new_image.acquire()
+        self._new_image.wait(3.)
+        i = self._current_img
+        if i is not None and hasattr(i, '_frame'):
+            i = self._worker.lease(i)
+        self._new_image.release()
+        return i
+
+    @property
+    def frames_dropped(self):
+        "The number of pictures the queue discarded to make room for newer ones"
+        queue = getattr(self, '_queue', None)
+        return queue.dropped if queue is not None else 0
+
     @property
     def new_image(self):
         "The Condition to wait for when you want a new Image"
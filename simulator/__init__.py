@@ -3,4 +3,5 @@
 #
 
 from simulator import GL_Simulator
-
+from frame_ring import Frame_Ring
+from numpy_renderer import Marker_Renderer, Numpy_Simulator
@@ -0,0 +1,142 @@
+#
+# Milovision: A camera pose estimation programme
+# 
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# frame_ring.py
+"""
+:synopsis:  Contains the Frame_Ring class, a ring of shared memory image slots
+            through which the simulator passes its images to the pipeline.
+            Only slot numbers and compact marker poses pass through the
+            message queue.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+# standard library and third party packages
+import logging
+import copy
+import multiprocessing
+import numpy as np
+from Queue import Empty
+from multiprocessing.sharedctypes import RawArray
+
+# milovision modules
+from marker import GL_Marker
+
+
+class Marker_Packer(object):
+    """ 
+    Packs markers into compact arrays of their poses, and rebuilds markers
+    from such arrays, from one template marker per config id.
+
+    """
+
+    def __init__(self):
+        """ sets the (empty) template cache """
+
+        self.templates = {}
+
+
+    def pack_markers(self, markers):
+        """ 
+        Returns the config ids of the given markers, and an mx18 array of their
+        centres, normals and (four) vertices.
+        
+        """
+
+        config_ids = []
+        poses = np.zeros((len(markers), 18))
+        for i, marker in enumerate(markers):
+            config_ids.append(marker.config_id)
+            poses[i,0:3] = marker.config.C
+            poses[i,3:6] = marker.config.N
+            poses[i,6:18] = np.ravel(marker.vertices)
+        return config_ids, poses
+
+
+    def unpack_markers(self, config_ids, poses, cam):
+        """ 
+        Rebuilds the markers packed by pack_markers from one template marker
+        per config id, copying only the config and vertices.
+
+        """
+
+        markers = []
+        for config_id, pose in zip(config_ids, poses):
+            if config_id not in self.templates:
+                self.templates[config_id] = GL_Marker(config_id = config_id, cam = cam)
+            marker = copy.copy(self.templates[config_id])
+            marker.config = copy.copy(marker.config)
+            marker.config.C = pose[0:3].copy()
+            marker.config.N = pose[3:6].copy()
+            marker.vertices = pose[6:18].reshape((4, 3)).copy()
+            markers.append(marker)
+        return markers
+
+
+    def unpack_poses(self, poses, cam):
+        """ 
+        Returns the centres and normals (mx3, in mm) of the markers packed by
+        pack_markers, as their GL_Marker's get_C_mm and get_N_mm would,
+        without rebuilding the markers.
+
+        """
+
+        poses = np.asarray(poses, dtype = float).reshape((-1, 18))
+        Cs = poses[:,0:3] * cam.unitsize
+        Ns = poses[:,3:6] * cam.unitsize
+        Cs[:,2] *= -1.
+        Ns[:,2] *= -1.
+        return Cs, Ns
+
+
+class Frame_Ring(Marker_Packer):
+    """ 
+    Holds nr_slots greyscale images of the given shape in shared memory, and
+    a queue of the numbers of the slots that are free for the simulator to
+    draw into. Must be created before the simulator process is started.
+
+    """
+
+    def __init__(self, nr_slots = 8, shape = (960, 1280)):
+        """ allocates the slots and marks them all as free """
+
+        self.logger = logging.getLogger('Frame_Ring')
+        self.nr_slots = nr_slots
+        self.shape = shape
+        size = shape[0] * shape[1]
+        self.buffer = RawArray('B', nr_slots * size)
+        self.frames = np.frombuffer(self.buffer, dtype = np.uint8).reshape(
+                (nr_slots,) + shape)
+        self.free = multiprocessing.Queue()
+        for slot_nr in xrange(nr_slots):
+            self.free.put(slot_nr)
+        Marker_Packer.__init__(self)
+
+
+    def frame(self, slot_nr):
+        """ returns the image in the given slot (a view, not a copy) """
+
+        return self.frames[slot_nr]
+
+
+    def acquire(self, timeout = 0.05):
+        """ 
+        Returns the number of a free slot for the simulator to draw into, or
+        None if no slot became free within the timeout.
+        
+        """
+
+        try:
+            return self.free.get(True, timeout)
+        except Empty:
+            return None
+
+
+    def release(self, slot_nr):
+        """ returns the given slot to the simulator once its image is used """
+
+        self.free.put(slot_nr)
@@ -0,0 +1,277 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# numpy_renderer.py
+"""
+:synopsis:  Contains the Marker_Renderer class, which renders simulated
+            marker images analytically with numpy (a homography per pose and
+            an inverse mapping of the texture), and the Numpy_Simulator class,
+            a simulator process that uses it instead of OpenGL.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+# standard library and third party packages
+import logging
+import numpy as np
+
+# milovision modules
+from marker.markers import GL_Marker_Texture
+from pipeline_modules import PipelineModule
+from camera_values import GL_Camera_Vals
+from simulator import GL_Simulator
+
+
+class Marker_Renderer(object):
+    """
+    Renders greyscale images of GL_Markers as the simulator's OpenGL set-up
+    does: a perspective projection with the camera's vertical field-of-view,
+    bilinear texture sampling clamped to the texture's edges, blending of the
+    texture with GL_ONE, GL_SRC_COLOR onto a 50% grey background, and the ITU-R
+    601-2 luma conversion. Row 0 of an image is its bottom row, as read back
+    from OpenGL.
+
+    """
+
+    def __init__(self, cam = None, shape = None):
+        """ sets the camera, image shape and background """
+
+        self.logger = logging.getLogger('Marker_Renderer')
+        self.cam = cam or GL_Camera_Vals()
+        self.shape = shape or (self.cam.iph, self.cam.ipw)
+        self.background = 128           # glClearColor(0.5, ...) as a byte
+        self.textures = {}
+
+
+    def get_texture(self, file_id):
+        """
+        Returns the texture of the given file as a float array of shape
+        (ysize, xsize, channels) together with its colour; a single channel is
+        kept for textures whose channels are all equal.
+
+        """
+
+        if file_id not in self.textures:
+            texture = GL_Marker_Texture(file_id)
+            rgba = np.frombuffer(texture.raw, dtype = np.uint8).reshape(
+                    (texture.ysize, texture.xsize, 4))
+            rgb = rgba[:,:,:3]
+            if (rgb == rgb[:,:,:1]).all():
+                rgb = rgb[:,:,:1]
+            self.textures[file_id] = (rgb.astype(np.float32) / 255.,
+                    np.array(texture.colour, dtype = np.float32))
+        return self.textures[file_id]
+
+
+    def get_homographies(self, markers):
+        """
+        Returns the nx3x3 homographies that map the texture coordinates (s, t,
+        1) of the given markers onto homogeneous window coordinates. The quad
+        vertices, with texture coordinates (0,1), (1,1), (1,0) and (0,0), span
+        the marker plane, which the camera matrix then projects.
+
+        """
+
+        iph, ipw = self.shape
+        focal = (iph / 2.) / np.tan(np.radians(self.cam.fovy) / 2.)
+        K = np.array([
+            [focal, 0., -ipw / 2.],
+            [0., focal, -iph / 2.],
+            [0., 0., -1.]
+            ])
+        Cs = np.array([marker.config.C for marker in markers], dtype = float)
+        Vs = np.array([marker.vertices for marker in markers], dtype = float)
+        A = np.empty((len(markers), 3, 3))
+        A[:,:,0] = Vs[:,2] - Vs[:,3]
+        A[:,:,1] = Vs[:,0] - Vs[:,3]
+        A[:,:,2] = Cs + Vs[:,3]
+        return np.einsum('ij,njk->nik', K, A)
+
+
+    def get_bounds(self, markers):
+        """
+        Returns, per marker, the (row, column) bounds of the image region
+        its quad projects onto, or None for a marker that is not (wholly) in
+        front of the camera.
+
+        """
+
+        iph, ipw = self.shape
+        focal = (iph / 2.) / np.tan(np.radians(self.cam.fovy) / 2.)
+        bounds = []
+        for marker in markers:
+            P = marker.config.C + marker.vertices
+            depth = -P[:,2]
+            if (depth <= self.cam.znear).any() or (depth >= self.cam.zfar).any():
+                bounds.append(None)
+                continue
+            x = ipw / 2. + focal * P[:,0] / depth
+            y = iph / 2. + focal * P[:,1] / depth
+            j0 = max(int(np.floor(x.min() - 0.5)), 0)
+            j1 = min(int(np.ceil(x.max() + 0.5)), ipw)
+            i0 = max(int(np.floor(y.min() - 0.5)), 0)
+            i1 = min(int(np.ceil(y.max() + 0.5)), iph)
+            if j0 >= j1 or i0 >= i1:
+                bounds.append(None)
+            else:
+                bounds.append((i0, i1, j0, j1))
+        return bounds
+
+
+    def sample(self, texture, s, t):
+        """ samples the texture bilinearly (GL_LINEAR, GL_CLAMP_TO_EDGE) """
+
+        ysize, xsize = texture.shape[:2]
+        u = s * xsize - 0.5
+        v = t * ysize - 0.5
+        u0 = np.floor(u)
+        v0 = np.floor(v)
+        a = (u - u0)[:,None].astype(np.float32)
+        b = (v - v0)[:,None].astype(np.float32)
+        u0 = u0.astype(np.intp)
+        v0 = v0.astype(np.intp)
+        u1 = np.clip(u0 + 1, 0, xsize - 1)
+        v1 = np.clip(v0 + 1, 0, ysize - 1)
+        np.clip(u0, 0, xsize - 1, out = u0)
+        np.clip(v0, 0, ysize - 1, out = v0)
+        top = texture[v0, u0] * (1 - a) + texture[v0, u1] * a
+        bottom = texture[v1, u0] * (1 - a) + texture[v1, u1] * a
+        return top * (1 - b) + bottom * b
+
+
+    def draw(self, image, marker, H, bounds):
+        """ draws one marker, given its homography and bounds, into the image """
+
+        texture, colour = self.get_texture(marker.config.file_id)
+        i0, i1, j0, j1 = bounds
+        ys, xs = np.mgrid[i0:i1, j0:j1]
+        xs = xs.ravel() + 0.5
+        ys = ys.ravel() + 0.5
+        Hinv = np.linalg.inv(H)
+        w = Hinv[2,0] * xs + Hinv[2,1] * ys + Hinv[2,2]
+        s = (Hinv[0,0] * xs + Hinv[0,1] * ys + Hinv[0,2]) / w
+        t = (Hinv[1,0] * xs + Hinv[1,1] * ys + Hinv[1,2]) / w
+        inside = (s >= 0.) & (s <= 1.) & (t >= 0.) & (t <= 1.)
+        if not inside.any():
+            return
+        texel = self.sample(texture, s[inside], t[inside])
+        if (colour == colour[0]).all():
+            texel = texel * colour[0]
+        else:
+            texel = texel * colour
+        # glBlendFunc(GL_ONE, GL_SRC_COLOR): src + dst * src
+        dst = self.background / 255.
+        rgb = np.rint(np.minimum(texel * (1. + dst), 1.) * 255.).astype(np.uint32)
+        if rgb.shape[1] == 1:
+            luma = rgb[:,0]
+        else:
+            luma = (rgb[:,0] * 19595 + rgb[:,1] * 38470 + rgb[:,2] * 7471) >> 16
+        window = image[i0:i1, j0:j1].reshape(-1)
+        window[inside] = luma
+        image[i0:i1, j0:j1] = window.reshape((i1 - i0, j1 - j0))
+
+
+    def render(self, markers, out = None):
+        """
+        Renders the given markers into out (or a new image), far markers
+        first, and returns the image.
+
+        """
+
+        if out is None:
+            out = np.empty(self.shape, dtype = np.uint8)
+        out.fill(self.background)
+        if not markers:
+            return out
+        Hs = self.get_homographies(markers)
+        bounds = self.get_bounds(markers)
+        order = np.argsort([marker.config.C[2] for marker in markers])
+        for index in order:
+            if bounds[index] is not None:
+                self.draw(out, markers[index], Hs[index], bounds[index])
+        return out
+
+
+    def render_batch(self, marker_lists, out = None):
+        """
+        Renders one image per list of markers into out (or a new nxhxw
+        array), computing the homographies of all poses at once.
+
+        """
+
+        n = len(marker_lists)
+        if out is None:
+            out = np.empty((n,) + self.shape, dtype = np.uint8)
+        out.fill(self.background)
+        markers = [marker for markers in marker_lists for marker in markers]
+        if not markers:
+            return out
+        Hs = self.get_homographies(markers)
+        bounds = self.get_bounds(markers)
+        index = 0
+        for k, image_markers in enumerate(marker_lists):
+            indices = np.arange(index, index + len(image_markers))
+            index += len(image_markers)
+            order = np.argsort([marker.config.C[2] for marker in image_markers])
+            for i in indices[order]:
+                if bounds[i] is not None:
+                    self.draw(out[k], markers[i], Hs[i], bounds[i])
+        return out
+
+
+class Numpy_Simulator(GL_Simulator):
+    """
+    A simulator process that renders its images with a Marker_Renderer rather
+    than OpenGL, so that it needs neither a display nor a GL context. It
+    generates poses and talks to the pipeline as GL_Simulator does.
+
+    """
+
+    def __init__(self, queues = None, options = None, ring = None):
+        """ sets the queues, frame ring, camera and renderer """
+
+        PipelineModule.__init__(self, options = options)
+        self.headless = True
+        self.running = True
+        self.q2sim, self.q2pipe = queues
+        self.ring = ring
+        self.markers = []
+        self.output = self.q2sim.get()
+        self.output.cam = GL_Camera_Vals()
+        self.pose_generator = None
+        self.renderer = Marker_Renderer(self.output.cam, ring.shape)
+        if queues:
+            self.main()
+
+
+    def draw(self):
+        """
+        Refreshes the output; obtains new marker poses from the generator;
+        renders them into a free slot of the frame ring; and sends the slot
+        and poses to the pipeline.
+
+        """
+
+        self.refresh_output()
+        if not self.check_messages():
+            return
+        slot_nr = self.ring.acquire()
+        if slot_nr is None:
+            return
+        if not self.next_markers():
+            return
+        self.renderer.render(self.markers, out = self.ring.frame(slot_nr))
+        self.send_to_pipe(slot_nr)
+
+
+    def main(self):
+        """ initialises the markers and draws images until stopped """
+
+        self.init_markers()
+        self.logger.info('rendering with numpy (%dx%d)' % self.ring.shape[::-1])
+        while self.running:
+            self.draw()
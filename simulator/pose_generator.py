@@ -99,114 +99,218 @@ class Linear_Pose_Generator(Pose_Generator):
         return marker
 
 
+class Pose_Batch(object):
+    """ 
+    Holds n marker poses as arrays of centres (nx3), normals (nx3) and
+    vertices (nx4x3), in simulation units. A marker object is only built
+    (from the template marker) when a pose is accessed by index or iteration.
+
+    """
+
+    def __init__(self, template = None, Cs = None, Ns = None, vertices = None):
+        """ sets the template marker and the pose arrays """
+
+        self.template = template
+        self.Cs = Cs
+        self.Ns = Ns
+        self.vertices = vertices
+
+
+    def __len__(self):
+
+        return len(self.Cs)
+
+
+    def __getitem__(self, index):
+
+        marker = copy.copy(self.template)
+        marker.config = copy.copy(self.template.config)
+        marker.config.C = self.Cs[index].copy()
+        marker.config.N = self.Ns[index].copy()
+        marker.vertices = self.vertices[index].copy()
+        return marker
+
+
+    def __iter__(self):
+
+        for index in xrange(len(self)):
+            yield self[index]
+
+
 class Random_Pose_Generator(Pose_Generator):
     """
     Generates random poses, including random orientation, within the given
-    visibility contraints.
+    visibility contraints. Poses are drawn in batches from the generator's own
+    RandomState, so that a given seed always yields the same poses.
     
     """
 
-    def __init__(self, output = None):
-        """ sets range of depths allowed """
+    def __init__(self, output = None, seed = None, batch_size = 1000):
+        """ sets range of depths allowed, random state and batch size """
 
         Pose_Generator.__init__(self, output = output)
         self.tzrange = -10000 / self.output.cam.unitsize
         self.tzrange -= self.init_marker.config.C[2]
+        self.random = np.random.RandomState(seed)
+        self.batch_size = batch_size
+        self.batch = None
+        self.n = 0
+        self.pose_index = -1
 
 
-    def get_angle(self, a, b):
-        """ returns the angle between vectors a and b """
-
-        return np.arccos(np.dot(a/np.linalg.norm(a),b/np.linalg.norm(b)))
+    def get_rotations(self, Ns):
+        """ 
+        Returns the nx3x3 rotations that map the initial marker normal onto
+        the given (unit) normals, each after a uniformly random spin about the
+        initial normal. The rotation maps the frame [e1, e2, n0] of the initial
+        normal n0 onto a frame [b1, b2, n] of the new normal n.
 
+        """
 
-    def get_rotation(self, angle, axis):
+        n = len(Ns)
+        n0 = self.init_marker.config.N / np.linalg.norm(self.init_marker.config.N)
+        helper = np.array([1., 0., 0.]) if abs(n0[0]) < 0.9 else np.array([0., 1., 0.])
+        e1 = np.cross(helper, n0)
+        e1 /= np.linalg.norm(e1)
+        e2 = np.cross(n0, e1)
+        F0 = np.column_stack((e1, e2, n0))
+
+        helpers = np.zeros((n, 3))
+        along_x = np.abs(Ns[:,0]) >= 0.9
+        helpers[~along_x,0] = 1.
+        helpers[along_x,1] = 1.
+        b1 = np.cross(helpers, Ns)
+        b1 /= np.sqrt((b1 ** 2).sum(axis = 1))[:,None]
+        b2 = np.cross(Ns, b1)
+        spin = self.random.uniform(0., 2. * np.pi, n)[:,None]
+        b1, b2 = np.cos(spin) * b1 + np.sin(spin) * b2, \
+                -np.sin(spin) * b1 + np.cos(spin) * b2
+        F1 = np.concatenate((b1[:,:,None], b2[:,:,None], Ns[:,:,None]), axis = 2)
+        return np.einsum('nij,kj->nik', F1, F0)
+
+
+    def generate_poses(self, n):
         """ 
-        Returns a rotation matrix corresponding to the given angle and axis 
+        Returns the centres (nx3), normals (nx3) and vertices (nx4x3) of n
+        random poses. Translations are within the camera's field of view, as
+        before. Normals are drawn uniformly from the cone of directions within
+        maxangle of the direction from the marker to the camera (so that the
+        marker faces the camera), rather than by rejection sampling.
+
+        Variables:
+            tx/ty/tz: marker translations
+            axes: unit vectors from the markers towards the camera (-C)
+            cos_a, phi: polar and azimuthal angles of the normals in the cone
         
         """
 
-        if axis == 'x':
-            return np.array([
-                [1.0, 0.0, 0.0],
-                [0.0, np.cos(angle), -np.sin(angle)],
-                [0.0, np.sin(angle), np.cos(angle)]
-                ])
-        elif axis == 'y':
-            return np.array([
-                [np.cos(angle), 0.0, np.sin(angle)],
-                [0.0, 1.0, 0.0],
-                [-np.sin(angle), 0.0, np.cos(angle)]
-                ])
-        elif axis == 'z':
-            return np.array([
-                [np.cos(angle), -np.sin(angle), 0.0],
-                [np.sin(angle), np.cos(angle), 0.0],
-                [0.0, 0.0, 1.0]
-                ])
-        else:
-            self.logger.error('invalid axis for rotation')
-            sys.exit(1)
-            
+        C0 = self.init_marker.config.C
+        u = self.random.uniform(size = (n, 3))
+        tz = C0[2] + u[:,0] * self.tzrange
+        txrange = -(tz - C0[2]) * self.tanx
+        tx = 2. * u[:,1] * txrange - txrange
+        tyrange = -(tz - C0[2]) * self.tany
+        ty = 2. * u[:,2] * tyrange - tyrange
+        Cs = np.column_stack((tx, ty, tz))
+
+        axes = -Cs / np.sqrt((Cs ** 2).sum(axis = 1))[:,None]
+        cos_a = self.random.uniform(np.cos(self.maxangle), 1., n)
+        sin_a = np.sqrt(1. - cos_a ** 2)
+        phi = self.random.uniform(0., 2. * np.pi, n)
+        helpers = np.zeros((n, 3))
+        along_x = np.abs(axes[:,0]) >= 0.9
+        helpers[~along_x,0] = 1.
+        helpers[along_x,1] = 1.
+        p = np.cross(helpers, axes)
+        p /= np.sqrt((p ** 2).sum(axis = 1))[:,None]
+        q = np.cross(axes, p)
+        Ns = cos_a[:,None] * axes
+        Ns += (sin_a * np.cos(phi))[:,None] * p
+        Ns += (sin_a * np.sin(phi))[:,None] * q
+
+        R = self.get_rotations(Ns)
+        vertices = np.einsum('nij,kj->nki', R, self.init_marker.vertices)
+        Ns = Ns * np.linalg.norm(self.init_marker.config.N)
+        return Cs, Ns, vertices
+
+
+    def generate_batch(self, n):
+        """ returns a Pose_Batch of n random poses """
+
+        Cs, Ns, vertices = self.generate_poses(n)
+        return Pose_Batch(self.init_marker, Cs, Ns, vertices)
 
-    def rotate(self, a, r):
-        """ 
-        Applies a succession of rotations, each around one axis and stored in
-        order in the array r, to a point. The result is a 3D rotation of the
-        point.
 
-        """
+    def generate(self):
+        """ returns the marker of the next random pose, drawn in batches """
 
-        result = np.copy(a)
-        for rotation in r:
-            result = np.dot(rotation, result)
-        return result
+        if self.batch is None or self.n == len(self.batch):
+            self.batch = self.generate_batch(self.batch_size)
+            self.n = 0
+        marker = self.batch[self.n]
+        self.n += 1
+        self.pose_index += 1
+        return marker
 
 
-    def generate(self):
-        """ 
-        Applies an arbitrary 3D rotation and translation to the points in
-        corners_3d, within a visibility constraint.
+class File_Pose_Generator(Pose_Generator):
+    """ 
+    Streams the poses of a precomputed pose table, in order, from a
+    memory-mapped .npy file. A table row holds a pose in simulation units,
+    either as the centre, normal and four vertices (18 values, the layout of
+    Marker_Packer and of the sweep's poses.npy), or as the centre, normal and
+    a row-major rotation of the initial marker's vertices (15 values).
 
-        Visibility constraint: first, translation must be within camera field of
-        view (fov); second, rotation must not map to a marker that is too
-        edge-on or that is facing away.
+    """
+
+    def __init__(self, output = None, filename = None, first = 0, stop = None):
+        """ maps the table, and sets the range of rows to stream """
+
+        Pose_Generator.__init__(self, output = output)
+        self.filename = filename
+        self.table = np.load(filename, mmap_mode = 'r')
+        if self.table.ndim != 2 or self.table.shape[1] not in (15, 18):
+            raise ValueError('not a pose table: %s' % filename)
+        nr_poses = len(self.table)
+        self.first = min(first, nr_poses)
+        self.stop = nr_poses if stop is None else min(stop, nr_poses)
+        self.index = self.first
+        self.pose_index = None
+
+
+    def __len__(self):
+
+        return len(self.table)
+
+
+    def get_batch(self, first, stop):
+        """ 
+        Returns a Pose_Batch of the poses in the given range of rows, read
+        from the mapped table only when accessed.
 
-        Variables:
-            tzlim/txlim/tylim: marker translation limits to remain in camera fov
-            tx/ty/tz: marker translation
-            z: z-axis unit vector
-            mn: marker normal
-            mc: marker centre
-            vis_threshold: maximum angle(mn, z) where marker visible (72deg)
-            r: array of three rotation matrices (x, y, z)
-        
         """
 
-        tz = self.init_marker.config.C[2] + np.random.uniform() * self.tzrange 
+        rows = self.table[first:stop]
+        if self.table.shape[1] == 18:
+            vertices = rows[:,6:18].reshape((len(rows), 4, 3))
+        else:
+            R = np.array(rows[:,6:15]).reshape((len(rows), 3, 3))
+            vertices = np.einsum('nij,kj->nki', R, self.init_marker.vertices)
+        return Pose_Batch(self.init_marker, rows[:,0:3], rows[:,3:6], vertices)
+
 
-        txrange = -(tz - self.init_marker.config.C[2]) * self.tanx
-        tx = 2. * np.random.uniform() * txrange - txrange
+    def seek(self, index):
+        """ makes the pose with the given index the next one to be generated """
 
-        tyrange = -(tz - self.init_marker.config.C[2]) * self.tany
-        ty = 2. * np.random.uniform() * tyrange - tyrange
+        self.index = index
 
-        t = np.array([tx, ty, tz])
-        marker = copy.deepcopy(self.init_marker)
-        marker.config.C = copy.deepcopy(t)
-
-        a = self.get_angle(marker.config.C, -marker.config.N)
-
-        r = None
-        while (not r) or (a > (self.maxangle)):
-            r = []
-            for axis in ['x', 'y', 'z']:
-                angle = np.random.uniform() * 2.0 * np.pi
-                r.append(self.get_rotation(angle, axis))
-                N = copy.deepcopy(self.init_marker.config.N)
-            marker.config.N = self.rotate(N, r)
-            a = self.get_angle(marker.config.C, -marker.config.N)
-
-        for i, vertex in enumerate(marker.vertices):
-            marker.vertices[i] = self.rotate(vertex, r)
+
+    def generate(self):
+        """ returns the marker of the next pose in the range, or None """
+
+        if self.index >= self.stop:
+            return None
+        marker = self.get_batch(self.index, self.index + 1)[0]
+        self.pose_index = self.index
+        self.index += 1
         return marker
@@ -20,29 +20,27 @@
 from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
-import Image
-import StringIO
 import numpy as np
 import sys
 import time
-import copy
 
 # milovision modules
 from pipeline_modules import PipelineModule
 from marker import GL_Marker
 from camera_values import GL_Camera_Vals
 from pose_generator import Linear_Pose_Generator, Random_Pose_Generator
+from pose_generator import File_Pose_Generator
 
 
 class GL_Simulator(PipelineModule):
     """ note that the simulator is a pipeline module """
 
 
-    def __init__(self, queues = None, options = None):
+    def __init__(self, queues = None, options = None, ring = None):
         """ 
         Sets OpenGL machine state; message queues to and from the pipeline;
-        camera; pose generator; initial model-view matrix; and optionally starts
-        up the main function.
+        shared memory frame ring; camera; pose generator; initial model-view
+        matrix; and optionally starts up the main function.
         See images directory for all possible markers 
         Variables:
             iph: image height in pixels (similarly ipw)
@@ -51,6 +49,10 @@ class GL_Simulator(PipelineModule):
         """
 
         PipelineModule.__init__(self, options = options)
+        self.headless = getattr(options, 'headless', False)
+        self.running = True
+        if self.headless:
+            self.init_offscreen(ring.shape)
         glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
         glHint(GL_LINE_SMOOTH_HINT, GL_NICEST)
         glHint(GL_POINT_SMOOTH_HINT, GL_NICEST)
@@ -63,6 +65,8 @@ class GL_Simulator(PipelineModule):
         glClearColor(0, 0, 0, 0.)
 
         self.q2sim, self.q2pipe = queues
+        self.ring = ring
+        self.markers = []
         self.output = self.q2sim.get()
         self.output.cam = GL_Camera_Vals()
         cam = self.output.cam
@@ -79,6 +83,25 @@ class GL_Simulator(PipelineModule):
         if queues:
             self.main()
 
+
+    def init_offscreen(self, shape):
+        """ 
+        Creates an OSMesa (software) rendering context that draws into an
+        image buffer of the given shape, rather than into a window. Requires
+        PyOpenGL's osmesa platform, which main.py selects for --headless.
+
+        """
+
+        from OpenGL import osmesa, arrays
+        iph, ipw = shape
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        self.offscreen = arrays.GLubyteArray.zeros((iph, ipw, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.offscreen,
+                GL_UNSIGNED_BYTE, ipw, iph):
+            self.logger.error('could not create offscreen rendering context')
+            sys.exit(1)
+        self.logger.info('rendering offscreen (%dx%d)' % (ipw, iph))
+
     
     def resize_window(self, w, h):
         """ 
@@ -89,6 +112,8 @@ class GL_Simulator(PipelineModule):
         """
 
         cam = self.output.cam
+        if (h, w) != self.ring.shape:
+            self.logger.warning('window size differs from frame ring slots')
         cam.ipw = w
         if h == 0:
             cam.iph = 1
@@ -105,70 +130,124 @@ class GL_Simulator(PipelineModule):
         self.logger.info('window resized to %dx%d'%(w,h))
 
 
-    def dispatch_to_pipe(self):
+    def dispatch_to_pipe(self, slot_nr):
         """ 
-        Sends image from current buffer and corresponding marker pose(s) to
-        pipeline over message queue.
+        Writes the greyscale image from the current buffer into the given slot
+        of the frame ring, and sends the slot number and the corresponding
+        marker pose(s) to the pipeline over the message queue. The greyscale
+        conversion is the one PIL applies for its "L" mode (ITU-R 601-2 luma,
+        in 16 bit fixed point, truncated), bit for bit.
         
         """
 
-        cam = self.output.cam
-        data = glReadPixels(0, 0, cam.ipw, cam.iph, GL_RGBA, GL_UNSIGNED_BYTE)
-        image_dims = (cam.ipw, cam.iph)
-        frame = Image.frombuffer("RGBA", image_dims, data, "raw", "RGBA",0,0).convert("L")
-        np_img = np.array(frame)
-        self.q2pipe.put_nowait(('simulglob', np_img, self.output))
+        iph, ipw = self.ring.shape
+        if self.headless:
+            glFinish()
+            rgba = np.asarray(self.offscreen, dtype = np.uint8)
+        else:
+            data = glReadPixels(0, 0, ipw, iph, GL_RGBA, GL_UNSIGNED_BYTE)
+            rgba = np.frombuffer(data, dtype = np.uint8).reshape((iph, ipw, 4))
+        luma = rgba[:,:,0].astype(np.uint32) * 19595
+        luma += rgba[:,:,1].astype(np.uint32) * 38470
+        luma += rgba[:,:,2].astype(np.uint32) * 7471
+        luma >>= 16
+        self.ring.frame(slot_nr)[:] = luma
+        self.send_to_pipe(slot_nr)
+
+
+    def send_to_pipe(self, slot_nr):
+        """ 
+        Sends the number of the slot holding the current image, and the
+        corresponding (packed) marker pose(s) and pose index, to the pipeline.
+
+        """
+
+        config_ids, poses = self.ring.pack_markers(self.markers)
+        message = ('simulslot', slot_nr, self.output.start_time, config_ids, poses,
+                self.output.pose_index)
+        self.q2pipe.put_nowait(message)
 
 
     def refresh_output(self):
         """ 
-        Replaces output with a copy that is reset to avoid overlap with the
-        object in q2pipe.
+        Resets the output for the next image. Only packed copies of its values
+        (and of the markers' poses) are sent to the pipeline, so the object
+        itself can be reused.
         
         """
 
-        self.output = copy.deepcopy(self.output)
         self.output.reset_markers_and_time()
 
 
-    def draw(self):
+    def check_messages(self):
         """ 
-        Called from within OpenGL. Refreshes data and settings as necessary;
-        obtains new marker poses from generator; exits the simulator and
-        pipeline if the generators are done; calls all the markers' draw
-        functions; and calls the function to send image and pose data to the
-        pipeline. The buffers are then swapped for the next image to be drawn.
+        Handles any message from the pipeline. Returns False if the simulator
+        was told to stop.
 
         """
 
-        self.refresh_output()
-        self.markers = []
         if not self.q2sim.empty():
             incoming = self.q2sim.get()
             if 'stop' in incoming:
                 time.sleep(0.5)
                 self.stop()
+                return False
             elif 'newoutput' in incoming:
                 self.output = incoming[1]
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glClearColor(0.5, 0.5, 0.5, 0.5)
+        return True
+
+
+    def next_markers(self):
+        """ 
+        Obtains the next marker poses from the pose generator, if any. Returns
+        False, and stops the simulator, once the generator is complete.
+
+        """
 
         if self.options.simulate < 0:
             markers = self.pose_generator.generate()
             if not markers:
                 self.logger.info('generator complete')
                 self.stop()
-                return
+                return False
             elif not isinstance(markers, list):
-                self.output.markers = [markers]
+                self.markers = [markers]
             else:
-                self.output.markers = markers
+                self.markers = markers
+            self.output.pose_index = getattr(self.pose_generator, 'pose_index', None)
+        return True
+
 
-        for marker in self.output.markers:
+    def draw(self):
+        """ 
+        Called from within OpenGL. Refreshes data and settings as necessary;
+        obtains new marker poses from generator; exits the simulator and
+        pipeline if the generators are done; calls all the markers' draw
+        functions; and calls the function to send image and pose data to the
+        pipeline. The buffers are then swapped for the next image to be drawn
+        (unless rendering offscreen, which is single-buffered).
+
+        """
+
+        self.refresh_output()
+        if not self.check_messages():
+            return
+        slot_nr = self.ring.acquire()
+        if slot_nr is None:
+            return
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glClearColor(0.5, 0.5, 0.5, 0.5)
+
+        if not self.next_markers():
+            self.ring.release(slot_nr)
+            return
+
+        for marker in self.markers:
             marker.draw(self.textures)
 
-        self.dispatch_to_pipe()
-        glutSwapBuffers()
+        self.dispatch_to_pipe(slot_nr)
+        if not self.headless:
+            glutSwapBuffers()
 
 
     def key_press(self, *args):
@@ -185,53 +264,74 @@ class GL_Simulator(PipelineModule):
         self.q2pipe.put_nowait('stop')
         self.logger.info('poisoning pipeline for good measure')
         time.sleep(0.05)
-        glutDestroyWindow(window)
-        glutLeaveMainLoop()
+        self.running = False
+        if not self.headless:
+            glutDestroyWindow(window)
+            glutLeaveMainLoop()
         self.logger.info('exiting')
 
 
-    def main(self):
-        """
-        This function refers to the command line options, and: performs more
-        initialisation for the OpenGL machine; displays a simulation window;
-        initialises the required pose generator; initialises the markers and
-        sets the corresponding textures; and calls OpenGL's main loop.
-        
-        """
+    def init_markers(self):
+        """ 
+        Initialises the pose generator required by the simulate option, or
+        else the preset marker of the given index.
 
-        global window
-        glutInit()
-        glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_ALPHA | GLUT_DEPTH)
-        glutInitWindowSize(self.output.cam.ipw, self.output.cam.iph)
-        glutInitWindowPosition(50,50)
-        window = glutCreateWindow('simulator')
-        glutIdleFunc(self.draw)
-        glutReshapeFunc(self.resize_window)
-        glutKeyboardFunc(self.key_press)
-        print 'press \'q\' to exit simulator'
-        glutDisplayFunc(self.draw)
+        """
 
         markers = []
         self.textures = {}
         if self.options.simulate == -1:
-            self.pose_generator = Random_Pose_Generator(self.output)
+            self.pose_generator = Random_Pose_Generator(self.output,
+                    seed = getattr(self.options, 'seed', None))
         elif self.options.simulate == -2:
             self.pose_generator = Linear_Pose_Generator(self.output)
+        elif self.options.simulate == -3:
+            first, stop = getattr(self.options, 'range', None) or (0, None)
+            self.pose_generator = File_Pose_Generator(self.output,
+                    filename = self.options.poses, first = first, stop = stop)
+            self.logger.info('streaming poses %d:%d of %s' % (self.pose_generator.first,
+                self.pose_generator.stop, self.options.poses))
         else:
-            if (self.options.simulate == -1) or (self.options.simulate == -2):
-                self.logger.error('incompatible simulation options')
-                self.stop()
             index = self.options.simulate
-            marker = GL_Marker(config_id = index, cam = self.output.cam)
-            markers.append(marker)
-            texture, texture_id = markers[-1].load_texture()
-            self.textures[texture_id] = texture
-        if self.options.simulate == -1 or self.options.simulate == -2:
-            texture, texture_id = self.pose_generator.init_marker.load_texture()
-            self.textures[texture_id] = texture
-        self.output.markers = markers
-
-        glutMainLoop()
+            markers.append(GL_Marker(config_id = index, cam = self.output.cam))
+        self.markers = markers
+
+
+    def main(self):
+        """
+        This function refers to the command line options, and: performs more
+        initialisation for the OpenGL machine; displays a simulation window
+        (unless rendering offscreen); initialises the required pose generator;
+        initialises the markers and sets the corresponding textures; and calls
+        OpenGL's main loop, or, offscreen, draws images until stopped.
+        
+        """
+
+        global window
+        if not self.headless:
+            glutInit()
+            glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_ALPHA | GLUT_DEPTH)
+            glutInitWindowSize(self.output.cam.ipw, self.output.cam.iph)
+            glutInitWindowPosition(50,50)
+            window = glutCreateWindow('simulator')
+            glutIdleFunc(self.draw)
+            glutReshapeFunc(self.resize_window)
+            glutKeyboardFunc(self.key_press)
+            print 'press \'q\' to exit simulator'
+            glutDisplayFunc(self.draw)
+
+        self.init_markers()
+        for marker in self.markers + [getattr(self.pose_generator,
+                'init_marker', None)]:
+            if marker is not None:
+                texture, texture_id = marker.load_texture()
+                self.textures[texture_id] = texture
+
+        if self.headless:
+            while self.running:
+                self.draw()
+        else:
+            glutMainLoop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+#
+# Milovision: A camera pose estimation programme
+#
+# Copyright (C) 2013 Joris Stork
+# See LICENSE.txt
+#
+# sweep.py
+"""
+:synopsis:  Contains the Sweep class, which runs batch accuracy studies: it
+            generates a table of marker poses, renders and processes them in
+            chunks in a pool of worker processes, and merges the results into
+            one table.
+
+.. moduleauthor:: Joris Stork <joris@wintermute.eu>
+
+"""
+
+# standard and third party libraries
+import numpy as np
+import os
+import copy
+import glob
+import pickle
+import time
+import multiprocessing
+import logging
+
+# milovision libraries
+from pipeline_pool import Pipeline_Worker
+from simulator import Marker_Renderer
+from simulator.frame_ring import Marker_Packer
+from simulator.pose_generator import Linear_Pose_Generator, Random_Pose_Generator
+from output import Pipeline_Output, Output_Stats
+from output.recorder import get_columns, fill_record
+from camera_values import GL_Camera_Vals
+
+
+def get_sweep_dtype(max_estimates = 8):
+    """ returns the dtype of the result table, one record per pose """
+
+    columns = get_columns(max_estimates)
+    return np.dtype([(name, dtype, shape) for name, dtype, shape in columns])
+
+
+# the state of a sweep worker process, set up once by init_sweep_worker
+_state = {}
+
+
+def init_sweep_worker(options, path, max_estimates):
+    """
+    Worker process initialiser. Sets up the renderer and the pipeline modules,
+    and maps the pose table.
+
+    """
+
+    cam = GL_Camera_Vals()
+    _state['poses'] = np.load(os.path.join(path, 'poses.npy'), mmap_mode = 'r')
+    _state['config_ids'] = np.load(os.path.join(path, 'config_ids.npy'))
+    init_output = Pipeline_Output(sim = True)
+    init_output.cam = cam
+    init_output.set_poses(_state['config_ids'][:1])
+    _state['cam'] = cam
+    _state['path'] = path
+    _state['max_estimates'] = max_estimates
+    _state['worker'] = Pipeline_Worker(options = options, init_output = init_output,
+            index = os.getpid())
+    _state['renderer'] = Marker_Renderer(cam)
+    _state['packer'] = Marker_Packer()
+    _state['image'] = np.empty((cam.iph, cam.ipw), dtype = np.uint8)
+
+
+def run_sweep_chunk(chunk):
+    """
+    Renders and processes the poses of the given (chunk nr, first, last + 1)
+    chunk, and saves the results to the chunk's file and the chunk's
+    accumulated stats (Output_Stats) next to it. The results file is renamed
+    into place last, so that an interrupted chunk is run again on resume.
+
+    """
+
+    chunk_nr, first, stop = chunk
+    cam = _state['cam']
+    worker = _state['worker']
+    image = _state['image']
+    table = np.zeros(stop - first, dtype = get_sweep_dtype(_state['max_estimates']))
+    worker.stats = Output_Stats()
+    for row, index in enumerate(xrange(first, stop)):
+        output = Pipeline_Output(sim = True)
+        output.cam = cam
+        output.pose_index = index
+        markers = _state['packer'].unpack_markers(
+                _state['config_ids'][index:index+1],
+                np.array(_state['poses'][index:index+1]), cam)
+        output.markers = markers
+        _state['renderer'].render(markers, out = image)
+        output = worker.process(image, output)
+        fill_record(table, row, output, _state['max_estimates'])
+    filename = os.path.join(_state['path'], 'chunk_%06d.npy' % chunk_nr)
+    partial = os.path.join(_state['path'], 'partial_%06d.npy' % chunk_nr)
+    worker.stats.save(os.path.join(_state['path'], 'chunk_%06d.stats' % chunk_nr))
+    np.save(partial, table)
+    os.rename(partial, filename)
+    return chunk_nr, stop - first
+
+
+class Sweep(object):
+    """
+    Runs the pipeline modules up to PoseEstimatorA on nr_poses generated
+    poses (linear with -s -2, random otherwise), with the renderer of the
+    numpy simulator. The poses are generated once per seed and stored
+    with the results, in chunks of chunk_size poses, in the sweep directory,
+    so that a sweep is deterministic and, if interrupted, resumes with the
+    chunks that have no results yet. Each chunk is independent of the others,
+    so throughput scales with the number of workers.
+
+    """
+
+    def __init__(self, options = None, path = 'output/sweep', nr_poses = 1000,
+            seed = 0, chunk_size = 100, nr_workers = None, max_estimates = 8):
+        """ sets the sweep parameters; nr_workers defaults to the nr of cpus """
+
+        self.logger = logging.getLogger('Sweep')
+        self.options = copy.copy(options)
+        self.path = path
+        self.nr_poses = nr_poses
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.nr_workers = nr_workers or multiprocessing.cpu_count()
+        self.max_estimates = max_estimates
+        if options.simulate == -2:
+            self.generator = 'linear'
+        else:
+            self.generator = 'random'
+        # the workers treat the rendered poses as simulated images and run
+        # all of ContourFinder, EllipseFitter and PoseEstimatorA on them
+        self.options.simulate = -2 if self.generator == 'linear' else -1
+        if options.nr_modules != 3:
+            self.logger.info('running the 3 pipeline modules up to pose estimation')
+        self.options.nr_modules = 3
+        # each pose is an image of its own: there is no previous image to
+        # track a region from
+        self.options.track = 0
+
+
+    def get_meta(self):
+        """ 
+        Returns the parameters that the stored poses and results depend on,
+        including the options of the modules that change the results
+        (--pyramid, --prefilter), and the layout of the results, which changes
+        between versions.
+
+        """
+
+        return {
+                'dtype': get_sweep_dtype(self.max_estimates).descr,
+                'nr_poses': self.nr_poses,
+                'seed': self.seed,
+                'generator': self.generator,
+                'chunk_size': self.chunk_size,
+                'nr_modules': self.options.nr_modules,
+                'max_estimates': self.max_estimates,
+                'pyramid': max(getattr(self.options, 'pyramid', None) or 1, 1),
+                'prefilter': bool(getattr(self.options, 'prefilter', None)),
+                }
+
+
+    def generate_poses(self):
+        """
+        Generates the poses with the seeded pose generator, and saves them as
+        a pose table (packed as by Marker_Packer) and their config ids.
+
+        """
+
+        output = Pipeline_Output(sim = True)
+        output.cam = GL_Camera_Vals()
+        if self.generator == 'linear':
+            generator = Linear_Pose_Generator(output)
+            markers = []
+            for i in xrange(self.nr_poses):
+                marker = generator.generate()
+                if marker is None:
+                    break
+                markers.append(marker)
+            if len(markers) < self.nr_poses:
+                self.logger.warning('generator complete after %d poses' % len(markers))
+                self.nr_poses = len(markers)
+            config_ids, poses = Marker_Packer().pack_markers(markers)
+        else:
+            generator = Random_Pose_Generator(output, seed = self.seed)
+            Cs, Ns, vertices = generator.generate_poses(self.nr_poses)
+            poses = np.hstack((Cs, Ns, vertices.reshape((self.nr_poses, 12))))
+            config_ids = [generator.init_marker.config_id] * self.nr_poses
+        np.save(os.path.join(self.path, 'poses.npy'), poses)
+        np.save(os.path.join(self.path, 'config_ids.npy'), np.array(config_ids))
+
+
+    def prepare(self):
+        """
+        Reuses the poses and results in the sweep directory if they were
+        produced with the same parameters and result layout; otherwise clears
+        them and generates new poses. Returns the chunks that have no results
+        yet.
+
+        """
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        meta_file = os.path.join(self.path, 'meta.pickle')
+        meta = None
+        if os.path.exists(meta_file):
+            meta = pickle.load(open(meta_file, 'rb'))
+        if meta and meta['requested'] == self.get_meta():
+            self.nr_poses = meta['nr_poses']
+            self.logger.info('resuming sweep in %s' % self.path)
+        else:
+            if meta:
+                self.logger.info('sweep in %s has other parameters or an older '
+                        'result layout; starting over' % self.path)
+            for pattern in 'chunk_*.npy', 'chunk_*.stats', 'partial_*.npy':
+                for filename in glob.glob(os.path.join(self.path, pattern)):
+                    os.remove(filename)
+            requested = self.get_meta()
+            self.generate_poses()
+            pickle.dump({'requested': requested, 'nr_poses': self.nr_poses},
+                    open(meta_file, 'wb'))
+
+        chunks = []
+        for chunk_nr, first in enumerate(xrange(0, self.nr_poses, self.chunk_size)):
+            filename = os.path.join(self.path, 'chunk_%06d.npy' % chunk_nr)
+            if not os.path.exists(filename):
+                stop = min(first + self.chunk_size, self.nr_poses)
+                chunks.append((chunk_nr, first, stop))
+        return chunks
+
+
+    def run(self):
+        """ runs the remaining chunks in the pool, then merges the results """
+
+        chunks = self.prepare()
+        nr_chunks = (self.nr_poses + self.chunk_size - 1) // self.chunk_size
+        self.logger.info('%d of %d chunks to run with %d workers' % (len(chunks),
+            nr_chunks, self.nr_workers))
+        if chunks:
+            start = time.time()
+            done = 0
+            pool = multiprocessing.Pool(self.nr_workers, init_sweep_worker,
+                    (self.options, self.path, self.max_estimates))
+            try:
+                for chunk_nr, nr_poses in pool.imap_unordered(run_sweep_chunk, chunks):
+                    done += nr_poses
+                    duration = time.time() - start
+                    msg = 'chunk %d done: %d poses in %.1f s (%.1f poses/s)'
+                    self.logger.info(msg % (chunk_nr, done, duration, done / duration))
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                self.logger.info('sweep interrupted; run again to resume')
+                raise
+            finally:
+                pool.join()
+        return self.merge()
+
+
+    def merge(self):
+        """
+        Concatenates the chunk results in pose order into one table, saved as
+        results.npy in the sweep directory, and returns it. Merges the chunks'
+        stats into stats.pickle in the sweep directory.
+
+        """
+
+        filenames = sorted(glob.glob(os.path.join(self.path, 'chunk_*.npy')))
+        if filenames:
+            table = np.concatenate([np.load(filename) for filename in filenames])
+        else:
+            table = np.zeros(0, dtype = get_sweep_dtype(self.max_estimates))
+        np.save(os.path.join(self.path, 'results.npy'), table)
+        stats = Output_Stats()
+        for filename in filenames:
+            stats.merge(Output_Stats.load(filename[:-len('.npy')] + '.stats'))
+        stats.save(os.path.join(self.path, 'stats.pickle'))
+        found = np.count_nonzero(table['nr_estimates'])
+        msg = '%d results (%d with estimates) written to %s'
+        self.logger.info(msg % (len(table), found, os.path.join(self.path, 'results.npy')))
+        return table